@@ -0,0 +1,556 @@
+# encoding: UTF-8
+#
+# PhotoFilmStrip - Creates movies out of your pictures.
+#
+# Copyright (C) 2017 Jens Goepfert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+'''
+Compares frames of reference projects with stored golden frames, so a
+faster render path can be checked for changes of the output. The golden
+frames are rendered by a checkout of a baseline revision, so changes without
+an optimisation toggle are checked too:
+
+    python -m benchmark.GoldenFrames --golden golden --baseline REV
+    python -m benchmark.GoldenFrames --golden golden
+
+The current tree renders the frames with all optimisations disabled, then
+each optimisation toggle is enabled on its own and all together. For each
+configuration the speedup compared to the render without optimisations and
+the PSNR and SSIM of the frames are reported. Lossy optimisations like the
+draft mode are reported but not checked. The exit code is 1 if the default
+configuration does not reach the thresholds.
+'''
+
+import collections
+import json
+import logging
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+from optparse import OptionParser
+
+from PIL import Image, ImageChops, ImageMath, ImageStat
+
+from photofilmstrip.action.ActionI18N import ActionI18N
+from photofilmstrip.core.DecodedImageCache import DecodedImageCache
+from photofilmstrip.core import Transitions
+from photofilmstrip.core.OutputProfile import GetOutputProfiles
+from photofilmstrip.core.PILBackend import ImagePyramid
+from photofilmstrip.core.Picture import Picture
+from photofilmstrip.core.ProjectFile import ProjectFile
+from photofilmstrip.core.RenderEngine import RenderEngine, \
+    RenderEngineSlideshow, RenderEngineTimelapse, ComputePath
+from photofilmstrip.core.tasks import TaskImaging, TaskLoadPic
+from photofilmstrip.lib.DestructionManager import DestructionManager
+
+from benchmark.SyntheticProject import CreateProject
+
+
+class Toggle(object):
+    '''
+    An optimisation that can be switched off to render the reference.
+    '''
+
+    def __init__(self, name, description, default=True, lossy=False):
+        '''
+        :param name: the name used on the command line and in the report
+        :param description: a short description
+        :param default: if the optimisation is enabled in a normal render
+        :param lossy: if the optimisation lowers the quality by design, its
+                      frames are not checked against the thresholds
+        '''
+        self.name = name
+        self.description = description
+        self.default = default
+        self.lossy = lossy
+
+    def Set(self, enabled):
+        raise NotImplementedError()
+
+
+class AttributeToggle(Toggle):
+    '''
+    An optimisation that is switched by a class attribute.
+    '''
+
+    def __init__(self, name, description, obj, attr, offValue,
+                 default=True):
+        Toggle.__init__(self, name, description, default)
+        self.obj = obj
+        self.attr = attr
+        self.onValue = getattr(obj, attr)
+        self.offValue = offValue
+
+    def Set(self, enabled):
+        setattr(self.obj, self.attr,
+                self.onValue if enabled else self.offValue)
+
+
+class DraftToggle(Toggle):
+    '''
+    The draft mode of the render engine, not enabled by default.
+    '''
+
+    def __init__(self):
+        Toggle.__init__(self, "draft", "draft mode of the render engine",
+                        default=False, lossy=True)
+        self.enabled = False
+
+    def Set(self, enabled):
+        self.enabled = enabled
+
+
+class TransitionToggle(Toggle):
+    '''
+    Optimised transitions that are replaced by reference transitions.
+    '''
+
+    def __init__(self, name, description, references):
+        '''
+        :param references: a dictionary of the transition kinds and the
+                           reference Transitions
+        '''
+        Toggle.__init__(self, name, description)
+        self.references = references
+        self.optimised = dict((kind, Transitions.GetTransition(kind))
+                              for kind in references)
+
+    def Set(self, enabled):
+        transitions = self.optimised if enabled else self.references
+        for kind, transition in transitions.items():
+            Transitions.RegisterTransition(kind, transition)
+
+
+class _BlendTransition(Transitions.Transition):
+    '''
+    The fade as it was rendered before the compositors.
+    '''
+
+    def Composite(self, frame1, frame2, percentage):
+        return Image.blend(frame1, frame2, percentage)
+
+
+class _CropPasteRollTransition(Transitions.Transition):
+    '''
+    The roll as it was rendered before the compositors, from two complete
+    frames.
+    '''
+
+    def Composite(self, frame1, frame2, percentage):
+        xsize, ysize = frame1.size
+        delta = int(xsize * percentage)
+        part1 = frame2.crop((0, 0, delta, ysize))
+        part2 = frame1.crop((delta, 0, xsize, ysize))
+        frame = frame2.copy()
+        frame.paste(part2, (0, 0, xsize - delta, ysize))
+        frame.paste(part1, (xsize - delta, 0, xsize, ysize))
+        return frame
+
+
+DRAFT = DraftToggle()
+
+TOGGLES = [
+    AttributeToggle("static-reuse",
+                    "motionless frames are rendered once",
+                    RenderEngine, "STATIC_TOLERANCE", 0),
+    AttributeToggle("reduced-decode",
+                    "JPEG files are decoded at a reduced scale",
+                    TaskLoadPic, "REDUCED_DECODE", False),
+    AttributeToggle("pyramid",
+                    "frames are resized from halved copies of the picture",
+                    ImagePyramid, "BUILD_LEVELS", False),
+    AttributeToggle("numpy-path",
+                    "motion paths are computed with numpy",
+                    ComputePath, "USE_NUMPY", False,
+                    default=ComputePath.USE_NUMPY),
+    DRAFT,
+]
+
+
+def RegisterToggle(toggle):
+    '''
+    Adds the toggle of another optimisation to the harness.
+    '''
+    TOGGLES.append(toggle)
+
+
+RegisterToggle(TransitionToggle(
+    "compositor",
+    "transitions are composited in place from the visible parts",
+    {Picture.TRANS_FADE: _BlendTransition(),
+     Picture.TRANS_ROLL: _CropPasteRollTransition()}))
+
+
+class _LocalContext(object):
+    '''
+    Processes the subtasks of a task in the current thread. The last
+    results are kept, so a picture is not loaded again for each frame.
+    '''
+
+    def __init__(self, size=4):
+        self.__results = collections.OrderedDict()
+        self.__size = size
+
+    def ProcessSubTask(self, task, isSubTask=True):  # pylint: disable=unused-argument
+        key = task.GetKey()
+        if key in self.__results:
+            result = self.__results.pop(key)
+        else:
+            result = task.Run(self)
+        self.__results[key] = result
+        while len(self.__results) > self.__size:
+            self.__results.popitem(last=False)
+        return result
+
+
+def _CreateEngine(project, profile):
+    if project.GetTimelapse():
+        return RenderEngineTimelapse(None, profile, project.GetPictures(),
+                                     DRAFT.enabled)
+    totalLength = project.GetDuration(False)
+    if totalLength == -1:
+        totalLength = None
+    return RenderEngineSlideshow(None, profile, project.GetPictures(),
+                                 DRAFT.enabled, totalLength)
+
+
+def _IterFrameTasks(project, profile):
+    '''
+    Yields the tasks that produce frames with the index of their first
+    frame.
+    '''
+    idxFrame = 0
+    for task in _CreateEngine(project, profile).GetTasks():
+        if not isinstance(task, TaskImaging):
+            continue
+        yield idxFrame, task
+        idxFrame += task.GetFrameCount()
+
+
+def RenderFrames(project, profile, frameIndices):
+    '''
+    Renders only the frames with the given indices.
+    Returns a dictionary of the indices and the PIL images and the time it
+    took to render them.
+    '''
+    DecodedImageCache().Clear()
+    wanted = sorted(set(frameIndices))
+    frames = {}
+    ctx = _LocalContext()
+    startTime = time.time()
+    for idxFrame, task in _IterFrameTasks(project, profile):
+        if idxFrame > wanted[-1]:
+            break
+        hits = [idx for idx in wanted
+                if idxFrame <= idx < idxFrame + task.GetFrameCount()]
+        if hits:
+            img = task.Run(ctx)
+            for idx in hits:
+                frames[idx] = img
+    return frames, time.time() - startTime
+
+
+def Psnr(img1, img2):
+    '''
+    Returns the peak signal-to-noise ratio of two images in dB, None if
+    the images are equal.
+    '''
+    diff = ImageChops.difference(img1.convert("RGB"), img2.convert("RGB"))
+    stat = ImageStat.Stat(diff)
+    mse = sum(stat.sum2) / float(diff.size[0] * diff.size[1] * 3)
+    if mse == 0:
+        return None
+    return 10 * math.log10(255 ** 2 / mse)
+
+
+def Ssim(img1, img2, blockSize=8):
+    '''
+    Returns the mean structural similarity of the luminance of two images,
+    computed on blocks of blockSize pixels.
+    '''
+    img1 = img1.convert("L").convert("F")
+    img2 = img2.convert("L").convert("F")
+    size = (max(1, img1.size[0] // blockSize),
+            max(1, img1.size[1] // blockSize))
+
+    def _Mean(img):
+        return img.resize(size, Image.BOX)
+
+    mu1 = _Mean(img1)
+    mu2 = _Mean(img2)
+    sq1 = _Mean(ImageMath.eval("a * a", a=img1))
+    sq2 = _Mean(ImageMath.eval("a * a", a=img2))
+    prod = _Mean(ImageMath.eval("a * b", a=img1, b=img2))
+    ssimMap = ImageMath.eval(
+        "((2 * m1 * m2 + c1) * (2 * (p - m1 * m2) + c2)) / "
+        "((m1 * m1 + m2 * m2 + c1) * "
+        "(s1 - m1 * m1 + s2 - m2 * m2 + c2))",
+        m1=mu1, m2=mu2, s1=sq1, s2=sq2, p=prod,
+        c1=(0.01 * 255) ** 2, c2=(0.03 * 255) ** 2)
+    # ImageStat works on a histogram of 256 bins, so the mean of the float
+    # image is computed by resizing it to a single pixel
+    return ssimMap.resize((1, 1), Image.BOX).getpixel((0, 0))
+
+
+def _SetToggles(enabledNames):
+    for toggle in TOGGLES:
+        toggle.Set(toggle.name in enabledNames)
+
+
+def CreateReferenceProjects(directory, megapixels):
+    '''
+    Creates the synthetic projects that cover the motions, transitions,
+    effects and the timelapse mode.
+    '''
+    return [CreateProject(directory, 4, megapixels, "mixed", "fade"),
+            CreateProject(directory, 3, megapixels, "zoom", "roll", "sepia"),
+            CreateProject(directory, 3, megapixels, "pan", "none", "bw"),
+            CreateProject(directory, 9, megapixels, "zoom", "fade",
+                          timelapse=True, duration=2)]
+
+
+def _GetGoldenDir(goldenDir, prjFilename):
+    return os.path.join(goldenDir,
+                        os.path.splitext(os.path.basename(prjFilename))[0])
+
+
+def _GetRepository():
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def ResolveRevision(revision):
+    '''
+    Returns the commit id of a git revision.
+    '''
+    return subprocess.check_output(
+        ["git", "rev-parse", "--verify", revision + "^{commit}"],
+        cwd=_GetRepository()).strip()
+
+
+def CheckoutRevision(commit, directory):
+    '''
+    Extracts the tree of a commit into directory.
+    '''
+    proc = subprocess.Popen(["git", "archive", "--format=tar", commit],
+                            cwd=_GetRepository(), stdout=subprocess.PIPE)
+    try:
+        with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+            tar.extractall(directory)
+    finally:
+        if proc.wait() != 0:
+            raise RuntimeError("cannot checkout %s" % commit)
+
+
+def GetGoldenRevision(goldenDir, prjFilename):
+    '''
+    Returns the commit id the golden frames of a project were rendered with,
+    None if there are no golden frames.
+    '''
+    filename = os.path.join(_GetGoldenDir(goldenDir, prjFilename),
+                            "golden.json")
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, "r") as fd:
+        return json.load(fd).get("baseline")
+
+
+def UpdateGolden(goldenDir, prjFilename, profile, frameCount,
+                 checkout, commit):
+    '''
+    Renders the golden frames of a project with the renderer of a baseline
+    revision.
+    :param checkout: the directory the baseline revision is extracted to
+    :param commit: the commit id of the baseline revision
+    '''
+    prjGoldenDir = _GetGoldenDir(goldenDir, prjFilename)
+    if os.path.isdir(prjGoldenDir):
+        shutil.rmtree(prjGoldenDir)
+    os.makedirs(prjGoldenDir)
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = checkout
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "ReferenceRender.py")
+    subprocess.check_call([sys.executable, script,
+                           os.path.abspath(prjFilename),
+                           profile.GetName().encode("utf-8"),
+                           str(frameCount), prjGoldenDir],
+                          env=env)
+
+    filename = os.path.join(prjGoldenDir, "golden.json")
+    with open(filename, "r") as fd:
+        meta = json.load(fd)
+    meta["baseline"] = commit
+    with open(filename, "w") as fd:
+        json.dump(meta, fd, indent=2)
+
+
+def CheckProject(goldenDir, prjFilename, project, profiles):
+    '''
+    Renders the golden frame indices of a project with each configuration.
+    Returns a list of (configuration name, speedup, min PSNR, min SSIM,
+    lossy).
+    '''
+    prjGoldenDir = _GetGoldenDir(goldenDir, prjFilename)
+    with open(os.path.join(prjGoldenDir, "golden.json"), "r") as fd:
+        meta = json.load(fd)
+    profile = profiles[meta["profile"]]
+    golden = dict((idx, Image.open(os.path.join(prjGoldenDir,
+                                                "frame-%05d.png" % idx)))
+                  for idx in meta["frames"])
+
+    # the reference time is measured again on this machine
+    _SetToggles([])
+    __, refTime = RenderFrames(project, profile, meta["frames"])
+
+    configs = [(toggle.name, [toggle.name], toggle.lossy)
+               for toggle in TOGGLES]
+    configs.append(("default", [toggle.name for toggle in TOGGLES
+                                if toggle.default], False))
+
+    result = []
+    for configName, enabledNames, lossy in configs:
+        _SetToggles(enabledNames)
+        frames, renderTime = RenderFrames(project, profile, meta["frames"])
+        psnrs = [Psnr(frames[idx], golden[idx]) for idx in meta["frames"]]
+        psnrs = [value for value in psnrs if value is not None]
+        ssims = [Ssim(frames[idx], golden[idx]) for idx in meta["frames"]]
+        result.append((configName,
+                       refTime / renderTime if renderTime > 0 else 0.0,
+                       min(psnrs) if psnrs else None,
+                       min(ssims),
+                       lossy))
+    _SetToggles([toggle.name for toggle in TOGGLES if toggle.default])
+    return result
+
+
+def main():
+    parser = OptionParser(prog="python -m benchmark.GoldenFrames")
+    parser.add_option("--golden", metavar="DIR", default="golden",
+                      help="directory of the golden frames "
+                      "[default: %default]")
+    parser.add_option("--baseline", metavar="REV",
+                      help="git revision that renders the golden frames, "
+                      "they are rendered again if they are missing or "
+                      "were rendered by another revision")
+    parser.add_option("--update", action="store_true", default=False,
+                      help="render the golden frames again")
+    parser.add_option("--project", action="append", default=[],
+                      help="a reference project, can be repeated "
+                      "[default: synthetic projects]")
+    parser.add_option("--workdir",
+                      help="directory of the synthetic projects")
+    parser.add_option("--megapixels", type="float", default=4.0,
+                      help="size of the synthetic pictures "
+                      "[default: %default]")
+    parser.add_option("--profile", default="HD 720p@25.00 fps",
+                      help="output profile of new golden frames "
+                      "[default: %default]")
+    parser.add_option("--frames", type="int", default=8,
+                      help="number of golden frames per project "
+                      "[default: %default]")
+    parser.add_option("--min-psnr", type="float", default=35.0,
+                      dest="minPsnr",
+                      help="minimal PSNR in dB [default: %default]")
+    parser.add_option("--min-ssim", type="float", default=0.97,
+                      dest="minSsim",
+                      help="minimal SSIM [default: %default]")
+    options = parser.parse_args()[0]
+
+    logging.basicConfig(level=logging.WARNING)
+    ActionI18N().Execute()
+
+    profiles = dict((prof.GetName(), prof) for prof in GetOutputProfiles())
+    if options.profile not in profiles:
+        parser.error("unknown profile %s, use one of: %s" % (
+            options.profile, ", ".join(sorted(profiles))))
+
+    commit = None
+    if options.baseline:
+        try:
+            commit = ResolveRevision(options.baseline)
+        except (OSError, subprocess.CalledProcessError):
+            parser.error("unknown revision %s" % options.baseline)
+
+    # loading a project starts the threads of the image cache, they are
+    # stopped by the DestructionManager
+    DestructionManager()
+    workdir = options.workdir or tempfile.mkdtemp(prefix="pfs-golden-")
+    checkout = None
+    try:
+        prjFilenames = options.project or \
+            CreateReferenceProjects(workdir, options.megapixels)
+
+        failed = False
+        for prjFilename in prjFilenames:
+            prjFile = ProjectFile(filename=prjFilename)
+            if not prjFile.Load():
+                parser.error("cannot load project %s" % prjFilename)
+            project = prjFile.GetProject()
+
+            goldenRevision = GetGoldenRevision(options.golden, prjFilename)
+            if options.update or goldenRevision is None or \
+                    (commit is not None and goldenRevision != commit):
+                if commit is None:
+                    parser.error("the golden frames of %s are rendered by "
+                                 "a baseline revision, use --baseline REV"
+                                 % prjFilename)
+                if checkout is None:
+                    checkout = tempfile.mkdtemp(prefix="pfs-baseline-")
+                    CheckoutRevision(commit, checkout)
+                UpdateGolden(options.golden, prjFilename,
+                             profiles[options.profile], options.frames,
+                             checkout, commit)
+                goldenRevision = commit
+
+            print u"%s (golden frames of %s)" % (
+                os.path.basename(prjFilename), goldenRevision[:12])
+            print u"  %-16s %8s %10s %8s" % ("configuration", "speedup",
+                                            "PSNR dB", "SSIM")
+            for configName, speedup, psnr, ssim, lossy in CheckProject(
+                    options.golden, prjFilename, project, profiles):
+                ok = (psnr is None or psnr >= options.minPsnr) and \
+                    ssim >= options.minSsim
+                if configName == "default" and not ok:
+                    failed = True
+                if lossy:
+                    status = "lossy, not checked"
+                else:
+                    status = "" if ok else "BELOW THRESHOLD"
+                print u"  %-16s %7.2fx %10s %8.4f %s" % (
+                    configName, speedup,
+                    "equal" if psnr is None else "%.2f" % psnr,
+                    ssim, status)
+    finally:
+        DestructionManager().Destroy()
+        if not options.workdir:
+            shutil.rmtree(workdir, True)
+        if checkout is not None:
+            shutil.rmtree(checkout, True)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+# encoding: UTF-8
+#
+# PhotoFilmStrip - Creates movies out of your pictures.
+#
+# Copyright (C) 2017 Jens Goepfert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+'''
+Renders the golden frames of a project with the photofilmstrip package on
+the python path, e.g. a checkout of an older revision. GoldenFrames runs
+this script with the checkout of the baseline revision:
+
+    PYTHONPATH=CHECKOUT python ReferenceRender.py PROJECT PROFILE COUNT DIR
+
+Only the API of the first releases is used, so the script works with old
+and new revisions. The frames are written as PNG files together with a
+golden.json file.
+'''
+
+import collections
+import json
+import os
+import sys
+import time
+
+from photofilmstrip.action.ActionI18N import ActionI18N
+from photofilmstrip.core.OutputProfile import GetOutputProfiles
+from photofilmstrip.core.ProjectFile import ProjectFile
+from photofilmstrip.core.RenderEngine import RenderEngineSlideshow, \
+    RenderEngineTimelapse
+from photofilmstrip.core.tasks import TaskImaging
+from photofilmstrip.lib.DestructionManager import DestructionManager
+
+
+class _LocalContext(object):
+    '''
+    Processes the subtasks of a task in the current thread.
+    '''
+
+    def __init__(self, size=4):
+        self.__results = collections.OrderedDict()
+        self.__size = size
+
+    def ProcessSubTask(self, task, isSubTask=True):  # pylint: disable=unused-argument
+        key = task.GetKey()
+        if key in self.__results:
+            result = self.__results.pop(key)
+        else:
+            result = task.Run(self)
+        self.__results[key] = result
+        while len(self.__results) > self.__size:
+            self.__results.popitem(last=False)
+        return result
+
+
+def _IterFrameTasks(project, profile):
+    if project.GetTimelapse():
+        engine = RenderEngineTimelapse(None, profile, project.GetPictures(),
+                                       False)
+    else:
+        totalLength = project.GetDuration(False)
+        if totalLength == -1:
+            totalLength = None
+        engine = RenderEngineSlideshow(None, profile, project.GetPictures(),
+                                       False, totalLength)
+    idxFrame = 0
+    for task in engine.GetTasks():
+        if not isinstance(task, TaskImaging):
+            continue
+        # a task rendered one frame before motionless frames were reused
+        getFrameCount = getattr(task, "GetFrameCount", None)
+        frameCount = getFrameCount() if getFrameCount else 1
+        yield idxFrame, frameCount, task
+        idxFrame += frameCount
+
+
+def Render(prjFilename, profileName, frameCount, outDir):
+    prjFile = ProjectFile(filename=prjFilename)
+    if not prjFile.Load():
+        raise RuntimeError("cannot load project %s" % prjFilename)
+    project = prjFile.GetProject()
+    profile = dict((prof.GetName(), prof)
+                   for prof in GetOutputProfiles())[profileName]
+
+    total = sum(count for __, count, __ in _IterFrameTasks(project, profile))
+    step = max(1, total // frameCount)
+    wanted = list(range(0, total, step))[:frameCount]
+
+    frames = {}
+    ctx = _LocalContext()
+    startTime = time.time()
+    for idxFrame, count, task in _IterFrameTasks(project, profile):
+        if idxFrame > wanted[-1]:
+            break
+        hits = [idx for idx in wanted if idxFrame <= idx < idxFrame + count]
+        if hits:
+            img = task.Run(ctx)
+            for idx in hits:
+                frames[idx] = img
+    renderTime = time.time() - startTime
+
+    for idx, img in frames.items():
+        img.save(os.path.join(outDir, "frame-%05d.png" % idx))
+    with open(os.path.join(outDir, "golden.json"), "w") as fd:
+        json.dump({"profile": profileName,
+                   "frames": sorted(frames),
+                   "renderTime": renderTime}, fd, indent=2)
+
+
+def main():
+    prjFilename, profileName, frameCount, outDir = sys.argv[1:5]
+    ActionI18N().Execute()
+    DestructionManager()
+    try:
+        Render(prjFilename, profileName.decode("utf-8"), int(frameCount),
+               outDir)
+    finally:
+        DestructionManager().Destroy()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+# encoding: UTF-8
+#
+# PhotoFilmStrip - Creates movies out of your pictures.
+#
+# Copyright (C) 2017 Jens Goepfert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+'''
+Renders synthetic projects and measures the throughput of the render
+pipeline. Run it from the source directory:
+
+    python -m benchmark.RenderBenchmark --pictures 20 --renderer all \
+        --output result.json --baseline baseline.json
+
+Each renderer is benchmarked in its own process, so the peak memory of one
+run does not hide the next one.
+'''
+
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from optparse import OptionParser
+
+from photofilmstrip.action.ActionI18N import ActionI18N
+from photofilmstrip.core.BaseRenderer import BaseRenderer
+from photofilmstrip.core.OutputProfile import GetOutputProfiles
+from photofilmstrip.core.ProjectFile import ProjectFile
+from photofilmstrip.core.RenderEngine import RenderEngineSlideshow, \
+    RenderEngineTimelapse
+from photofilmstrip.core.RenderJob import RenderJob
+from photofilmstrip.core.renderer.SingleFileRenderer import SingleFileRenderer
+from photofilmstrip.lib.DestructionManager import DestructionManager
+from photofilmstrip.lib.jobimpl.JobManager import JobManager
+
+from benchmark.SyntheticProject import CreateProject, MOTIONS, \
+    TRANSITIONS, EFFECTS
+
+
+class NullRenderer(BaseRenderer):
+    '''
+    Finalizes the frames like the SingleFileRenderer, but drops them.
+    '''
+
+    @staticmethod
+    def GetName():
+        return u"Null"
+
+    def Prepare(self):
+        pass
+
+    def ToSink(self, data):
+        pass
+
+    def ToSinkRepeated(self, data, count):
+        pass
+
+    def Finalize(self):
+        pass
+
+    def ProcessAbort(self):
+        pass
+
+
+def GetRendererClasses():
+    '''
+    Returns a dictionary of the names and classes of the renderers that
+    can be used on this system.
+    '''
+    result = {"null": NullRenderer,
+              "single": SingleFileRenderer}
+    try:
+        from photofilmstrip.core.renderer import GStreamerRenderer as GSR
+    except ImportError:
+        logging.info("GStreamer is not available")
+        return result
+
+    for rendererClass in (GSR.VCDFormat, GSR.SVCDFormat, GSR.DVDFormat,
+                          GSR.OggTheoraVorbis, GSR.MkvX264AC3,
+                          GSR.Mp4X264AAC, GSR.MkvX265AC3):
+        msgList = []
+        rendererClass.CheckDependencies(msgList)
+        if msgList:
+            logging.info("%s is not available: %s",
+                         rendererClass.__name__, msgList)
+        else:
+            result[rendererClass.__name__] = rendererClass
+    return result
+
+
+def _InitGStreamer():
+    try:
+        import gi
+        gi.require_version('Gst', '1.0')
+        from gi.repository import Gst
+    except (ImportError, ValueError):
+        return
+    Gst.init(None)
+
+
+def _RenderProject(prjFilename, rendererName, profile, workers, processes,
+                   outpath):
+    '''
+    Renders the project and returns a dictionary with the measured values.
+    '''
+    _InitGStreamer()
+    rendererClass = GetRendererClasses()[rendererName]
+
+    prjFile = ProjectFile(filename=prjFilename)
+    if not prjFile.Load():
+        raise RuntimeError("cannot load project %s" % prjFilename)
+    project = prjFile.GetProject()
+
+    DestructionManager()
+    groupId = "benchmark"
+    JobManager().Init(groupId, workerCount=workers, useProcesses=processes)
+    try:
+        renderer = rendererClass()
+        renderer.Init(profile, project.GetAspect(), outpath)
+        renderer.SetAudioFiles([])
+
+        if project.GetTimelapse():
+            renderEngine = RenderEngineTimelapse(outpath, profile,
+                                                 project.GetPictures(),
+                                                 False)
+        else:
+            totalLength = project.GetDuration(False)
+            if totalLength == -1:
+                totalLength = None
+            renderEngine = RenderEngineSlideshow(outpath, profile,
+                                                 project.GetPictures(),
+                                                 False, totalLength)
+
+        firstFrame = []
+        frames = [0]
+
+        def _Probe(method):
+            def _Wrapper(*args):
+                if not firstFrame:
+                    firstFrame.append(time.time())
+                # the last argument of ToSinkRepeated is the count
+                frames[0] += args[-1] if len(args) > 1 else 1
+                return method(*args)
+            return _Wrapper
+        renderer.ToSink = _Probe(renderer.ToSink)
+        renderer.ToSinkRepeated = _Probe(renderer.ToSinkRepeated)
+
+        startTime = time.time()
+        renderJob = RenderJob(rendererName, renderer,
+                              renderEngine.GetTasks(),
+                              renderEngine.GetFrameCount(),
+                              groupId)
+        JobManager().EnqueueContext(renderJob)
+        while not renderJob.IsDone():
+            time.sleep(0.01)
+        wallTime = time.time() - startTime
+    finally:
+        DestructionManager().Destroy()
+
+    return {"frames": frames[0],
+            "wallTime": wallTime,
+            "fps": frames[0] / wallTime if wallTime > 0 else 0.0,
+            "timeToFirstFrame": (firstFrame[0] - startTime
+                                 if firstFrame else None),
+            # kilobytes on Linux
+            "peakRssKiB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "peakRssChildrenKiB": resource.getrusage(
+                resource.RUSAGE_CHILDREN).ru_maxrss}
+
+
+def _RunCase(queue, *args):
+    try:
+        queue.put(("ok", _RenderProject(*args)))
+    except Exception, err:  # IGNORE:R0703
+        logging.error("benchmark failed", exc_info=1)
+        queue.put(("error", str(err)))
+
+
+def RunCase(prjFilename, rendererName, profile, workers, processes):
+    '''
+    Renders the project in a new process and returns the measured values.
+    '''
+    outpath = tempfile.mkdtemp(prefix="pfs-benchmark-")
+    try:
+        queue = multiprocessing.Queue()
+        proc = multiprocessing.Process(
+            target=_RunCase,
+            args=(queue, prjFilename, rendererName, profile,
+                  workers, processes, outpath))
+        proc.start()
+        status, result = queue.get()
+        proc.join()
+    finally:
+        shutil.rmtree(outpath, True)
+
+    if status != "ok":
+        raise RuntimeError(result)
+    return result
+
+
+def Compare(results, baseline, tolerance):
+    '''
+    Compares the results with the results of a baseline.
+    Returns a list of messages for the cases that are slower than the
+    baseline by more than the tolerance.
+    '''
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["fps"] < base["fps"] * (1 - tolerance):
+            regressions.append(u"%s: %.2f fps, baseline %.2f fps" % (
+                name, result["fps"], base["fps"]))
+        if result["timeToFirstFrame"] is not None and \
+                base["timeToFirstFrame"] is not None and \
+                result["timeToFirstFrame"] > \
+                base["timeToFirstFrame"] * (1 + tolerance):
+            regressions.append(u"%s: first frame after %.2f s, "
+                               u"baseline %.2f s" % (
+                                   name, result["timeToFirstFrame"],
+                                   base["timeToFirstFrame"]))
+    return regressions
+
+
+def main():
+    parser = OptionParser(prog="python -m benchmark.RenderBenchmark")
+    parser.add_option("--pictures", type="int", default=10,
+                      help="number of pictures [default: %default]")
+    parser.add_option("--megapixels", type="float", default=2.0,
+                      help="size of each picture [default: %default]")
+    parser.add_option("--motion", choices=MOTIONS, default="mixed",
+                      help=", ".join(MOTIONS) + " [default: %default]")
+    parser.add_option("--transition", choices=sorted(TRANSITIONS),
+                      default="fade",
+                      help=", ".join(sorted(TRANSITIONS)) +
+                      " [default: %default]")
+    parser.add_option("--effect", choices=sorted(EFFECTS), default="none",
+                      help=", ".join(sorted(EFFECTS)) + " [default: %default]")
+    parser.add_option("--timelapse", action="store_true", default=False,
+                      help="create a timelapse project")
+    parser.add_option("--duration", type="float", default=3.0,
+                      help="seconds per picture, frames per picture in "
+                      "timelapse mode [default: %default]")
+    parser.add_option("--profile", default="HD 720p@25.00 fps",
+                      help="name of the output profile [default: %default]")
+    parser.add_option("--renderer", action="append", default=[],
+                      help="null, single, the class name of a GStreamer "
+                      "renderer or all, can be repeated [default: null]")
+    parser.add_option("--workers", type="int",
+                      default=multiprocessing.cpu_count(),
+                      help="number of workers [default: %default]")
+    parser.add_option("--processes", action="store_true", default=False,
+                      help="render in worker processes")
+    parser.add_option("--workdir",
+                      help="directory of the synthetic projects, they are "
+                      "reused if it exists [default: a temporary directory]")
+    parser.add_option("--output", metavar="FILE",
+                      help="write the results as JSON")
+    parser.add_option("--baseline", metavar="FILE",
+                      help="compare with the results of a former run")
+    parser.add_option("--tolerance", type="float", default=0.1,
+                      help="allowed slowdown compared to the baseline "
+                      "[default: %default]")
+    options = parser.parse_args()[0]
+
+    logging.basicConfig(level=logging.WARNING)
+    ActionI18N().Execute()
+    _InitGStreamer()
+
+    available = GetRendererClasses()
+    rendererNames = options.renderer or ["null"]
+    if "all" in rendererNames:
+        rendererNames = sorted(available)
+    for name in rendererNames:
+        if name not in available:
+            parser.error("renderer not available: %s" % name)
+
+    profiles = dict((prof.GetName(), prof) for prof in GetOutputProfiles())
+    if options.profile not in profiles:
+        parser.error("unknown profile %s, use one of: %s" % (
+            options.profile, ", ".join(sorted(profiles))))
+    profile = profiles[options.profile]
+
+    workdir = options.workdir or tempfile.mkdtemp(prefix="pfs-benchmark-")
+    try:
+        prjFilename = CreateProject(workdir,
+                                    options.pictures, options.megapixels,
+                                    options.motion, options.transition,
+                                    options.effect, options.timelapse,
+                                    options.duration)
+
+        results = {}
+        for name in rendererNames:
+            result = RunCase(prjFilename, name, profile,
+                             options.workers, options.processes)
+            results[name] = result
+            print u"%-16s %6d frames %8.2f fps  first frame %s  " \
+                  u"peak RSS %d MiB" % (
+                      name, result["frames"], result["fps"],
+                      "%.2f s" % result["timeToFirstFrame"]
+                      if result["timeToFirstFrame"] is not None else "-",
+                      result["peakRssKiB"] // 1024)
+    finally:
+        if not options.workdir:
+            shutil.rmtree(workdir, True)
+
+    report = {"config": {"pictures": options.pictures,
+                         "megapixels": options.megapixels,
+                         "motion": options.motion,
+                         "transition": options.transition,
+                         "effect": options.effect,
+                         "timelapse": options.timelapse,
+                         "duration": options.duration,
+                         "profile": options.profile,
+                         "workers": options.workers,
+                         "processes": options.processes,
+                         "platform": platform.platform(),
+                         "cpus": multiprocessing.cpu_count()},
+              "results": results}
+    if options.output:
+        with open(options.output, "w") as fd:
+            json.dump(report, fd, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline, "r") as fd:
+            baseline = json.load(fd)
+        if baseline.get("config") != report["config"]:
+            print u"warning: the baseline was created with another " \
+                  u"configuration"
+        regressions = Compare(results, baseline.get("results", {}),
+                              options.tolerance)
+        for msg in regressions:
+            print u"REGRESSION %s" % msg
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+# encoding: UTF-8
+#
+# PhotoFilmStrip - Creates movies out of your pictures.
+#
+# Copyright (C) 2017 Jens Goepfert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+import os
+import random
+
+from PIL import Image, ImageDraw
+
+from photofilmstrip.core.Aspect import Aspect
+from photofilmstrip.core.Picture import Picture
+from photofilmstrip.core.Project import Project
+from photofilmstrip.core.ProjectFile import ProjectFile
+
+
+MOTIONS = ["static", "pan", "zoom", "mixed"]
+
+TRANSITIONS = {"none": Picture.TRANS_NONE,
+               "fade": Picture.TRANS_FADE,
+               "roll": Picture.TRANS_ROLL}
+
+EFFECTS = {"none": Picture.EFFECT_NONE,
+           "bw": Picture.EFFECT_BLACK_WHITE,
+           "sepia": Picture.EFFECT_SEPIA}
+
+
+def CreatePicture(filename, megapixels, seed):
+    '''
+    Writes a JPEG file with random shapes, so the decoder has to do about
+    the same work as for a photo of that size.
+    :param filename: the file to create
+    :param megapixels: the size of the picture, the aspect ratio is 3:2
+    :param seed: makes the content reproducible
+    '''
+    rnd = random.Random(seed)
+    height = int(round((megapixels * 1e6 / 1.5) ** 0.5))
+    width = int(round(height * 1.5))
+
+    img = Image.new("RGB", (width, height),
+                    tuple(rnd.randint(0, 255) for __ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for __ in range(60):
+        x1 = rnd.randint(-width // 4, width)
+        y1 = rnd.randint(-height // 4, height)
+        x2 = x1 + rnd.randint(width // 20, width // 2)
+        y2 = y1 + rnd.randint(height // 20, height // 2)
+        color = tuple(rnd.randint(0, 255) for __ in range(3))
+        if rnd.random() < 0.5:
+            draw.ellipse((x1, y1, x2, y2), fill=color)
+        else:
+            draw.line((x1, y1, x2, y2), fill=color,
+                      width=max(1, width // 200))
+    img.save(filename, quality=90)
+    return width, height
+
+
+def _GetRects(motion, idxPic, width, height):
+    '''
+    Returns the start and target rect of a picture for the motion type.
+    '''
+    if motion == "mixed":
+        motion = MOTIONS[idxPic % (len(MOTIONS) - 1)]
+
+    # the largest 16:9 rect of the picture
+    fullWidth = width
+    fullHeight = int(width * 9 / 16.0)
+    top = (height - fullHeight) // 2
+    full = (0, top, fullWidth, fullHeight)
+    if motion == "static":
+        return full, full
+    elif motion == "pan":
+        partWidth = int(fullWidth * 0.6)
+        partHeight = int(fullHeight * 0.6)
+        return ((0, top, partWidth, partHeight),
+                (fullWidth - partWidth, top + fullHeight - partHeight,
+                 partWidth, partHeight))
+    elif motion == "zoom":
+        partWidth = fullWidth // 2
+        partHeight = fullHeight // 2
+        return (full,
+                ((fullWidth - partWidth) // 2,
+                 top + (fullHeight - partHeight) // 2,
+                 partWidth, partHeight))
+    else:
+        raise ValueError("unknown motion: %s" % motion)
+
+
+def CreateProject(directory, pictures=10, megapixels=2.0, motion="mixed",
+                  transition="fade", effect="none", timelapse=False,
+                  duration=3.0):
+    '''
+    Creates the pictures and the project file of a synthetic project.
+    Existing pictures of the same size are reused.
+    Returns the filename of the project.
+    :param directory: the directory of the project and its pictures
+    :param pictures: the number of picture files
+    :param megapixels: the size of each picture
+    :param motion: one of MOTIONS
+    :param transition: a key of TRANSITIONS
+    :param effect: a key of EFFECTS
+    :param timelapse: creates a timelapse project, every picture file is
+                      one frame and only some of them are in the project
+    :param duration: the duration of each picture in seconds, in timelapse
+                     mode the number of frames of each picture file
+    '''
+    # the filenames must not contain other numbers than the index, otherwise
+    # they do not match the number pattern of a timelapse sequence
+    picDir = os.path.join(directory, "%.1fmp" % megapixels)
+    if not os.path.isdir(picDir):
+        os.makedirs(picDir)
+
+    picList = []
+    for idx in range(pictures):
+        filename = os.path.join(picDir, "pic_%04d.jpg" % idx)
+        if os.path.isfile(filename):
+            width, height = Image.open(filename).size
+        else:
+            width, height = CreatePicture(filename, megapixels, idx)
+
+        if timelapse and idx not in (0, pictures - 1) \
+                and idx % max(1, pictures // 4) != 0:
+            # a timelapse project contains only the key pictures
+            continue
+
+        pic = Picture(filename)
+        pic.SetWidth(width)
+        pic.SetHeight(height)
+        startRect, targetRect = _GetRects(motion, idx, width, height)
+        pic.SetStartRect(startRect)
+        pic.SetTargetRect(targetRect)
+        pic.SetDuration(duration)
+        pic.SetEffect(EFFECTS[effect])
+        pic.SetTransition(TRANSITIONS[transition])
+        if timelapse:
+            pic.SetTransitionDuration(0)
+        pic.SetComment(u"Picture %d" % (idx + 1))
+        picList.append(pic)
+
+    project = Project()
+    project.SetAspect(Aspect.ASPECT_16_9)
+    project.SetTimelapse(timelapse)
+    project.SetPictures(picList)
+
+    prjFilename = os.path.join(directory, "benchmark-%s.pfs" % (
+        "-".join(str(value) for value in (pictures, megapixels, motion,
+                                          transition, effect,
+                                          int(timelapse)))))
+    ProjectFile(project, prjFilename).Save()
+    return prjFilename
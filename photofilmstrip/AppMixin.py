@@ -51,9 +51,17 @@ class AppMixin(object):
         from gi.repository import Gst
         Gst.init(None)
 
+    def InitProcesses(self):
+        if self._UsesProcesses():
+            # the worker processes are forked by a server that is started
+            # while no other thread is running
+            from photofilmstrip.lib.jobimpl.ForkServer import ForkServer
+            ForkServer().Start()
+
     def Start(self):
         self.InitLogging()
         self.InitI18N()
+        self.InitProcesses()
         self.InitGStreamer()
 
         DestructionManager()
@@ -73,5 +81,8 @@ class AppMixin(object):
     def _GetLogFilename(self):
         return None
 
+    def _UsesProcesses(self):
+        return False
+
     def _OnStart(self):
         raise NotImplementedError()
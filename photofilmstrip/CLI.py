@@ -29,6 +29,9 @@ class CliApp(AppMixin):
     def _GetLogFormat(self):
         return '\n%(levelname)s: %(message)s'
 
+    def _UsesProcesses(self):
+        return "-P" in sys.argv or "--processes" in sys.argv
+
     def _OnStart(self):
         showHelp = False
         for helpOption in ("-h", "--help"):
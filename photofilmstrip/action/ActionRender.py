@@ -29,22 +29,32 @@ from photofilmstrip.lib.util import CheckFile
 from photofilmstrip.core.OutputProfile import GetOutputProfiles
 from photofilmstrip.core.Renderer import RENDERERS
 from photofilmstrip.core.RenderEngine import RenderEngineSlideshow, \
-    RenderEngineTimelapse
+    RenderEngineTimelapse, SplitUnits
 from photofilmstrip.core.RenderJob import RenderJob
+from photofilmstrip.core.Readahead import Readahead
+from photofilmstrip.core.SegmentCache import SegmentCache
+from photofilmstrip.core.RenderCheckpoint import RenderCheckpoint
+from photofilmstrip.core.renderer.SegmentedRenderer import SegmentedRenderer, \
+    Segment
 from photofilmstrip.core.GPlayer import GPlayer
 
 
 class ActionRender(IAction):
 
+    # length of the segments of a resumable render
+    CHECKPOINT_SECONDS = 60
+
     def __init__(self, photoFilmStrip,
                  profile,
                  rendererClass, draftMode,
-                 outpath=None):
+                 outpath=None, groupId="render", resume=False):
         self.__photoFilmStrip = photoFilmStrip
         self.__profile = profile
         self.__rendererClass = rendererClass
         self.__draftMode = draftMode
         self.__outpath = outpath
+        self.__groupId = groupId
+        self.__resume = resume
 
         self.__renderJob = None
 
@@ -115,8 +125,164 @@ class ActionRender(IAction):
         name = "%s (%s)" % (self.__photoFilmStrip.GetName(),
                             self.__profile.GetName())
 
+        frameCount = renderEngine.GetFrameCount()
+        segmentCount = renderer.GetSegmentCount()
+        if not outpath or not renderer.SupportsSegments():
+            tasks = renderEngine.GetTasks()
+        elif renderer.GetTypedProperty("SegmentCache", bool):
+            renderer, tasks, frameCount = self._CreateCachedSegments(
+                renderer, renderEngine, outpath, segmentCount, frameCount)
+        elif segmentCount > 1 or self.__resume:
+            renderer, tasks, frameCount = self._CreateSegments(
+                renderer, renderEngine, outpath, segmentCount, frameCount)
+        else:
+            tasks = renderEngine.GetTasks()
+
+        if self.__photoFilmStrip.GetTimelapse():
+            # each file of a sequence is needed for a few frames only, so
+            # the upcoming files are read before their frames are rendered
+            tasks = Readahead().Iterate(tasks)
+
         self.__renderJob = RenderJob(name, renderer,
-                                     renderEngine.GetTasks())
+                                     tasks,
+                                     frameCount,
+                                     self.__groupId)
+
+    def _CreateSegments(self, renderer, renderEngine, outpath, laneCount,
+                        frameCount):
+        '''
+        Splits the video into segments that are encoded at the same time.
+        A resumable render uses segments of CHECKPOINT_SECONDS and records
+        the complete ones in a RenderCheckpoint, the segments of an aborted
+        render with the same settings are not rendered again.
+        Returns the renderer that distributes the frames on the segments,
+        the tasks to process and the number of frames to render.
+        '''
+        units = renderEngine.GetUnits()
+        segmentCount = laneCount
+        if self.__resume:
+            checkpointFrames = int(self.__profile.GetFrameRate().AsFloat() *
+                                   ActionRender.CHECKPOINT_SECONDS)
+            totalFrames = sum(unit.frameCount for unit in units)
+            segmentCount = max(segmentCount,
+                               -(-totalFrames // checkpointFrames))
+        groups = SplitUnits(units, segmentCount)
+        if not groups or (len(groups) < 2 and not self.__resume):
+            return renderer, renderEngine.GetTasks(), frameCount
+
+        tempDir = SegmentedRenderer.CreateTempDir(outpath,
+                                                  clear=not self.__resume)
+        segments = []
+        for idx, group in enumerate(groups):
+            filename = os.path.join(tempDir, "segment-%04d.%s" % (
+                idx, renderer.GetSegmentExtension()))
+            segments.append(Segment(filename,
+                                    group[0].frameOffset,
+                                    sum(unit.frameCount for unit in group)))
+
+        checkpoint = None
+        if self.__resume:
+            key = SegmentCache.MakeKey(
+                tuple(unit.GetKey() for unit in units),
+                (self._GetSegmentContext(renderer),
+                 tuple((segment.frameOffset, segment.frameCount)
+                       for segment in segments)))
+            checkpoint = RenderCheckpoint(tempDir, key)
+            complete = checkpoint.Load()
+            for idx, segment in enumerate(segments):
+                if segment.filename in complete:
+                    segment.done = True
+                    groups[idx] = []
+                    frameCount -= segment.frameCount
+
+        logging.debug("Rendering %s of %s segments",
+                      len([group for group in groups if group]),
+                      len(segments))
+        return (SegmentedRenderer(renderer, segments, tempDir,
+                                  checkpoint=checkpoint),
+                renderEngine.GetSegmentTasks(groups, laneCount),
+                frameCount)
+
+    def _CreateCachedSegments(self, renderer, renderEngine, outpath,
+                              laneCount, frameCount):
+        '''
+        Creates one segment per picture that is kept in the SegmentCache.
+        Only the segments that are not in the cache are rendered, the
+        others are reused when the segments are concatenated. The
+        concatenated video is kept as well, if it is still valid only the
+        audio is encoded and muxed with it.
+        Returns the renderer that distributes the frames on the segments,
+        the tasks to process and the number of frames to render.
+        '''
+        segmentCache = SegmentCache(SegmentCache.GetCacheDir(outpath))
+        context = self._GetSegmentContext(renderer)
+        renderSubtitle = renderer.GetTypedProperty("RenderSubtitle", bool)
+
+        extension = renderer.GetSegmentExtension()
+        segments = []
+        groups = []
+        keys = []
+        totalFrames = 0
+        doneFrames = 0
+        for unit in renderEngine.GetUnits():
+            if unit.frameCount == 0:
+                continue
+
+            unitContext = context
+            if renderSubtitle:
+                # the subtitles are timed relative to the whole video
+                unitContext += (unit.frameOffset,)
+            key = SegmentCache.MakeKey(unit.GetKey(), unitContext)
+            keys.append(key)
+            totalFrames += unit.frameCount
+            segment = Segment(segmentCache.GetFilename(key, extension),
+                              unit.frameOffset, unit.frameCount)
+            segment.done = segmentCache.Contains(segment.filename)
+            segments.append(segment)
+            if segment.done:
+                groups.append([])
+                doneFrames += unit.frameCount
+            else:
+                groups.append([unit])
+
+        if not segments:
+            return renderer, renderEngine.GetTasks(), frameCount
+
+        videoFile = segmentCache.GetVideoFilename(
+            SegmentCache.MakeKey(tuple(keys), context), extension)
+        if segmentCache.Contains(videoFile):
+            # the video is unchanged, e.g. only the audio files differ
+            logging.debug("Reusing encoded video '%s'", videoFile)
+            segment = Segment(videoFile, 0, totalFrames)
+            segment.done = True
+            return (SegmentedRenderer(renderer, [segment]),
+                    renderEngine.GetSegmentTasks([[]]),
+                    frameCount - totalFrames)
+
+        logging.debug("Rendering %s of %s segments",
+                      len([group for group in groups if group]),
+                      len(segments))
+        return (SegmentedRenderer(renderer, segments,
+                                  segmentCache=segmentCache,
+                                  videoFile=videoFile),
+                renderEngine.GetSegmentTasks(groups, laneCount),
+                frameCount - doneFrames)
+
+    def _GetSegmentContext(self, renderer):
+        '''
+        Returns a tuple of the settings that affect every segment.
+        '''
+        props = tuple((prop, renderer.GetProperty(prop))
+                      for prop in renderer.GetProperties()
+                      if prop not in ("Segments", "SegmentCache"))
+        return (renderer.__class__.__name__,
+                props,
+                self.__profile.GetName(),
+                self.__profile.GetResolution(),
+                self.__profile.GetFrameRate().AsStr(),
+                self.__profile.GetBitrate(),
+                self.__photoFilmStrip.GetAspect(),
+                self.__draftMode)
 
     def GetRenderJob(self):
         return self.__renderJob
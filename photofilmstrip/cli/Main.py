@@ -30,10 +30,12 @@ from photofilmstrip.lib.util import Decode, CheckFile
 from photofilmstrip.core.OutputProfile import (
     GetOutputProfiles, GetMPEGProfiles)
 from photofilmstrip.core.ProjectFile import ProjectFile
+from photofilmstrip.core.RenderStats import RenderStats
 from photofilmstrip.core.Renderer import RENDERERS
 from photofilmstrip.core.renderer.StreamRenderer import StreamRenderer
 from photofilmstrip.action.ActionRender import ActionRender
 from photofilmstrip.lib.jobimpl.JobManager import JobManager
+from photofilmstrip.lib.jobimpl.Tracer import Tracer
 from photofilmstrip.lib.jobimpl.IVisualJobHandler import IVisualJobHandler
 
 
@@ -100,6 +102,23 @@ class DummyGui(IVisualJobHandler):
         pass
 
 
+def WriteStats(gui, outpath):
+    '''
+    Prints the summary of the RenderStats and writes it as JSON file.
+    '''
+    stats = RenderStats()
+    summary = stats.GetSummary()
+    if isinstance(gui, CliGui):
+        # the stream renderer writes the video to stdout
+        gui.Write(u"\n" + stats.Format(summary))
+
+    filename = os.path.join(outpath or os.getcwd(), "render-stats.json")
+    try:
+        stats.WriteJson(filename, summary)
+    except IOError, err:
+        logging.error(_(u"cannot write statistics: %s"), err)
+
+
 def main(showHelp=False):
     parser = OptionParser(prog="%s-cli" % Constants.APP_NAME.lower(),
                           version="%%prog %s" % Constants.APP_VERSION_EX)
@@ -117,6 +136,10 @@ def main(showHelp=False):
     parser.add_option("-n", "--videonorm", help=_(u"Option videonorm is deprecated, use an appropriate profile!"))
     parser.add_option("-f", "--format", help=formatStr + " [default: %default]", default=4, type="int")
     parser.add_option("-a", "--draft", action="store_true", default=False, help=u"%s - %s" % (_(u"enable draft mode"), _(u"Activate this option to generate a preview of your PhotoFilmStrip. The rendering process will speed up dramatically, but results in lower quality.")))
+    parser.add_option("-r", "--resume", action="store_true", default=False, help=_(u"render in segments that are kept if the render is aborted, and continue an aborted render of the same project"))
+    parser.add_option("-s", "--stats", action="store_true", default=False, help=_(u"print the time spent in each render stage and write it to render-stats.json in the output path"))
+    parser.add_option("-T", "--trace", help=_(u"write a timeline of the render process to FILE, it can be opened with chrome://tracing or ui.perfetto.dev"), metavar="FILE")
+    parser.add_option("-P", "--processes", action="store_true", default=False, help=_(u"render in worker processes instead of threads"))
     parser.add_option("-d", "--debug", action="store_true", default=False, help=u"enable debug logging")
 
     if showHelp:
@@ -173,8 +196,16 @@ def main(showHelp=False):
     else:
         outpath = None
 
+    if options.processes:
+        groupId = "render-processes"
+        if not JobManager().HasGroup(groupId):
+            JobManager().Init(groupId, useProcesses=True)
+    else:
+        groupId = "render"
+
     project = prjFile.GetProject()
-    ar = ActionRender(project, profile, rendererClass, False, outpath)
+    ar = ActionRender(project, profile, rendererClass, False, outpath,
+                      groupId, options.resume)
 
     audioFile = project.GetAudioFile()
     if not CheckFile(audioFile):
@@ -188,6 +219,11 @@ def main(showHelp=False):
 
     cliGui.Info(options.project, rendererClass, profile)
 
+    if options.stats:
+        RenderStats().Enable()
+    if options.trace:
+        Tracer().Enable()
+
     ar.Execute()
     renderJob = ar.GetRenderJob()
     renderJob.AddVisualJobHandler(cliGui)
@@ -195,16 +231,26 @@ def main(showHelp=False):
     JobManager().EnqueueContext(renderJob)
 
     try:
-        while not renderJob.IsDone():
-            time.sleep(0.1)
-    except KeyboardInterrupt:
-        renderJob.Abort()
-        cliGui.Write("\n" + _(u"...aborted!"))
-        return 10
-
-    resultObj = renderJob.GetResultObject()
-    result = resultObj.GetResult()
-    if result:
-        cliGui.Write(_(u"all done"))
-#    else:
-#        logging.error(_(u"Error: %s"), renderEngine.GetErrorMessage())
+        try:
+            while not renderJob.IsDone():
+                time.sleep(0.1)
+        except KeyboardInterrupt:
+            renderJob.Abort()
+            cliGui.Write("\n" + _(u"...aborted!"))
+            return 10
+
+        resultObj = renderJob.GetResultObject()
+        result = resultObj.GetResult()
+        if result:
+            cliGui.Write(_(u"all done"))
+#        else:
+#            logging.error(_(u"Error: %s"), renderEngine.GetErrorMessage())
+    finally:
+        # an aborted render is written too
+        if options.stats:
+            WriteStats(cliGui, renderJob.GetOutputPath())
+        if options.trace:
+            try:
+                Tracer().Write(options.trace)
+            except IOError, err:
+                logging.error(_(u"cannot write trace: %s"), err)
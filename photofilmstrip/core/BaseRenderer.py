@@ -134,9 +134,56 @@ class BaseRenderer(object):
     def ToSink(self, data):
         raise NotImplementedError()
 
+    def ToSinkRepeated(self, data, count):
+        '''
+        Passes the same frame count times to the sink. Renderers may override
+        this to reuse the frame instead of processing it again.
+        '''
+        for __ in range(count):
+            self.ToSink(data)
+
     def ProcessAbort(self):
         raise NotImplementedError()
 
+    @staticmethod
+    def SupportsSegments():
+        '''
+        Returns True if the renderer can encode the video in segments that
+        are concatenated afterwards without encoding them again.
+        '''
+        return False
+
+    def GetSegmentCount(self):
+        '''
+        Returns the number of segments that are encoded in parallel.
+        '''
+        return 1
+
+    def GetSegmentExtension(self):
+        raise NotImplementedError()
+
+    def PrepareSegment(self, filename, frameOffset):
+        '''
+        Prepares the renderer to encode the video of one segment instead of
+        the output file.
+        :param filename: the file the segment is written to
+        :param frameOffset: the index of the first frame of the segment in
+                            the whole video
+        '''
+        raise NotImplementedError()
+
+    def ConcatSegments(self, filenames, frameCount, videoFile=None):
+        '''
+        Concatenates the encoded segments and adds the audio files, creates
+        the output file. Blocks until the output file is complete.
+        :param filenames: the files of the segments in the order of the video
+        :param frameCount: the number of frames of all segments
+        :param videoFile: if set, the concatenated video is also written to
+                          this file without audio, so it can be used as the
+                          only segment of another output with other audio
+        '''
+        raise NotImplementedError()
+
 
 class FinalizeHandler(object):
 
@@ -160,3 +207,20 @@ class ImageDataFinalizeHandler(FinalizeHandler):
         res = cStringIO.StringIO()
         pilImg.save(res, self._format, quality=self._quality)
         return res.getvalue()
+
+
+class RawImageDataFinalizeHandler(FinalizeHandler):
+    '''
+    Converts the PIL image into a packed raw pixel buffer. Avoids the encoding
+    in the worker and the decoding in the sink if the sink is able to handle
+    raw video frames.
+    '''
+
+    def __init__(self, rawMode="RGB"):
+        self._rawMode = rawMode
+
+    def UseSmartFinalize(self):
+        return True
+
+    def ProcessFinalize(self, pilImg):
+        return pilImg.tobytes("raw", self._rawMode)
@@ -0,0 +1,152 @@
+# encoding: UTF-8
+#
+# PhotoFilmStrip - Creates movies out of your pictures.
+#
+# Copyright (C) 2017 Jens Goepfert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+import collections
+import logging
+import os
+import threading
+
+from photofilmstrip.lib.common.Singleton import Singleton
+
+
+class DecodedImageCache(Singleton):
+    '''
+    Process wide cache of decoded pictures. The least recently
+    used pictures are evicted if the cached pictures exceed the byte budget.
+    A picture that was decoded at a reduced scale is only used if the
+    requested scale is not larger.
+
+    Worker processes have their own instance, so the budget applies to each
+    of them.
+    '''
+
+    DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__entries = collections.OrderedDict()
+        self.__maxBytes = DecodedImageCache.DEFAULT_MAX_BYTES
+        self.__bytes = 0
+
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+        self.__logger = logging.getLogger("DecodedImageCache")
+
+    @staticmethod
+    def MakeKey(picture, mode):
+        '''
+        Returns the cache key of a Picture or PictureSpec. The key contains
+        the modification time and size of the file, so a changed file is
+        decoded again. Returns None if the file cannot be accessed. The
+        pictures are cached in file orientation and without effect, so the
+        key is the same for all rotations and for all effects that are
+        applied to the same decoded image.
+        :param mode: the mode the picture is decoded to, e.g. "L" or "RGB"
+        '''
+        try:
+            stat = os.stat(picture.GetFilename())
+        except (OSError, TypeError):
+            return None
+        return (picture.GetFilename(),
+                mode,
+                stat.st_mtime,
+                stat.st_size)
+
+    def SetMaxBytes(self, maxBytes):
+        with self.__lock:
+            self.__maxBytes = maxBytes
+            self.__Evict()
+
+    def GetMaxBytes(self):
+        return self.__maxBytes
+
+    def Get(self, key, minScale=1.0):
+        '''
+        Returns a tuple of the image, the full size of the picture and its
+        EXIF orientation or None.
+        :param key: the key created by MakeKey()
+        :param minScale: the minimal scale of the image in relation to the
+                         full size
+        '''
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                pilImg, fullSize = entry[:2]
+                if pilImg.size[0] >= fullSize[0] * minScale - 1 and \
+                        pilImg.size[1] >= fullSize[1] * minScale - 1:
+                    # mark as recently used
+                    del self.__entries[key]
+                    self.__entries[key] = entry
+                    self.__hits += 1
+                    return pilImg, fullSize, entry[3]
+
+            self.__misses += 1
+            return None
+
+    def Put(self, key, pilImg, fullSize, exifOrientation):
+        '''
+        Adds an image to the cache, replaces an existing image of the same
+        picture.
+        :param key: the key created by MakeKey()
+        :param pilImg: the decoded image, must not be modified afterwards
+        :param fullSize: the size of the picture at scale 1
+        :param exifOrientation: the EXIF orientation of the picture, the
+                                image is in file orientation
+        '''
+        size = pilImg.size[0] * pilImg.size[1] * len(pilImg.getbands())
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            if entry is not None:
+                self.__bytes -= entry[2]
+
+            if size > self.__maxBytes:
+                return
+
+            self.__entries[key] = (pilImg, fullSize, size, exifOrientation)
+            self.__bytes += size
+            self.__Evict()
+
+    def __Evict(self):
+        while self.__bytes > self.__maxBytes and self.__entries:
+            key, entry = self.__entries.popitem(last=False)
+            self.__bytes -= entry[2]
+            self.__evictions += 1
+            self.__logger.debug("evicted %s", key)
+
+    def Clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+
+    def GetStatistics(self):
+        '''
+        Returns a dictionary with the counters of hits, misses and evictions
+        and the current usage of the cache.
+        '''
+        with self.__lock:
+            return {"hits": self.__hits,
+                    "misses": self.__misses,
+                    "evictions": self.__evictions,
+                    "entries": len(self.__entries),
+                    "bytes": self.__bytes,
+                    "maxBytes": self.__maxBytes}
@@ -20,11 +20,13 @@
 #
 
 import logging
+import math
 import cStringIO
 
 from PIL import Image, ImageDraw
 
 from photofilmstrip.core.Picture import Picture
+from photofilmstrip.lib.jobimpl import SharedMemory
 
 
 def ImageToStream(pilImg, imgFormat="JPEG"):
@@ -39,18 +41,31 @@ def ImageFromBuffer(size, buffr):
     return pilImg
 
 
-def RotateExif(pilImg):
+def GetExifOrientation(pilImg):
+    '''
+    Returns the EXIF orientation (1-8) of the image, 1 if it has none.
+    '''
     exifOrient = 274
-    rotation = 0
+    orientation = 1
     try:
         exif = pilImg._getexif()  # pylint: disable=protected-access
         if isinstance(exif, dict) and exif.has_key(exifOrient):
-            rotation = exif[exifOrient]
+            orientation = exif[exifOrient]
     except AttributeError:
         pass
     except Exception, err:
-        logging.debug("PILBackend.RotateExif(): %s", err, exc_info=1)
-
+        logging.debug("PILBackend.GetExifOrientation(): %s", err, exc_info=1)
+    return orientation
+
+
+def RotateExif(pilImg, rotation=None):
+    '''
+    Applies the EXIF orientation of the image.
+    :param rotation: the EXIF orientation if the image has lost its EXIF
+                     data, e.g. it was decoded before
+    '''
+    if rotation is None:
+        rotation = GetExifOrientation(pilImg)
     if rotation == 2:
         # flip horizontal
         return pilImg.transpose(Image.FLIP_LEFT_RIGHT)
@@ -78,32 +93,193 @@ def RotateExif(pilImg):
     return pilImg
 
 
+def _MakeLinearRamp(white):
+    # putpalette expects [r,g,b,r,g,b,...]
+    ramp = []
+    r, g, b = white
+    for i in range(255):
+        ramp.extend((r * i / 255, g * i / 255, b * i / 255))
+    return ramp
+
+
+# the effects that work on a grayscale image and the palette that maps the
+# gray values to colors
+_EFFECT_PALETTES = {
+    Picture.EFFECT_BLACK_WHITE: None,
+    # make sepia ramp (tweak color as necessary)
+    Picture.EFFECT_SEPIA: _MakeLinearRamp((255, 240, 192)),
+}
+
+
+# maps the coordinates of the picture after RotateExif() to the coordinates
+# in file orientation, for each EXIF orientation a function of the file size
+_EXIF_MATRICES = {
+    2: lambda w, h: (-1, 0, w, 0, 1, 0),
+    3: lambda w, h: (-1, 0, w, 0, -1, h),
+    4: lambda w, h: (1, 0, 0, 0, -1, h),
+    5: lambda w, h: (0, 1, 0, 1, 0, 0),
+    6: lambda w, h: (0, 1, 0, -1, 0, h),
+    7: lambda w, h: (0, -1, w, -1, 0, h),
+    8: lambda w, h: (0, -1, w, 1, 0, 0),
+}
+
+
+def _ComposeMatrices(outer, inner):
+    '''
+    Returns the affine matrix that applies inner first and then outer.
+    '''
+    a1, b1, c1, d1, e1, f1 = outer
+    a2, b2, c2, d2, e2, f2 = inner
+    return (a1 * a2 + b1 * d2, a1 * b2 + b1 * e2, a1 * c2 + b1 * f2 + c1,
+            d1 * a2 + e1 * d2, d1 * b2 + e1 * e2, d1 * c2 + e1 * f2 + f1)
+
+
+def GetOrientationMatrix(size, exifOrientation, rotation):
+    '''
+    Returns the affine matrix that maps coordinates of the picture as it is
+    shown, i.e. after the EXIF orientation and the rotation of the picture are
+    applied, to coordinates of the image in file orientation. Returns None if
+    the picture is shown in file orientation.
+    :param size: the size of the image in file orientation
+    :param exifOrientation: the EXIF orientation (1-8) of the image
+    :param rotation: the rotation of the picture in steps of 90 degrees
+                     clockwise, like Picture.GetRotation()
+    '''
+    width, height = size
+    matrix = None
+    if exifOrientation in _EXIF_MATRICES:
+        matrix = _EXIF_MATRICES[exifOrientation](width, height)
+        if exifOrientation >= 5:
+            width, height = height, width
+
+    if rotation % 4:
+        # same as Image.rotate() without expand, the picture is rotated
+        # around the center and keeps its size
+        cos, sin = ((1, 0), (0, 1), (-1, 0), (0, -1))[rotation % 4]
+        cx, cy = width / 2.0, height / 2.0
+        rotMatrix = (cos, sin, cx - cos * cx - sin * cy,
+                     -sin, cos, cy + sin * cx - cos * cy)
+        if matrix is None:
+            matrix = rotMatrix
+        else:
+            matrix = _ComposeMatrices(matrix, rotMatrix)
+    return matrix
+
+
+def _GetRectMatrix(rect, size):
+    return (rect[2] / float(size[0]), 0, rect[0],
+            0, rect[3] / float(size[1]), rect[1])
+
+
+class ImagePyramid(object):
+    '''
+    Holds a decoded picture and successively halved copies of it. Each level
+    is only built if it is still at least as large as the output resolution,
+    so the crop and resize of a frame can work on the smallest level that
+    covers the rect without upscaling.
+
+    The image may be kept in file orientation, the orientation matrix then
+    maps the coordinates of the rects to the coordinates of the image and is
+    folded into the transformation of each frame. The effect of the picture
+    is applied to each frame, a grayscale image is kept for effects that do
+    not need the colors.
+    '''
+
+    # disabled to compare with the result of the full size picture
+    BUILD_LEVELS = True
+
+    def __init__(self, pilImg, resolution, fullSize=None, orientation=None,
+                 effect=Picture.EFFECT_NONE):
+        '''
+        :param pilImg: the decoded image
+        :param resolution: the output resolution
+        :param fullSize: the size of the image at scale 1
+        :param orientation: the matrix returned by GetOrientationMatrix()
+        :param effect: the effect that is applied to each frame
+        '''
+        self.levels = [pilImg]
+        # the size of the image at scale 1, if the image was decoded at a
+        # reduced scale it is larger than the first level
+        if fullSize is None:
+            fullSize = pilImg.size
+        self.fullSize = fullSize
+        self.orientation = orientation
+        self.effect = effect
+        if orientation is not None and orientation[0] == 0:
+            # rotated by 90 or 270 degrees
+            resolution = resolution[1], resolution[0]
+
+        width, height = pilImg.size
+        while ImagePyramid.BUILD_LEVELS and \
+                width // 2 >= resolution[0] and height // 2 >= resolution[1]:
+            width, height = width // 2, height // 2
+            pilImg = pilImg.resize((width, height), Image.BILINEAR)
+            self.levels.append(pilImg)
+
+    def __getstate__(self):
+        # levels are moved through shared memory if sent to a worker process
+        state = self.__dict__.copy()
+        state["levels"] = [SharedMemory.Pack(level) for level in self.levels]
+        return state
+
+    def __setstate__(self, state):
+        state["levels"] = [SharedMemory.Unpack(level)
+                           for level in state["levels"]]
+        self.__dict__.update(state)
+
+    def GetLevel(self, rect, size):
+        '''
+        Returns the smallest level that still provides at least one source
+        pixel per output pixel for the given rect together with the affine
+        matrix that maps the output pixels to the coordinates of that level.
+        :param rect: the rect in coordinates of the full size picture as it
+                     is shown
+        :param size: the output resolution
+        '''
+        fullWidth, fullHeight = self.fullSize
+        if self.orientation is None:
+            for pilImg in reversed(self.levels):
+                scaleX = pilImg.size[0] / float(fullWidth)
+                scaleY = pilImg.size[1] / float(fullHeight)
+                if rect[2] * scaleX >= size[0] and \
+                        rect[3] * scaleY >= size[1]:
+                    break
+            return pilImg, _GetRectMatrix((rect[0] * scaleX, rect[1] * scaleY,
+                                           rect[2] * scaleX, rect[3] * scaleY),
+                                          size)
+
+        matrix = _ComposeMatrices(self.orientation,
+                                  _GetRectMatrix(rect, size))
+        for pilImg in reversed(self.levels):
+            scaleX = pilImg.size[0] / float(fullWidth)
+            scaleY = pilImg.size[1] / float(fullHeight)
+            levelMatrix = (matrix[0] * scaleX, matrix[1] * scaleX,
+                           matrix[2] * scaleX, matrix[3] * scaleY,
+                           matrix[4] * scaleY, matrix[5] * scaleY)
+            # the distance of neighbouring output pixels in the level
+            if math.hypot(levelMatrix[0], levelMatrix[3]) >= 1 and \
+                    math.hypot(levelMatrix[1], levelMatrix[4]) >= 1:
+                break
+        return pilImg, levelMatrix
+
+
 def CropAndResize(pilImg, rect, size, draft=False):
+    effect = Picture.EFFECT_NONE
+    if isinstance(pilImg, ImagePyramid):
+        effect = pilImg.effect
+        pilImg, matrix = pilImg.GetLevel(rect, size)
+    else:
+        matrix = _GetRectMatrix(rect, size)
     if draft:
         filtr = Image.NEAREST
     else:
         filtr = Image.BILINEAR
     img = pilImg.transform(size,
                            Image.AFFINE,
-                           [rect[2] / float(size[0]), 0, rect[0],
-                            0, rect[3] / float(size[1]), rect[1]],
+                           matrix,
                            filtr)
-    return img
-
-
-def Transition(kind, pilImg1, pilImg2, percentage):
-    if kind == Picture.TRANS_FADE:
-        img = Image.blend(pilImg1, pilImg2, percentage)
-    elif kind == Picture.TRANS_ROLL:
-        xsize, ysize = pilImg1.size
-        delta = int(xsize * percentage)
-        part1 = pilImg2.crop((0, 0, delta, ysize))
-        part2 = pilImg1.crop((delta, 0, xsize, ysize))
-        image = pilImg2.copy()
-        image.paste(part2, (0, 0, xsize - delta, ysize))
-        image.paste(part1, (xsize - delta, 0, xsize, ysize))
-        img = image
-
+    if effect != Picture.EFFECT_NONE:
+        img = __ApplyEffect(img, effect)
     return img
 
 
@@ -132,70 +308,160 @@ def __CreateDummyImage(message):
     return img
 
 
-def __GetImage(picture):
+def __OpenImage(filename):
+    '''
+    Opens the image file, returns a tuple of the image and a flag that is True
+    if the file could not be opened and a dummy image is returned instead.
+    '''
     try:
-        img = Image.open(picture.GetFilename())
+        img = Image.open(filename)
         # open does not validate the image data, because it is not loaded yet
         # use thumbnail() instead of load, it checks image data much faster
         img.thumbnail((10, 10))
         # discard the thumbnail
-        img = Image.open(picture.GetFilename())
-        picture.SetDummy(False)
+        img = Image.open(filename)
+        return img, False
     except StandardError, err:
-        logging.debug("PILBackend.GetImage(%s): %s", picture.GetFilename(), err, exc_info=1)
-        img = __CreateDummyImage(str(err))
-        picture.SetDummy(True)
+        logging.debug("PILBackend.GetImage(%s): %s", filename, err, exc_info=1)
+        return __CreateDummyImage(str(err)), True
+
+
+def __GetImage(picture):
+    img, isDummy = __OpenImage(picture.GetFilename())
+    picture.SetDummy(isDummy)
     return img
 
 
 def __ProcessImage(img, picture):
-    if not picture.IsDummy():
+    return __ApplyRotationAndEffect(img, picture.IsDummy(),
+                                    picture.GetRotation(),
+                                    picture.GetEffect())
+
+
+def __ApplyRotationAndEffect(img, isDummy, rotation, effect):
+    if not isDummy:
         img = RotateExif(img)
-        rotation = picture.GetRotation() * -90
+        rotation = rotation * -90
         if rotation != 0:
             img = img.rotate(rotation)
+    return __ApplyEffect(img, effect)
 
-    if picture.GetEffect() == picture.EFFECT_BLACK_WHITE:
-        img = img.convert("L")
 
-    elif picture.GetEffect() == picture.EFFECT_SEPIA:
-
-        def make_linear_ramp(white):
-            # putpalette expects [r,g,b,r,g,b,...]
-            ramp = []
-            r, g, b = white
-            for i in range(255):
-                ramp.extend((r * i / 255, g * i / 255, b * i / 255))
-            return ramp
-
-        # make sepia ramp (tweak color as necessary)
-        sepia = make_linear_ramp((255, 240, 192))
-        img = img.convert("L")
-        img.putpalette(sepia)
+def __ApplyEffect(img, effect):
+    '''
+    Applies the effect and returns an RGB image. The image may be modified if
+    it is a grayscale image already.
+    '''
+    if effect in _EFFECT_PALETTES:
+        if img.mode != "L":
+            img = img.convert("L")
+        palette = _EFFECT_PALETTES[effect]
+        if palette is not None:
+            img.putpalette(palette)
 
     return img.convert("RGB")
 
 
-def GetImage(picture):
-    pilImg = __GetImage(picture)
-    pilImg = __ProcessImage(pilImg, picture)
+def __LoadImage(picture, scale=1.0, imageCache=None):
+    '''
+    Decodes the picture in file orientation, for effects as grayscale image.
+    Returns a tuple of the image, the full size of the picture, the EXIF
+    orientation and a flag that is True if a dummy image is returned.
+    '''
+    # crop and resize work on a single channel for effects on grayscale
+    mode = "L" if picture.GetEffect() in _EFFECT_PALETTES else "RGB"
+
+    cacheKey = None
+    if imageCache is not None:
+        cacheKey = imageCache.MakeKey(picture, mode)
+        cached = imageCache.Get(cacheKey, scale)
+        if cached is not None:
+            pilImg, fullSize, exifOrientation = cached
+            return pilImg, fullSize, exifOrientation, False
+
+    pilImg, isDummy = __OpenImage(picture.GetFilename())
+    fullSize = pilImg.size
+    if not isDummy and (scale < 1 or mode == "L"):
+        draftSize = None
+        if scale < 1:
+            # draft() only reduces the size as long as the result is not
+            # smaller than the requested size
+            draftSize = (int(math.ceil(fullSize[0] * scale)),
+                         int(math.ceil(fullSize[1] * scale)))
+        # JPEG files are decoded to grayscale directly
+        pilImg.draft(mode if mode == "L" else pilImg.mode, draftSize)
+
+    exifOrientation = 1
+    if not isDummy:
+        exifOrientation = GetExifOrientation(pilImg)
+    pilImg = pilImg.convert(mode)
+
+    if cacheKey is not None and not isDummy:
+        imageCache.Put(cacheKey, pilImg, fullSize, exifOrientation)
+    return pilImg, fullSize, exifOrientation, isDummy
+
+
+def GetImage(picture, imageCache=None):
+    '''
+    Loads the picture at full size. The decoded image is shared with the
+    renderer in the imageCache, the orientation and the effect are applied
+    to a copy.
+    :param picture: the picture to load
+    :param imageCache: an optional DecodedImageCache
+    '''
+    pilImg, fullSize, exifOrientation, isDummy = \
+        __LoadImage(picture, imageCache=imageCache)
+    picture.SetDummy(isDummy)
+
+    if not isDummy:
+        cached = pilImg
+        pilImg = RotateExif(pilImg, exifOrientation)
+        rotation = picture.GetRotation() * -90
+        if rotation != 0:
+            pilImg = pilImg.rotate(rotation)
+        if pilImg is cached and pilImg.mode == "L":
+            # the effect may modify a grayscale image
+            pilImg = pilImg.copy()
+    pilImg = __ApplyEffect(pilImg, picture.GetEffect())
+
     picture.SetWidth(pilImg.size[0])
     picture.SetHeight(pilImg.size[1])
     return pilImg
 
 
-def GetExifRotation(pilImg):
-    exifOrient = 274
-    rotation = 0
-    try:
-        exif = pilImg._getexif()  # pylint: disable=protected-access
-        if isinstance(exif, dict) and exif.has_key(exifOrient):
-            rotation = exif[exifOrient]
-    except AttributeError:
-        pass
-    except Exception, err:
-        logging.debug("PILBackend.RotateExif(): %s", err, exc_info=1)
+def GetImagePyramid(pictureSpec, resolution, minRectSize=None,
+                    imageCache=None):
+    '''
+    Loads the picture as ImagePyramid. If minRectSize is given JPEG files are
+    decoded at a reduced scale (1/2, 1/4 or 1/8) as long as the smallest rect
+    still gets at least one source pixel per output pixel. The image is kept
+    in file orientation, the EXIF orientation, the rotation and the effect of
+    the picture are applied by CropAndResize(). The pictureSpec is not
+    modified.
+    :param pictureSpec: the PictureSpec to load
+    :param resolution: the output resolution
+    :param minRectSize: the size of the smallest rect used for the picture
+    :param imageCache: an optional DecodedImageCache
+    '''
+    scale = 1.0
+    if minRectSize is not None \
+            and minRectSize[0] > 0 and minRectSize[1] > 0:
+        scale = min(scale,
+                    max(resolution[0] / float(minRectSize[0]),
+                        resolution[1] / float(minRectSize[1])))
+
+    pilImg, fullSize, exifOrientation, isDummy = \
+        __LoadImage(pictureSpec, scale, imageCache)
+    orientation = None
+    if not isDummy:
+        orientation = GetOrientationMatrix(fullSize, exifOrientation,
+                                           pictureSpec.GetRotation())
+    return ImagePyramid(pilImg, resolution, fullSize, orientation,
+                        pictureSpec.GetEffect())
+
 
+def GetExifRotation(pilImg):
+    rotation = GetExifOrientation(pilImg)
     if rotation == 3:
         # rotate 180
         return 2
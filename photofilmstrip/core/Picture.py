@@ -201,3 +201,59 @@ class Picture(Observable):
                             self.GetRotation(),
                             self.GetEffect())
         return key
+
+    def GetSpec(self, filename=None):
+        '''
+        Returns an immutable snapshot of the attributes needed for rendering.
+        :param filename: overrides the filename of the picture, e.g. for the
+                         files of a time lapse sequence
+        '''
+        return PictureSpec(filename or self._filename,
+                           self._rotation,
+                           self._effect,
+                           self._startRect,
+                           self._targetRect)
+
+
+class PictureSpec(object):
+    '''
+    Compact and immutable description of a picture used by the render tasks.
+    All tasks of one picture share the same PictureSpec instead of having
+    their own Picture copy.
+    '''
+
+    __slots__ = ("filename", "rotation", "effect",
+                 "startRect", "targetRect", "key")
+
+    def __init__(self, filename, rotation, effect, startRect, targetRect):
+        self.filename = filename
+        self.rotation = rotation
+        self.effect = effect
+        self.startRect = tuple(startRect)
+        self.targetRect = tuple(targetRect)
+        self.key = (filename, rotation, effect)
+
+    def __getstate__(self):
+        return (self.filename, self.rotation, self.effect,
+                self.startRect, self.targetRect)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def GetFilename(self):
+        return self.filename
+
+    def GetRotation(self):
+        return self.rotation
+
+    def GetEffect(self):
+        return self.effect
+
+    def GetStartRect(self):
+        return self.startRect
+
+    def GetTargetRect(self):
+        return self.targetRect
+
+    def GetKey(self):
+        return self.key
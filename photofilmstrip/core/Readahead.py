@@ -0,0 +1,145 @@
+# encoding: UTF-8
+#
+# PhotoFilmStrip - Creates movies out of your pictures.
+#
+# Copyright (C) 2017 Jens Goepfert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+
+import collections
+import logging
+import os
+import threading
+
+from photofilmstrip.core.tasks import TaskLoadPic
+
+
+class Readahead(object):
+    '''
+    Reads the picture files of upcoming tasks into the page cache of the
+    operating system, so decoding a file does not wait for slow storage like
+    network shares or spinning disks. The task stream is passed through
+    Iterate(), which creates the tasks some steps in advance and hands their
+    files to a pool of reader threads.
+    '''
+
+    # number of tasks that are created in advance
+    TASKS = 64
+    THREADS = 2
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, tasks=None, threads=None):
+        '''
+        :param tasks: the number of tasks that are created in advance
+        :param threads: the number of reader threads
+        '''
+        self.__taskCount = tasks or Readahead.TASKS
+        self.__threadCount = threads or Readahead.THREADS
+
+        self.__cond = threading.Condition()
+        self.__pending = collections.deque()
+        self.__active = False
+        self.__threads = []
+        # the files that were requested last, a file of a time lapse
+        # sequence is needed by consecutive tasks
+        self.__requested = collections.deque(maxlen=16)
+
+        self.__logger = logging.getLogger("Readahead")
+
+    def Iterate(self, tasks):
+        '''
+        Returns a generator that yields the tasks in the same order.
+        :param tasks: a list or an iterator of tasks
+        '''
+        self.__Start()
+        try:
+            window = collections.deque()
+            for task in tasks:
+                self.__Request(task)
+                window.append(task)
+                if len(window) > self.__taskCount:
+                    yield window.popleft()
+            while window:
+                yield window.popleft()
+        finally:
+            self.__Stop()
+
+    def __Start(self):
+        self.__active = True
+        for num in range(self.__threadCount):
+            thread = threading.Thread(name="readahead-{0}".format(num),
+                                      target=self.__Run)
+            thread.daemon = True
+            thread.start()
+            self.__threads.append(thread)
+
+    def __Stop(self):
+        with self.__cond:
+            self.__active = False
+            self.__pending.clear()
+            self.__cond.notify_all()
+        # a reader finishes the file it is reading
+        for thread in self.__threads:
+            thread.join()
+        self.__threads = []
+
+    def __Request(self, task):
+        for subTask in task.IterSubTasks():
+            if not isinstance(subTask, TaskLoadPic):
+                continue
+            filename = subTask.pictureSpec.GetFilename()
+            if filename in self.__requested:
+                continue
+            self.__requested.append(filename)
+            with self.__cond:
+                self.__pending.append(filename)
+                if len(self.__pending) > self.__taskCount:
+                    # the readers fell behind, the oldest file is probably
+                    # decoded already
+                    self.__pending.popleft()
+                self.__cond.notify()
+
+    def __Run(self):
+        while 1:
+            with self.__cond:
+                while self.__active and not self.__pending:
+                    self.__cond.wait()
+                if not self.__active:
+                    return
+                filename = self.__pending.popleft()
+
+            try:
+                _ReadFile(filename)
+            except (IOError, OSError), err:
+                # the error is reported when the file is decoded
+                self.__logger.debug("cannot read %s: %s", filename, err)
+
+
+def _ReadFile(filename):
+    '''
+    Loads the file into the page cache.
+    '''
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0,  # pylint: disable=no-member
+                             os.POSIX_FADV_WILLNEED)  # pylint: disable=no-member
+        else:
+            while os.read(fd, Readahead.CHUNK_SIZE):
+                pass
+    finally:
+        os.close(fd)
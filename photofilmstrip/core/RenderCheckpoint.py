@@ -0,0 +1,106 @@
+# encoding: UTF-8
+#
+# PhotoFilmStrip - Creates movies out of your pictures.
+#
+# Copyright (C) 2017 Jens Goepfert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+import json
+import logging
+import os
+import threading
+
+
+class RenderCheckpoint(object):
+    '''
+    Records the complete segments of a render in a file next to them, so an
+    aborted or crashed render can be resumed. The file is rewritten after
+    each segment, it also contains the number of frames that are complete
+    from the beginning of the video.
+    '''
+
+    FILENAME = "checkpoint.json"
+
+    def __init__(self, directory, key):
+        '''
+        :param directory: the directory of the segment files
+        :param key: identifies the render, a checkpoint of a render with
+                    another key is ignored
+        '''
+        self.__filename = os.path.join(directory, RenderCheckpoint.FILENAME)
+        self.__key = key
+        self.__lock = threading.Lock()
+        self.__segments = {}
+
+        self.__logger = logging.getLogger("RenderCheckpoint")
+
+    def Load(self):
+        '''
+        Reads the checkpoint of a former render with the same key.
+        Returns the filenames of the segments that are complete.
+        '''
+        try:
+            with open(self.__filename, "r") as fd:
+                data = json.load(fd)
+        except (IOError, ValueError) as err:
+            self.__logger.debug("no checkpoint loaded: %s", err)
+            return set()
+
+        if data.get("key") != self.__key:
+            self.__logger.info("checkpoint belongs to another render")
+            return set()
+
+        with self.__lock:
+            for filename, frameOffset, frameCount in data.get("segments", []):
+                if os.path.isfile(filename):
+                    self.__segments[filename] = (frameOffset, frameCount)
+        self.__logger.info("resuming at frame %s", self.GetFrameIndex())
+        return set(self.__segments)
+
+    def Add(self, segment):
+        '''
+        Records a complete segment and writes the checkpoint file.
+        '''
+        with self.__lock:
+            self.__segments[segment.filename] = (segment.frameOffset,
+                                                 segment.frameCount)
+            data = {"key": self.__key,
+                    "frameIndex": self.__GetFrameIndex(),
+                    "segments": [(filename, frameOffset, frameCount)
+                                 for filename, (frameOffset, frameCount)
+                                 in sorted(self.__segments.items())]}
+
+            tmpFilename = self.__filename + ".part"
+            with open(tmpFilename, "w") as fd:
+                json.dump(data, fd)
+            os.rename(tmpFilename, self.__filename)
+
+    def GetFrameIndex(self):
+        '''
+        Returns the number of frames that are complete without a gap from
+        the beginning of the video.
+        '''
+        with self.__lock:
+            return self.__GetFrameIndex()
+
+    def __GetFrameIndex(self):
+        frameIndex = 0
+        for frameOffset, frameCount in sorted(self.__segments.values()):
+            if frameOffset > frameIndex:
+                break
+            frameIndex = max(frameIndex, frameOffset + frameCount)
+        return frameIndex
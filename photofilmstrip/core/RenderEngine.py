@@ -19,30 +19,222 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
 
+import array
+import logging
 import os
 
-from photofilmstrip.core.tasks import TaskCropResize, TaskTrans, TaskSubtitle
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from photofilmstrip.core.tasks import (TaskCropResize, TaskTrans,
+                                      TaskSubtitle, TaskLoadPic,
+                                      TaskLoadSequencePic)
 from photofilmstrip.core.Picture import Picture
 from photofilmstrip.core.PicturePattern import PicturePattern
+from photofilmstrip.core.SequenceIndex import SequenceIndex
 from photofilmstrip.core.exceptions import RenderException
 
 
 class RenderEngine(object):
 
+    # rects that differ less than this (in pixels of the picture) produce the
+    # same frame
+    STATIC_TOLERANCE = 1 / 512.0
+
     def __init__(self, outputPath, profile, pics, draftMode):
         self._outputPath = outputPath
         self._profile = profile
         self._pics = pics
         self._draftMode = draftMode
 
-        self._tasks = []
+    def _Prepare(self, pics):
+        '''
+        Called before the units are created.
+        '''
+        pass
+
+    def _GeneratePreTasks(self, pics):
+        '''
+        Yields the tasks that do not belong to a unit and do not produce
+        frames.
+        '''
+        return iter(())
 
-    def _PrepareTasks(self, pics):
+    def _CountUnitFrames(self, pics, idxPic):
         raise NotImplementedError()
 
+    def _GenerateUnitTasks(self, pics, idxPic):
+        raise NotImplementedError()
+
+    def _IterStaticRuns(self, pathRects):
+        '''
+        Groups consecutive rects that produce the same frame. Yields tuples
+        of the rect and the number of frames it is shown.
+        :param pathRects: the rects of consecutive frames
+        '''
+        runRect = None
+        count = 0
+        for rect in pathRects:
+            if runRect is not None and \
+                    max(abs(rect[0] - runRect[0]),
+                        abs(rect[1] - runRect[1]),
+                        abs(rect[2] - runRect[2]),
+                        abs(rect[3] - runRect[3])) < self.STATIC_TOLERANCE:
+                count += 1
+                continue
+
+            if runRect is not None:
+                yield runRect, count
+            runRect = rect
+            count = 1
+
+        if runRect is not None:
+            yield runRect, count
+
+    def GetUnits(self):
+        '''
+        Returns a list of RenderUnits, one for each picture.
+        '''
+        self._Prepare(self._pics)
+        units = []
+        frameOffset = 0
+        for idxPic in range(len(self._pics)):
+            frameCount = self._CountUnitFrames(self._pics, idxPic)
+            units.append(RenderUnit(self, idxPic, frameOffset, frameCount))
+            frameOffset += frameCount
+        return units
+
     def GetTasks(self):
-        self._PrepareTasks(self._pics)
-        return self._tasks
+        '''
+        Returns a generator that creates the tasks lazily while the render
+        job is consuming them.
+        '''
+        units = self.GetUnits()
+        for task in self._GeneratePreTasks(self._pics):
+            yield task
+        for unit in units:
+            for task in unit.GenerateTasks():
+                yield task
+
+    def GetSegmentTasks(self, segments, laneCount=None):
+        '''
+        Returns a generator that creates the tasks of the given segments.
+        The segments are distributed on lanes, each lane renders its
+        segments one after another. The tasks of the lanes are interleaved,
+        so all lanes are rendered at the same time. Each task knows the
+        index of its segment.
+        :param segments: a list of lists of consecutive RenderUnits, empty
+                         segments are skipped
+        :param laneCount: the number of lanes, by default each segment has
+                          its own lane
+        '''
+        pending = [idxSegment for idxSegment, units in enumerate(segments)
+                   if units]
+        if laneCount is None:
+            laneCount = len(pending)
+        laneCount = max(1, min(laneCount, len(pending)))
+
+        def _LaneTasks(idxLane):
+            for idxSegment in pending[idxLane::laneCount]:
+                for unit in segments[idxSegment]:
+                    for task in unit.GenerateTasks():
+                        task.SetSegment(idxSegment)
+                        yield task
+
+        self._Prepare(self._pics)
+        for task in self._GeneratePreTasks(self._pics):
+            yield task
+
+        lanes = [_LaneTasks(idxLane) for idxLane in range(laneCount)]
+        while lanes:
+            for lane in lanes[:]:
+                try:
+                    yield next(lane)
+                except StopIteration:
+                    lanes.remove(lane)
+
+    def GetFrameCount(self):
+        '''
+        Returns the number of frames the tasks of GetTasks() will produce
+        without creating them. Tasks without result count as one frame.
+        '''
+        return len(list(self._GeneratePreTasks(self._pics))) + \
+            sum(unit.frameCount for unit in self.GetUnits())
+
+
+class RenderUnit(object):
+    '''
+    The frames of one picture including the transition from the previous
+    picture.
+    '''
+
+    __slots__ = ("engine", "idxPic", "frameOffset", "frameCount")
+
+    def __init__(self, engine, idxPic, frameOffset, frameCount):
+        self.engine = engine
+        self.idxPic = idxPic
+        self.frameOffset = frameOffset
+        self.frameCount = frameCount
+
+    def GenerateTasks(self):
+        # pylint: disable=protected-access
+        return self.engine._GenerateUnitTasks(self.engine._pics, self.idxPic)
+
+    def GetKey(self):
+        '''
+        Returns a tuple that changes if any frame of the unit changes. It is
+        built from the keys of the tasks, the state of the picture files
+        and the comments of the picture and its predecessor.
+        '''
+        # pylint: disable=protected-access
+        pics = self.engine._pics[max(0, self.idxPic - 1):self.idxPic + 1]
+        taskKeys = []
+        files = {}
+        for task in self.GenerateTasks():
+            taskKeys.append((task.GetKey(), task.GetFrameCount()))
+            for subTask in task.IterSubTasks():
+                if isinstance(subTask, TaskLoadPic):
+                    filename = subTask.pictureSpec.GetFilename()
+                    if filename not in files:
+                        files[filename] = _GetFileState(filename)
+        return (self.frameCount,
+                tuple(taskKeys),
+                tuple(sorted(files.items())),
+                tuple(pic.GetComment() for pic in pics))
+
+
+def _GetFileState(filename):
+    try:
+        stat = os.stat(filename)
+        return stat.st_mtime, stat.st_size
+    except OSError:
+        return None
+
+
+def SplitUnits(units, count):
+    '''
+    Splits the units into at most count lists of consecutive units with
+    nearly the same number of frames.
+    '''
+    totalFrames = sum(unit.frameCount for unit in units)
+    segments = []
+    current = []
+    currentFrames = 0
+    doneFrames = 0
+    for unit in units:
+        current.append(unit)
+        currentFrames += unit.frameCount
+        target = totalFrames * (len(segments) + 1) / float(count)
+        if doneFrames + currentFrames >= target and len(segments) < count - 1:
+            segments.append(current)
+            doneFrames += currentFrames
+            current = []
+            currentFrames = 0
+    if current:
+        segments.append(current)
+    return segments
 
 
 class RenderEngineSlideshow(RenderEngine):
@@ -85,8 +277,29 @@ class RenderEngineSlideshow(RenderEngine):
                          fr * \
                          self.__picCountFactor))
 
+    def __GetCounts(self, pics, idxPic):
+        '''
+        Returns the number of frames of the picture, of the transition to the
+        next picture and of the transition from the previous picture.
+        '''
+        picCount = self.__GetPicCount(pics[idxPic])
+        transCount = 0
+        if idxPic < (len(pics) - 1):
+            # last pic has no transition
+            transCount = self.__GetTransCount(pics[idxPic])
+        transCountBefore = 0
+        if idxPic > 0:
+            transCountBefore = self.__GetTransCount(pics[idxPic - 1])
+        return picCount, transCount, transCountBefore
+
+    def __GetPathRects(self, pics, idxPic):
+        picCount, transCount, transCountBefore = self.__GetCounts(pics, idxPic)
+        cp = ComputePath(pics[idxPic],
+                         picCount + transCount + transCountBefore)
+        return cp.GetPathRects()
+
     def __TransAndFinal(self, infoText, trans,
-                        picFrom, picTo,
+                        taskLoadPicFrom, taskLoadPicTo,
                         pathRectsFrom, pathRectsTo):
         if len(pathRectsFrom) != len(pathRectsTo):
             raise RuntimeError()
@@ -94,148 +307,232 @@ class RenderEngineSlideshow(RenderEngine):
         count = len(pathRectsFrom)
         for idx in range(count):
             task = TaskTrans(trans, idx / float(count),
-                             picFrom.Copy(), pathRectsFrom[idx],
-                             picTo.Copy(), pathRectsTo[idx],
-                             self._profile.GetResolution())
+                             taskLoadPicFrom, pathRectsFrom[idx],
+                             taskLoadPicTo, pathRectsTo[idx])
             task.SetInfo(infoText)
             task.SetDraft(self._draftMode)
-            self._tasks.append(task)
+            yield task
 
-        return True
-
-    def _PrepareTasks(self, pics):
+    def _Prepare(self, pics):
         self.__picCountFactor = self.__GetPicCountFactor(pics)
 
-        taskSub = TaskSubtitle(self._outputPath,
-                               self.__picCountFactor,
-                               pics)
-        self._tasks.append(taskSub)
-
-        pathRectsBefore = []
-        picBefore = None
-        transCountBefore = 0
-
-        for idxPic, pic in enumerate(pics):
-            picCount = self.__GetPicCount(pic)
-            transCount = 0
-            if idxPic < (len(pics) - 1):
-                # last pic has no transition
-                transCount = self.__GetTransCount(pic)
-
-            cp = ComputePath(pic, picCount + transCount + transCountBefore)
-            pathRects = cp.GetPathRects()
-
-            if idxPic > 0 and idxPic < len(pics):
-                # first and last pic has no transition
-                infoText = _(u"processing transition %d/%d") % (idxPic + 1, len(pics))
-
-                if transCountBefore > 0:
-                    phase2a = pathRectsBefore[-transCountBefore:]
-                    phase2b = pathRects[:transCountBefore]
-                    if not self.__TransAndFinal(infoText,
-                                                pics[idxPic - 1].GetTransition(),
-                                                picBefore, pic,
-                                                phase2a, phase2b):
-                        break
-
-            infoText = _(u"processing image %d/%d") % (idxPic + 1, len(pics))
-
-            if transCount > 0:
-                # transition needs pictures, subtract them from movement
-                _pathRects = pathRects[transCountBefore:-transCount]
-            else:
-                # transition needs no pictures, use them all for movement
-                _pathRects = pathRects[transCountBefore:]
-
-            for rect in _pathRects:
-                task = TaskCropResize(pic.Copy(), rect,
-                                      self._profile.GetResolution())
-                task.SetInfo(infoText)
-                task.SetDraft(self._draftMode)
-                self._tasks.append(task)
+    def _GeneratePreTasks(self, pics):
+        yield TaskSubtitle(self._outputPath,
+                           self.__picCountFactor,
+                           pics)
+
+    def _CountUnitFrames(self, pics, idxPic):
+        picCount, __, transCountBefore = self.__GetCounts(pics, idxPic)
+        return picCount + transCountBefore
+
+    def _GenerateUnitTasks(self, pics, idxPic):
+        pic = pics[idxPic]
+        resolution = self._profile.GetResolution()
+        picCount, transCount, transCountBefore = self.__GetCounts(pics, idxPic)
+        taskLoadPic = TaskLoadPic(pic.GetSpec(), resolution)
+        pathRects = self.__GetPathRects(pics, idxPic)
+
+        if transCountBefore > 0:
+            # first pic has no transition
+            infoText = _(u"processing transition %d/%d") % (idxPic + 1, len(pics))
+
+            picBefore = pics[idxPic - 1]
+            taskLoadPicBefore = TaskLoadPic(picBefore.GetSpec(), resolution)
+            pathRectsBefore = self.__GetPathRects(pics, idxPic - 1)
+            phase2a = pathRectsBefore[-transCountBefore:]
+            phase2b = pathRects[:transCountBefore]
+            for task in self.__TransAndFinal(infoText,
+                                             picBefore.GetTransition(),
+                                             taskLoadPicBefore,
+                                             taskLoadPic,
+                                             phase2a, phase2b):
+                yield task
+
+        infoText = _(u"processing image %d/%d") % (idxPic + 1, len(pics))
+
+        if transCount > 0:
+            # transition needs pictures, subtract them from movement
+            _pathRects = pathRects[transCountBefore:-transCount]
+        else:
+            # transition needs no pictures, use them all for movement
+            _pathRects = pathRects[transCountBefore:]
 
-            picBefore = pic
-            pathRectsBefore = pathRects
-            transCountBefore = transCount
+        for rect, frameCount in self._IterStaticRuns(_pathRects):
+            task = TaskCropResize(taskLoadPic, rect)
+            task.SetFrameCount(frameCount)
+            task.SetInfo(infoText)
+            task.SetDraft(self._draftMode)
+            yield task
 
 
 class RenderEngineTimelapse(RenderEngine):
 
-    def _PrepareTasks(self, pics):
-        picBefore = None
-
-        picNum = None
-
-        idxPic = 0
-        while idxPic < len(pics):
-            pic = pics[idxPic]
+    def __init__(self, outputPath, profile, pics, draftMode):
+        RenderEngine.__init__(self, outputPath, profile, pics, draftMode)
+        # the SequenceIndex of each sequence, a directory is scanned once
+        self.__indexes = {}
+        self.__checked = False
+        self.__logger = logging.getLogger("RenderEngineTimelapse")
+
+    def __GetSequenceIndex(self, filename, picPattern):
+        key = (os.path.dirname(filename), picPattern.prefix,
+               picPattern.postfix, picPattern.digits)
+        index = self.__indexes.get(key)
+        if index is None:
+            index = SequenceIndex(*key)
+            self.__indexes[key] = index
+        return index
+
+    def _Prepare(self, pics):
+        if self.__checked:
+            return
+        self.__checked = True
+
+        # report the missing files before the rendering starts
+        for idxPic, pic in enumerate(pics):
             picPattern = PicturePattern.Create(pic.GetFilename())
             if not picPattern.IsOk():
+                continue
+            lastNum = picPattern.num
+            if idxPic < (len(pics) - 1):
+                nextPicPattern = PicturePattern.Create(
+                    pics[idxPic + 1].GetFilename())
+                if nextPicPattern.IsOk():
+                    lastNum = nextPicPattern.num
+
+            index = self.__GetSequenceIndex(pic.GetFilename(), picPattern)
+            for first, last in index.GetGaps(picPattern.num, lastNum):
+                missing = os.path.basename(index.MakeFilename(first))
+                if last > first:
+                    missing += " - " + os.path.basename(
+                        index.MakeFilename(last))
+                self.__logger.warning("missing file of the sequence: %s, "
+                                      "the previous file is shown instead",
+                                      missing)
+
+    def _CountUnitFrames(self, pics, idxPic):
+        pic = pics[idxPic]
+        picPattern = PicturePattern.Create(pic.GetFilename())
+        if not picPattern.IsOk():
+            # raised while generating the tasks
+            return 0
+
+        if idxPic < (len(pics) - 1):
+            nextPicPattern = PicturePattern.Create(
+                pics[idxPic + 1].GetFilename())
+            if not nextPicPattern.IsOk():
+                return 0
+            picCount = nextPicPattern.num - picPattern.num + 1
+        else:
+            picCount = 1
+
+        picDur = int(pic.GetDuration())
+        transDur = int(pic.GetTransitionDuration())
+        return max(0, (picDur * picCount) + (transDur * (picCount - 1)))
+
+    def _GenerateUnitTasks(self, pics, idxPic):
+        resolution = self._profile.GetResolution()
+        taskLoadPicBefore = None
+
+        pic = pics[idxPic]
+        picPattern = PicturePattern.Create(pic.GetFilename())
+        if not picPattern.IsOk():
+            raise RenderException(
+                (u"Filename '%s' does not match a number pattern "
+                 u"which is necessary for a time lapse "
+                 u"slide show!") % pic.GetFilename())
+
+        picNum = picPattern.num
+        picDur = int(pic.GetDuration())
+        transDur = int(pic.GetTransitionDuration())
+        if idxPic < (len(pics) - 1):
+            # get number from next pic
+            nextPic = pics[idxPic + 1]
+            nextPicPattern = PicturePattern.Create(nextPic.GetFilename())
+            if not nextPicPattern.IsOk():
+                return
+
+            picCount = nextPicPattern.num - picNum + 1
+            if picCount < 0:
                 raise RenderException(
-                    (u"Filename '%s' does not match a number pattern "
-                     u"which is necessary for a time lapse "
-                     u"slide show!") % pic.GetFilename())
+                    (u"The picture counter is not "
+                     u"increasing: %s") % nextPic.GetFilename())
+        else:
+            # no next pic so add the final image
+            picCount = 1
+
+        rectCount = (picDur * picCount) + (transDur * (picCount - 1))
+        cp = ComputePath(pic, rectCount)
+
+        index = self.__GetSequenceIndex(pic.GetFilename(), picPattern)
+        filenameBefore = None
+        # rects of the transition from the previous file
+        rectsTrans = []
+        idxRect = 0
+        while idxRect < rectCount:
+            filename = index.GetFilename(picNum)
+            if filename is None:
+                if filenameBefore is None:
+                    # nothing to show instead, the missing file is rendered
+                    # as error image
+                    filename = index.MakeFilename(picNum)
+                else:
+                    filename = filenameBefore
+
+            # only the rects of the frames that need this file are computed,
+            # so the memory does not grow with the length of the sequence
+            idxRect += len(rectsTrans)
+            rects = [cp.GetRect(idx)
+                     for idx in xrange(idxRect,
+                                       min(idxRect + picDur, rectCount))]
+            idxNext = idxRect + len(rects)
+            rectsNext = [cp.GetRect(idx)
+                         for idx in xrange(idxNext,
+                                           min(idxNext + transDur,
+                                               rectCount))]
+
+            # the file is decoded once at the scale of all its rects, the
+            # result is shared with the transition to the next file
+            window = rectsTrans + rects + rectsNext
+            minRectSize = None
+            if window:
+                minRectSize = (min(rect[2] for rect in window),
+                               min(rect[3] for rect in window))
+            taskLoadPic = TaskLoadSequencePic(pic.GetSpec(filename),
+                                              resolution, minRectSize)
+
+            for idxTrans, rect in enumerate(rectsTrans):
+                task = TaskTrans(pic.GetTransition(), (idxTrans + 1) / float(transDur + 1),
+                                 taskLoadPicBefore, rect,
+                                 taskLoadPic, rect)
+                task.SetInfo(_(u"processing transition %d/%d") % (picNum, idxTrans + 1))
+                task.SetDraft(self._draftMode)
+                yield task
 
-            picNum = picPattern.num
-            picDur = int(pic.GetDuration())
-            transDur = int(pic.GetTransitionDuration())
-            if idxPic < (len(pics) - 1):
-                # get number from next pic
-                nextPic = pics[idxPic + 1]
-                nextPicPattern = PicturePattern.Create(nextPic.GetFilename())
-                if not nextPicPattern.IsOk():
-                    idxPic += 1
-                    continue
-
-                picCount = nextPicPattern.num - picNum + 1
-                if picCount < 0:
-                    raise RenderException(
-                        (u"The picture counter is not "
-                         u"increasing: %s") % nextPic.GetFilename())
-            else:
-                # no next pic so add the final image
-                picCount = 1
-
-            cp = ComputePath(pic, (picDur * picCount) + (transDur * (picCount - 1)))
-            pathRects = cp.GetPathRects()
-
-            picDir = os.path.dirname(pic.GetFilename())
-            idxRect = 0
-            while idxRect < len(pathRects):
-                picCopy = pic.Copy()
-                picCopy._filename = os.path.join(
-                    picDir,
-                    "{0}{1}{2}".format(picPattern.prefix,
-                                       ("%%0%dd" % picPattern.digits) % picNum,
-                                       picPattern.postfix))
-
-                if transDur > 0 and picBefore:
-                    for idxTrans in range(transDur):
-                        task = TaskTrans(pic.GetTransition(), (idxTrans + 1) / float(transDur + 1),
-                                         picBefore.Copy(), pathRects[idxRect],
-                                         picCopy.Copy(), pathRects[idxRect],
-                                         self._profile.GetResolution())
-                        task.SetInfo(_(u"processing transition %d/%d") % (picNum, idxTrans + 1))
-                        task.SetDraft(self._draftMode)
-                        self._tasks.append(task)
-                        idxRect += 1
-
-                for __ in range(picDur):
-                    task = TaskCropResize(picCopy.Copy(), pathRects[idxRect],
-                                          self._profile.GetResolution())
-                    task.SetInfo(_(u"processing image %d/%d") % (picNum, __ + 1))
-                    task.SetDraft(self._draftMode)
-                    self._tasks.append(task)
-                    idxRect += 1
-
-                picNum += 1
-                picBefore = picCopy
-
-            picBefore = None
-            idxPic += 1
+            idxFrame = 0
+            for rect, frameCount in self._IterStaticRuns(rects):
+                task = TaskCropResize(taskLoadPic, rect)
+                task.SetFrameCount(frameCount)
+                task.SetInfo(_(u"processing image %d/%d") % (picNum, idxFrame + 1))
+                task.SetDraft(self._draftMode)
+                yield task
+                idxFrame += frameCount
+            idxRect = idxNext
+
+            picNum += 1
+            taskLoadPicBefore = taskLoadPic
+            filenameBefore = filename
+            rectsTrans = rectsNext
 
 
 class ComputePath(object):
+    '''
+    Computes the rects of the motion path of a picture. A single rect can be
+    requested without computing the whole path.
+    '''
+
+    # the whole path is evaluated with numpy if it is available
+    USE_NUMPY = numpy is not None
 
     def __init__(self, pic, picCount):
         px1, py1 = pic.GetStartRect()[:2]
@@ -256,29 +553,114 @@ class ComputePath(object):
             clazz = DelayedMovement
         else:
             clazz = AccelMovement
-        mX = clazz(cx2 - cx1, picCount, cx1)
-        mY = clazz(cy2 - cy1, picCount, cy1)
-        mW = clazz(w2 - w1, picCount, w1)
-        mH = clazz(h2 - h1, picCount, h1)
-
-        pathRects = []
-        for step in xrange(picCount):
-            px = mX.Get(step)
-            py = mY.Get(step)
-            width = mW.Get(step)
-            height = mH.Get(step)
-
-            rect = (px - width / 2.0,
-                    py - height / 2.0,
-                    width,
-                    height)
-
-            pathRects.append(rect)
-        self.pathRects = pathRects
+        self.picCount = picCount
+        self.mX = clazz(cx2 - cx1, picCount, cx1)
+        self.mY = clazz(cy2 - cy1, picCount, cy1)
+        self.mW = clazz(w2 - w1, picCount, w1)
+        self.mH = clazz(h2 - h1, picCount, h1)
+
+        self.pathRects = None
+
+    def GetRect(self, step):
+        '''
+        Returns the rect of a single frame of the path.
+        :param step: the index of the frame
+        '''
+        if not 0 <= step < self.picCount:
+            raise IndexError(step)
+        px = self.mX.Get(step)
+        py = self.mY.Get(step)
+        width = self.mW.Get(step)
+        height = self.mH.Get(step)
+        return (px - width / 2.0,
+                py - height / 2.0,
+                width,
+                height)
 
     def GetPathRects(self):
+        '''
+        Returns the rects of all frames as PathRects.
+        '''
+        if self.pathRects is None:
+            if ComputePath.USE_NUMPY and self.picCount > 0:
+                data = self.__ComputeArray()
+            else:
+                data = self.__ComputeList()
+            self.pathRects = PathRects(data)
         return self.pathRects
 
+    def __ComputeList(self):
+        getX, getY = self.mX.Get, self.mY.Get
+        getW, getH = self.mW.Get, self.mH.Get
+        values = []
+        append = values.append
+        for step in xrange(self.picCount):
+            width = getW(step)
+            height = getH(step)
+            append(getX(step) - width / 2.0)
+            append(getY(step) - height / 2.0)
+            append(width)
+            append(height)
+        return array.array("d", values)
+
+    def __ComputeArray(self):
+        steps = numpy.arange(self.picCount, dtype=numpy.float64)
+        px = self.mX.GetArray(steps)
+        py = self.mY.GetArray(steps)
+        width = self.mW.GetArray(steps)
+        height = self.mH.GetArray(steps)
+
+        rects = numpy.empty((self.picCount, 4), dtype=numpy.float64)
+        rects[:, 0] = px - width / 2.0
+        rects[:, 1] = py - height / 2.0
+        rects[:, 2] = width
+        rects[:, 3] = height
+        return rects.ravel()
+
+
+class PathRects(object):
+    '''
+    A sequence of the rects of a motion path, stored as a flat array of
+    doubles. Slicing returns a view on the same array, the rects are returned
+    as tuples of floats.
+    '''
+
+    __slots__ = ("_data", "_start", "_stop")
+
+    def __init__(self, data, start=0, stop=None):
+        '''
+        :param data: a numpy array or an array.array of 4 values per rect
+        :param start: index of the first rect of the view
+        :param stop: index after the last rect of the view
+        '''
+        self._data = data
+        self._start = start
+        self._stop = len(data) // 4 if stop is None else stop
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if step != 1:
+                return [self[i] for i in xrange(start, stop, step)]
+            return PathRects(self._data,
+                             self._start + start,
+                             self._start + max(start, stop))
+
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        pos = (self._start + idx) * 4
+        return tuple(self._data[pos:pos + 4].tolist())
+
+    def __iter__(self):
+        values = self._data[self._start * 4:self._stop * 4].tolist()
+        for pos in xrange(0, len(values), 4):
+            yield tuple(values[pos:pos + 4])
+
 
 class LinearMovement(object):
 
@@ -297,6 +679,12 @@ class LinearMovement(object):
         t = float(t)
         return self._v * t + self._s0
 
+    def GetArray(self, steps):
+        '''
+        Same as Get() for a numpy array of steps.
+        '''
+        return self._v * steps + self._s0
+
 
 class AccelMovement(object):
 
@@ -320,18 +708,34 @@ class AccelMovement(object):
     def Get(self, t):
         return self._a * t ** 3 + self._b * t ** 2 + self._c * t + self._d
 
+    def GetArray(self, steps):
+        '''
+        Same as Get() for a numpy array of steps.
+        '''
+        return self._a * steps ** 3 + self._b * steps ** 2 + \
+            self._c * steps + self._d
+
 
 class DelayedMovement(AccelMovement):
 
     def __init__(self, s, t, s0):
         AccelMovement.__init__(self, s, t / 2, s0)
         self._t4th = t / 4
-        self._sAccel = None
+        # the movement stops at this step and keeps its position
+        self._tLast = int(self._t * 2) - self._t4th - 1
 
     def Get(self, t):
-        if t < self._t4th:
-            self._sAccel = self._s0
-        elif t < (self._t * 2) - self._t4th:
-            self._sAccel = AccelMovement.Get(self, t - self._t4th)
-        return self._sAccel
-
+        if t < self._t4th or self._tLast < self._t4th:
+            return self._s0
+        return AccelMovement.Get(self, min(t, self._tLast) - self._t4th)
+
+    def GetArray(self, steps):
+        '''
+        Same as Get() for a numpy array of steps.
+        '''
+        if self._tLast < self._t4th:
+            return numpy.full(steps.shape, self._s0)
+        result = AccelMovement.GetArray(
+            self, numpy.minimum(steps, self._tLast) - self._t4th)
+        result[steps < self._t4th] = self._s0
+        return result
@@ -19,9 +19,18 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
 
+import collections
 import logging
 import threading
+import time
 
+import Queue
+
+from photofilmstrip.core.DecodedImageCache import DecodedImageCache
+from photofilmstrip.core.PILBackend import ImagePyramid
+from photofilmstrip.core.RenderStats import RenderStats
+from photofilmstrip.lib.jobimpl.ProcessWorker import ProcessWorker
+from photofilmstrip.lib.jobimpl.Tracer import Tracer
 from photofilmstrip.lib.jobimpl.VisualJob import VisualJob
 from photofilmstrip.lib.jobimpl.Worker import JobAbortedException
 from photofilmstrip.lib.jobimpl.WorkLoad import WorkLoad
@@ -29,48 +38,178 @@ from photofilmstrip.lib.jobimpl.WorkLoad import WorkLoad
 
 class RenderJob(VisualJob):
 
-    def __init__(self, name, renderer, tasks):
-        VisualJob.__init__(self, name, groupId="render")
+    # number of tasks that are registered in advance, must be at least 2 so
+    # that the result of a shared subtask is not released between two
+    # consecutive tasks
+    LOOKAHEAD = 16
+
+    # default limits of the results that are finished but wait for a
+    # previous result before they can be passed to the renderer
+    REORDER_WINDOW = 32
+    REORDER_BYTES = 512 * 1024 * 1024
+
+    # default number of upcoming pictures that are loaded in advance, the
+    # loaded pictures waiting in the lookahead must not exceed the bytes
+    PREFETCH_PICTURES = 2
+    PREFETCH_BYTES = 256 * 1024 * 1024
+    # the lookahead is extended up to this number of tasks to find the
+    # upcoming pictures
+    PREFETCH_LOOKAHEAD = 1000
+
+    def __init__(self, name, renderer, tasks, frameCount=None,
+                 groupId="render"):
+        '''
+        :param name: the name of the job
+        :param renderer: the renderer the results are passed to
+        :param tasks: a list or an iterator that yields the tasks
+        :param frameCount: the number of frames of all tasks, necessary if
+                           tasks is an iterator
+        :param groupId: the worker group that processes the job
+        '''
+        VisualJob.__init__(self, name, groupId=groupId)
         self.renderer = renderer
-        self.tasks = tasks
-
-        self.SetMaxProgress(len(tasks))
-
-        self.resultsForRendererLock = threading.Lock()
+        if frameCount is None:
+            frameCount = sum(task.GetFrameCount() for task in tasks)
+        self.tasks = iter(tasks)
+        self.taskIdx = 0
+        self.lookahead = collections.deque()
+        # prerequisites of the tasks in the lookahead in order of appearance,
+        # mapped to the number of tasks that need them
+        self.lookaheadPrerequisites = collections.OrderedDict()
+        self.prefetchPictures = RenderJob.PREFETCH_PICTURES
+        self.prefetchBytes = RenderJob.PREFETCH_BYTES
+
+        self.SetMaxProgress(frameCount)
+
+        self.resultsForRendererCond = threading.Condition()
         self.resultForRendererIdx = 0
         self.resultsForRendererCache = {}
-
+        self.resultsForRendererBytes = 0
+        self.reorderWindow = RenderJob.REORDER_WINDOW
+        self.reorderBytes = RenderJob.REORDER_BYTES
+        # the last result passed to the renderer, it replaces failed results
+        self.lastResultForRenderer = None
+        self.failedFrames = 0
+
+        self.taskResultCacheLock = threading.Lock()
         self.taskResultCache = {}
+        # the keys of the subtasks the current task of a worker requested
+        self.consumedSubTasks = threading.local()
         self.finalizeHandler = self.renderer.GetFinalizeHandler()
 
         self.__logger = logging.getLogger("RenderJob")
 
+    def SetReorderWindow(self, results=None, maxBytes=None):
+        '''
+        Limits how far the workers may run ahead of the oldest result that
+        is not passed to the renderer yet. A new workload is handed out only
+        if less than results tasks are in progress or waiting and the
+        waiting results take less than maxBytes.
+        :param results: the number of tasks, None for no limit
+        :param maxBytes: the size of the waiting results, None for no limit
+        '''
+        self.reorderWindow = results
+        self.reorderBytes = maxBytes
+
+    def SetPrefetch(self, pictures, maxBytes=None):
+        '''
+        Configures the loading of upcoming pictures while the frames of the
+        current picture are rendered.
+        :param pictures: the number of pictures to load in advance, 0
+                         disables the prefetch
+        :param maxBytes: no picture is loaded in advance while the loaded
+                         pictures of the lookahead take more memory, None
+                         for no limit
+        '''
+        self.prefetchPictures = pictures
+        self.prefetchBytes = maxBytes
+
+    def __IsReorderWindowFull(self, idx):
+        if idx == self.resultForRendererIdx:
+            # the oldest result is always processed, otherwise the window
+            # would never move on
+            return False
+        if self.reorderWindow is not None and \
+                idx - self.resultForRendererIdx >= self.reorderWindow:
+            return True
+        if self.reorderBytes is not None and \
+                self.resultsForRendererBytes >= self.reorderBytes:
+            return True
+        return False
+
     def GetOutputPath(self):
         return self.renderer.GetOutputPath()
 
     def Done(self):
+        # the workers are finished, a task generator of an aborted job is
+        # closed to release its resources, e.g. the threads of Readahead
+        close = getattr(self.tasks, "close", None)
+        if close is not None:
+            close()
+
         if self.IsAborted():
             self.renderer.ProcessAbort()
         self.renderer.Finalize()
+        if RenderStats().IsEnabled():
+            RenderStats().Stop()
 
         self.__logger.debug("task cache: %s; result cache: %s",
                            len(self.taskResultCache),
                            len(self.resultsForRendererCache))
+        self.__logger.debug("decoded image cache: %s",
+                            DecodedImageCache().GetStatistics())
+        if self.failedFrames:
+            self.__logger.error("%s: %s frames could not be rendered and "
+                                "show the previous frame",
+                                self.GetName(), self.failedFrames)
 
     def Begin(self):
-        # prepare task queue
-        self.__logger.debug("%s: prepare task queue", self.GetName())
-        for idx, task in enumerate(self.tasks):
+        if RenderStats().IsEnabled():
+            RenderStats().Start()
+        # prepare the renderer, creates the sink pipe
+        self.renderer.Prepare()
+
+    def _FillLookahead(self):
+        '''
+        Pulls tasks from the task iterator until LOOKAHEAD tasks are waiting
+        and registers the results they need. Tasks are registered before
+        the previous ones are processed, so results of subtasks that are
+        shared by consecutive tasks stay in the cache.
+        '''
+        while len(self.lookahead) < RenderJob.LOOKAHEAD or \
+                (len(self.lookaheadPrerequisites) <= self.prefetchPictures and
+                 len(self.lookahead) < RenderJob.PREFETCH_LOOKAHEAD):
+            try:
+                task = next(self.tasks)
+            except StopIteration:
+                break
+
+            prerequisites = []
             for subTask in task.IterSubTasks():
-                self._RegisterTaskResult(subTask, True)
+                trce = self._RegisterTaskResult(subTask, True)
+                if not subTask.subTasks and trce not in prerequisites:
+                    # subtasks without own subtasks (loading the pictures)
+                    # are scheduled as separate workloads
+                    prerequisites.append(trce)
 
             self._RegisterTaskResult(task, False)
 
-            prt = RendererResultTask(idx, task)
-            self.AddWorkLoad(prt)
+            for trce in prerequisites:
+                self.lookaheadPrerequisites[trce] = \
+                    self.lookaheadPrerequisites.get(trce, 0) + 1
 
-        # prepare the renderer, creates the sink pipe
-        self.renderer.Prepare()
+            self.lookahead.append(RendererResultTask(self.taskIdx, task,
+                                                     prerequisites))
+            self.taskIdx += 1
+
+    def __RemoveFromLookahead(self, task):
+        self.lookahead.remove(task)
+        for trce in task.prerequisites:
+            count = self.lookaheadPrerequisites[trce] - 1
+            if count == 0:
+                del self.lookaheadPrerequisites[trce]
+            else:
+                self.lookaheadPrerequisites[trce] = count
 
     def _RegisterTaskResult(self, task, isSubTask):
         if not self.finalizeHandler.UseSmartFinalize() or isSubTask:
@@ -80,27 +219,114 @@ class RenderJob(VisualJob):
             finalizeHandler = self.finalizeHandler
         # make sure that a real sub task is not processed from FinalizeHandler
         # so generate a special key for subtasks
-        key = "{0}{1}".format(task.GetKey(), isSubTask)
-        if key in self.taskResultCache:
-            trce = self.taskResultCache[key]
-            isNew = False
-        else:
-            trce = TaskResultCacheEntry(task, self, finalizeHandler)
-            self.taskResultCache[key] = trce
-            isNew = True
+        key = (task.GetKey(), isSubTask)
+        with self.taskResultCacheLock:
+            if key in self.taskResultCache:
+                trce = self.taskResultCache[key]
+            else:
+                trce = TaskResultCacheEntry(task, self, finalizeHandler)
+                self.taskResultCache[key] = trce
 
-        trce.refCount += 1
-        return isNew
+            trce.refCount += 1
+        return trce
 
     def GetWorkLoad(self):
-        task = VisualJob.GetWorkLoad(self)
-        self.SetInfo(task.GetInfo())
+        '''
+        overrides Job.GetWorkLoad, the workloads are created on demand from
+        the task iterator. A task is only handed out if the pictures it needs
+        are loaded, the loading of the pictures is handed out as separate
+        workloads before. Blocks while neither is possible.
+        '''
+        while 1:
+            if self.IsAborted():
+                raise Queue.Empty()
+
+            self._FillLookahead()
+            if not self.lookahead:
+                raise Queue.Empty()
+
+            with self.resultsForRendererCond:
+                workLoad = self.__GetReadyWorkLoad()
+                if workLoad is None:
+                    self.__logger.debug("%s: %s: no workload ready",
+                                        threading.current_thread().getName(),
+                                        self.GetName())
+                    self.resultsForRendererCond.wait(0.25)
+                    continue
+
+            if isinstance(workLoad, RendererResultTask):
+                self.SetInfo(workLoad.GetInfo())
+
+            self.__logger.debug("%s: %s: %s - start",
+                                threading.current_thread().getName(),
+                                self.GetName(), workLoad.GetKey())
 
-        self.__logger.debug("%s: %s: %s - start",
-                            threading.current_thread().getName(),
-                            self.GetName(), task.GetKey())
+            return workLoad
 
-        return task
+    def __GetReadyWorkLoad(self):
+        '''
+        Returns in this order a workload for a prerequisite of a task within
+        the reorder window that is not scheduled yet, a workload that loads
+        an upcoming picture in advance, or the first task within the reorder
+        window whose prerequisites are done. Returns None if all
+        prerequisites are being processed by other workers.
+        '''
+        readyTask = None
+        for task in self.lookahead:
+            if self.__IsReorderWindowFull(task.idx):
+                break
+
+            pending = [trce for trce in task.prerequisites
+                       if not trce.IsDone()]
+            if not pending:
+                if readyTask is None:
+                    readyTask = task
+                continue
+
+            for trce in pending:
+                if not trce.scheduled:
+                    trce.scheduled = True
+                    return SubTaskWorkLoad(trce)
+
+        workLoad = self.__GetPrefetchWorkLoad()
+        if workLoad is not None:
+            return workLoad
+
+        if readyTask is not None:
+            self.__RemoveFromLookahead(readyTask)
+        return readyTask
+
+    def __GetPrefetchWorkLoad(self):
+        '''
+        Returns a workload that loads the next upcoming picture, as long as
+        no other picture is loading and the memory budget is not exceeded.
+        The other workers keep on rendering frames of the current picture
+        meanwhile.
+        '''
+        if self.prefetchPictures <= 0:
+            return None
+
+        loadedBytes = 0
+        nextTrce = None
+        for trce in self.lookaheadPrerequisites:
+            if trce.IsDone():
+                loadedBytes += _GetResultSize(trce.result)
+            elif trce.scheduled:
+                # one picture at a time
+                return None
+            elif nextTrce is None:
+                nextTrce = trce
+
+        if nextTrce is None:
+            return None
+        if self.prefetchBytes is not None \
+                and loadedBytes >= self.prefetchBytes:
+            return None
+
+        self.__logger.debug("%s: prefetch %s",
+                            self.GetName(), nextTrce.task.GetKey())
+        nextTrce.scheduled = True
+        return SubTaskWorkLoad(nextTrce)
 
     def PushResult(self, resultObject):
         '''
@@ -111,14 +337,35 @@ class RenderJob(VisualJob):
                             threading.current_thread().getName(),
                             self.GetName(), task.GetKey())
 
+        if isinstance(task, SubTaskWorkLoad):
+            # the result stays in the task result cache, but waiting tasks
+            # may be ready now
+            with self.resultsForRendererCond:
+                self.resultsForRendererCond.notify_all()
+            return
+
+        frameCount = task.GetFrameCount()
+        segment = task.task.GetSegment()
+        stats = RenderStats() if RenderStats().IsEnabled() else None
         try:
             result = resultObject.GetResult()
             if not self.finalizeHandler.UseSmartFinalize() and result:
+                startTime = time.time()
                 result = self.finalizeHandler.ProcessFinalize(result)
-            self.resultsForRendererCache[task.idx] = result
+                if stats:
+                    stats.Add("Finalize", time.time() - startTime)
         except JobAbortedException:
-            pass
-        with self.resultsForRendererLock:
+            return
+        except Exception, exc:  # IGNORE:R0703
+            # already logged by the worker, the frames are replaced so that
+            # the following results are not kept back forever
+            result = _FailedResult(exc)
+
+        with self.resultsForRendererCond:
+            self.resultsForRendererCache[task.idx] = \
+                result, frameCount, segment, time.time()
+            self.resultsForRendererBytes += _GetResultSize(result)
+
             while self.resultsForRendererCache.has_key(
                                         self.resultForRendererIdx):
                 idx = self.resultForRendererIdx
@@ -127,29 +374,128 @@ class RenderJob(VisualJob):
                                     threading.current_thread().getName(),
                                     self.GetName(), idx)
 
-                imgData = self.resultsForRendererCache[idx]
+                imgData, frameCount, segment, arrivalTime = \
+                    self.resultsForRendererCache[idx]
+                if stats:
+                    startTime = time.time()
+                    stats.Add("ReorderWait", startTime - arrivalTime)
+                if isinstance(imgData, _FailedResult):
+                    if not self.__ReplaceFailedResult(idx, imgData,
+                                                      frameCount):
+                        return
+                    imgData = self.lastResultForRenderer
+                else:
+                    self.lastResultForRenderer = imgData
                 if imgData:
-                    self.renderer.ToSink(imgData)
+                    if segment is not None:
+                        self.renderer.ToSegment(segment, imgData, frameCount)
+                    elif frameCount == 1:
+                        self.renderer.ToSink(imgData)
+                    else:
+                        self.renderer.ToSinkRepeated(imgData, frameCount)
+                if stats:
+                    stats.Add("ToSink", time.time() - startTime)
+                    if imgData:
+                        stats.AddFrames(frameCount)
                 del self.resultsForRendererCache[idx]
+                self.resultsForRendererBytes -= _GetResultSize(imgData)
                 self.resultForRendererIdx += 1
 
-                self.StepProgress()
+                self.StepProgress(progress=frameCount)
+
+            self.resultsForRendererCond.notify_all()
+
+    def __ReplaceFailedResult(self, idx, failedResult, frameCount):
+        '''
+        Keeps the video in sync with the audio and the segments if a task
+        failed, its frames show the previous frame. Aborts the job if there
+        is no previous frame and returns False.
+        '''
+        if self.lastResultForRenderer is None:
+            self.__logger.error("%s: task %s failed: %s", self.GetName(),
+                                idx, failedResult.error)
+            self.Abort(_(u"Rendering failed: %s") % failedResult.error)
+            self.resultsForRendererCond.notify_all()
+            return False
+
+        self.__logger.error("%s: task %s failed, its %s frames show the "
+                            "previous frame: %s", self.GetName(), idx,
+                            frameCount, failedResult.error)
+        self.failedFrames += frameCount
+        return True
 
     def ProcessSubTask(self, task, isSubTask=True):
-        key = "{0}{1}".format(task.GetKey(), isSubTask)
-        trce = self.taskResultCache[key]
-        result = trce.GetResult()
-        if trce.refCount == 0:
-            self.__logger.debug("%s: %s: clear cached result %s",
-                                threading.current_thread().getName(),
-                                self.GetName(), key)
-            del self.taskResultCache[key]
+        key = (task.GetKey(), isSubTask)
+        with self.taskResultCacheLock:
+            trce = self.taskResultCache[key]
+        if isSubTask:
+            consumed = getattr(self.consumedSubTasks, "keys", None)
+            if consumed is not None:
+                consumed.append(task.GetKey())
         else:
-            self.__logger.debug("%s: %s: result ref count %s %s",
-                                threading.current_thread().getName(),
-                                self.GetName(), trce.refCount, key)
+            self.consumedSubTasks.keys = []
+        try:
+            return trce.GetResult()
+        finally:
+            # failed results are released as well
+            self.__ReleaseTaskResult(key)
+            if not isSubTask:
+                self.__ReleaseSubTasks(task, self.consumedSubTasks.keys)
+                self.consumedSubTasks.keys = None
+
+    def __ReleaseSubTasks(self, task, consumed):
+        '''
+        Releases the subtasks that were registered for the task but not
+        requested, because the task failed or its result was computed
+        before.
+        '''
+        for subTask in task.IterSubTasks():
+            subKey = subTask.GetKey()
+            if subKey in consumed:
+                consumed.remove(subKey)
+            else:
+                self.__ReleaseTaskResult((subKey, True))
+
+    def __ReleaseTaskResult(self, key):
+        with self.taskResultCacheLock:
+            trce = self.taskResultCache[key]
+            trce.refCount -= 1
+            if trce.refCount == 0:
+                self.__logger.debug("%s: %s: clear cached result %s",
+                                    threading.current_thread().getName(),
+                                    self.GetName(), key)
+                del self.taskResultCache[key]
+            else:
+                self.__logger.debug("%s: %s: result ref count %s %s",
+                                    threading.current_thread().getName(),
+                                    self.GetName(), trce.refCount, key)
 
-        return result
+
+class _FailedResult(object):
+    '''
+    Takes the place of the result of a failed task in the reorder cache.
+    '''
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _GetResultSize(result):
+    '''
+    Estimates the memory used by a result.
+    '''
+    if isinstance(result, str):
+        return len(result)
+    elif hasattr(result, "getbands"):
+        # a PIL image
+        return result.size[0] * result.size[1] * len(result.getbands())
+    elif isinstance(result, ImagePyramid):
+        return sum(_GetResultSize(level) for level in result.levels)
+    elif hasattr(result, "get_stride"):
+        # a cairo image surface
+        return result.get_stride() * result.get_height()
+    else:
+        return 0
 
 
 class RendererResultTask(WorkLoad):
@@ -158,10 +504,11 @@ class RendererResultTask(WorkLoad):
     of task results especially concerning sub tasks.
     '''
 
-    def __init__(self, idx, task):
+    def __init__(self, idx, task, prerequisites=None):
         WorkLoad.__init__(self)
         self.idx = idx
         self.task = task
+        self.prerequisites = prerequisites or []
 
     def GetKey(self):
         return self.idx
@@ -169,11 +516,46 @@ class RendererResultTask(WorkLoad):
     def Run(self, jobContext):
         # self.task is not really a sub task, but is processed as a sub task to
         # use the result cache
-        return jobContext.ProcessSubTask(self.task, False)
+        if not RenderStats().IsEnabled():
+            return jobContext.ProcessSubTask(self.task, False)
+
+        startTime = time.time()
+        try:
+            return jobContext.ProcessSubTask(self.task, False)
+        finally:
+            RenderStats().AddBusy(time.time() - startTime)
 
     def GetInfo(self):
         return self.task.GetInfo()
 
+    def GetFrameCount(self):
+        return self.task.GetFrameCount()
+
+
+class SubTaskWorkLoad(WorkLoad):
+    '''
+    Computes the result of a subtask in advance, so that the tasks that need
+    it do not wait for each other.
+    '''
+
+    def __init__(self, trce):
+        WorkLoad.__init__(self)
+        self.trce = trce
+
+    def GetKey(self):
+        return self.trce.task.GetKey()
+
+    def Run(self, jobContext):  # pylint: disable=unused-argument
+        if not RenderStats().IsEnabled():
+            self.trce.GetResult()
+            return
+
+        startTime = time.time()
+        try:
+            self.trce.GetResult()
+        finally:
+            RenderStats().AddBusy(time.time() - startTime)
+
 
 class TaskResultCacheEntry(object):
 
@@ -185,17 +567,91 @@ class TaskResultCacheEntry(object):
         self.finalizeHandler = finalizeHandler
         self.refCount = 0
         self.result = TaskResultCacheEntry.NO_RESULT
+        self.error = None
+        # set if the computation was handed out as SubTaskWorkLoad
+        self.scheduled = False
         self.lock = threading.Lock()
 
     def SetResult(self, result):
         assert self.result is TaskResultCacheEntry.NO_RESULT
         self.result = result
 
+    def IsDone(self):
+        return self.result is not TaskResultCacheEntry.NO_RESULT \
+            or self.error is not None
+
     def GetResult(self):
+        stats = RenderStats() if RenderStats().IsEnabled() else None
+        tracer = Tracer() if Tracer().IsEnabled() else None
+        if stats is None and tracer is None:
+            return self.__GetResult()[0]
+
+        if stats:
+            stats.BeginTask()
+        if tracer:
+            startTime = tracer.Now()
+        # waiting for a result that is computed by another worker
+        stage = "SubTaskWait"
+        finalizeTime = None
+        try:
+            result, finalizeTime = self.__GetResult()
+            if finalizeTime is not None:
+                stage = self.task.__class__.__name__
+            return result
+        finally:
+            if stats:
+                stats.EndTask(stage, finalizeTime)
+            if tracer:
+                tracer.AddComplete(stage, "task", startTime,
+                                   {"key": repr(self.task.GetKey())})
+
+    def __GetResult(self):
+        '''
+        Returns the result and the time to finalize it, the time is None if
+        the result was computed before.
+        '''
         with self.lock:
             if self.result is TaskResultCacheEntry.NO_RESULT:
-                self.result = self.task.Run(self.renderJob)
-                if self.finalizeHandler and self.result:
-                    self.result = self.finalizeHandler.ProcessFinalize(self.result)
-            self.refCount -= 1
-            return self.result
+                if self.error is not None:
+                    # do not try again for each task that needs the result
+                    raise self.error
+
+                runner = TaskRunner(self.task, self.finalizeHandler)
+                worker = threading.current_thread()
+                try:
+                    if isinstance(worker, ProcessWorker) \
+                            and self.task.IsProcessable():
+                        self.result, finalizeTime = \
+                            worker.Execute(runner, self.renderJob)
+                    else:
+                        self.result, finalizeTime = \
+                            runner.Run(self.renderJob)
+                except Exception, exc:
+                    self.error = exc
+                    raise
+                return self.result, finalizeTime
+            return self.result, None
+
+
+class TaskRunner(object):
+    '''
+    Runs a task and finalizes its result. If the current worker is a
+    ProcessWorker the runner is sent to its child process, subtasks are then
+    requested from the RenderJob of the parent process.
+    '''
+
+    def __init__(self, task, finalizeHandler):
+        self.task = task
+        self.finalizeHandler = finalizeHandler
+
+    def Run(self, jobContext):
+        '''
+        Returns the result and the time it took to finalize it.
+        '''
+        result = self.task.Run(jobContext)
+        finalizeTime = 0.0
+        if self.finalizeHandler and result:
+            startTime = time.time()
+            result = self.finalizeHandler.ProcessFinalize(result)
+            finalizeTime = time.time() - startTime
+        return result, finalizeTime
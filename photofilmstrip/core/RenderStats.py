@@ -0,0 +1,198 @@
+# encoding: UTF-8
+#
+# PhotoFilmStrip - Creates movies out of your pictures.
+#
+# Copyright (C) 2017 Jens Goepfert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+import json
+import threading
+import time
+
+from photofilmstrip.lib.common.Singleton import Singleton
+
+
+class RenderStats(Singleton):
+    '''
+    Collects the durations of the render stages, e.g. the tasks, the
+    finalizing of the frames and the waits before a frame reaches the
+    encoder. The collection is disabled by default, the hooks only check
+    IsEnabled() then.
+
+    The time of a task does not include the time of the subtasks it waits
+    for, so the stages add up to the busy time of the workers.
+    '''
+
+    def __init__(self):
+        self.__enabled = False
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__samples = {}
+        self.__busy = {}
+        self.__frames = 0
+        self.__startTime = None
+        self.__stopTime = None
+
+    def Enable(self, value=True):
+        self.__enabled = value
+
+    def IsEnabled(self):
+        return self.__enabled
+
+    def Start(self):
+        '''
+        Resets the collected values and starts the wall clock.
+        '''
+        with self.__lock:
+            self.__samples = {}
+            self.__busy = {}
+            self.__frames = 0
+            self.__startTime = time.time()
+            self.__stopTime = None
+
+    def Stop(self):
+        self.__stopTime = time.time()
+
+    def Add(self, stage, duration):
+        '''
+        Adds a sample to a stage.
+        :param stage: the name of the stage
+        :param duration: the duration in seconds
+        '''
+        with self.__lock:
+            self.__samples.setdefault(stage, []).append(duration)
+
+    def AddBusy(self, duration):
+        '''
+        Adds the time the current worker thread processed a workload.
+        '''
+        name = threading.current_thread().getName()
+        with self.__lock:
+            self.__busy[name] = self.__busy.get(name, 0) + duration
+
+    def AddFrames(self, count):
+        with self.__lock:
+            self.__frames += count
+
+    def BeginTask(self):
+        '''
+        Starts the measurement of a task on the current thread. Calls can
+        be nested, each must be followed by a call of EndTask().
+        '''
+        stack = getattr(self.__local, "stack", None)
+        if stack is None:
+            stack = self.__local.stack = []
+        # start time and the time spent in nested tasks
+        stack.append([time.time(), 0.0])
+
+    def EndTask(self, stage, finalizeTime=None):
+        '''
+        Ends the measurement of the innermost task of the current thread.
+        :param stage: the stage the task belongs to
+        :param finalizeTime: the part of the time that was spent to
+                             finalize the result, it is added to the stage
+                             "Finalize"
+        '''
+        stack = self.__local.stack
+        startTime, nestedTime = stack.pop()
+        duration = time.time() - startTime
+        if stack:
+            stack[-1][1] += duration
+
+        ownTime = duration - nestedTime
+        if finalizeTime:
+            ownTime -= finalizeTime
+            self.Add("Finalize", finalizeTime)
+        self.Add(stage, max(0.0, ownTime))
+
+    def GetSummary(self):
+        '''
+        Returns a dictionary with the wall time, the number of frames, the
+        frames per second, the utilisation of each worker and the count,
+        total, mean, p50, p99 and max of each stage in seconds.
+        '''
+        with self.__lock:
+            startTime = self.__startTime or time.time()
+            wallTime = (self.__stopTime or time.time()) - startTime
+            stages = {}
+            for stage, samples in self.__samples.items():
+                samples = sorted(samples)
+                total = sum(samples)
+                stages[stage] = {"count": len(samples),
+                                 "total": total,
+                                 "mean": total / len(samples),
+                                 "p50": _Percentile(samples, 0.50),
+                                 "p99": _Percentile(samples, 0.99),
+                                 "max": samples[-1]}
+
+            workers = {}
+            for name, busy in self.__busy.items():
+                workers[name] = busy / wallTime if wallTime > 0 else 0.0
+
+            return {"wallTime": wallTime,
+                    "frames": self.__frames,
+                    "fps": self.__frames / wallTime if wallTime > 0 else 0.0,
+                    "workerUtilisation": workers,
+                    "stages": stages}
+
+    def Format(self, summary=None):
+        '''
+        Returns the summary as a text table.
+        '''
+        if summary is None:
+            summary = self.GetSummary()
+
+        lines = []
+        lines.append(u"%-20s: %.2f s" % (_(u"render time"),
+                                          summary["wallTime"]))
+        lines.append(u"%-20s: %d (%.2f fps)" % (_(u"frames"),
+                                                summary["frames"],
+                                                summary["fps"]))
+        workers = summary["workerUtilisation"]
+        if workers:
+            lines.append(u"%-20s: %.0f%%" % (
+                _(u"worker utilisation"),
+                100 * sum(workers.values()) / len(workers)))
+            for name in sorted(workers):
+                lines.append(u"  %-18s: %.0f%%" % (name, 100 * workers[name]))
+        lines.append(u"")
+        lines.append(u"%-20s %8s %10s %10s %10s %10s" % (
+            _(u"stage"), _(u"count"), _(u"total s"),
+            _(u"p50 ms"), _(u"p99 ms"), _(u"max ms")))
+        stages = summary["stages"]
+        for stage in sorted(stages, key=lambda s: -stages[s]["total"]):
+            values = stages[stage]
+            lines.append(u"%-20s %8d %10.2f %10.1f %10.1f %10.1f" % (
+                stage, values["count"], values["total"],
+                1000 * values["p50"], 1000 * values["p99"],
+                1000 * values["max"]))
+        return u"\n".join(lines)
+
+    def WriteJson(self, filename, summary=None):
+        if summary is None:
+            summary = self.GetSummary()
+        with open(filename, "w") as fd:
+            json.dump(summary, fd, indent=2, sort_keys=True)
+
+
+def _Percentile(samples, fraction):
+    '''
+    Returns the value below which the given fraction of the sorted samples
+    falls (nearest rank).
+    '''
+    idx = int(round(fraction * (len(samples) - 1)))
+    return samples[idx]
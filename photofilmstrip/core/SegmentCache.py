@@ -0,0 +1,82 @@
+# encoding: UTF-8
+#
+# PhotoFilmStrip - Creates movies out of your pictures.
+#
+# Copyright (C) 2017 Jens Goepfert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+import hashlib
+import logging
+import os
+
+
+class SegmentCache(object):
+    '''
+    Keeps the encoded segments of the last render in a directory. Each
+    segment file is named by a hash of everything that affects its frames,
+    so a segment is rendered again only if one of its pictures, its motion,
+    its transitions, the profile or the renderer settings changed.
+    '''
+
+    def __init__(self, cacheDir):
+        self.__cacheDir = cacheDir
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+
+        self.__logger = logging.getLogger("SegmentCache")
+
+    @staticmethod
+    def GetCacheDir(outputPath):
+        return os.path.join(outputPath, ".cache")
+
+    @staticmethod
+    def MakeKey(unitKey, context):
+        '''
+        Returns the hash of a segment.
+        :param unitKey: the key of the RenderUnit of the segment
+        :param context: a tuple with the settings of the render that affect
+                        all segments
+        '''
+        return hashlib.sha1(repr((unitKey, context))).hexdigest()
+
+    def GetFilename(self, key, extension):
+        return os.path.join(self.__cacheDir,
+                            "segment-{0}.{1}".format(key, extension))
+
+    def GetVideoFilename(self, key, extension):
+        '''
+        Returns the file of the complete video without audio.
+        '''
+        return os.path.join(self.__cacheDir,
+                            "video-{0}.{1}".format(key, extension))
+
+    def Contains(self, filename):
+        return os.path.isfile(filename)
+
+    def Prune(self, filenames):
+        '''
+        Removes all files of the cache that are not in filenames.
+        '''
+        keep = set(os.path.basename(filename) for filename in filenames)
+        for name in os.listdir(self.__cacheDir):
+            if name in keep:
+                continue
+            self.__logger.debug("removing %s", name)
+            try:
+                os.remove(os.path.join(self.__cacheDir, name))
+            except OSError:
+                pass
@@ -0,0 +1,107 @@
+# encoding: UTF-8
+#
+# PhotoFilmStrip - Creates movies out of your pictures.
+#
+# Copyright (C) 2017 Jens Goepfert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+
+import bisect
+import logging
+import os
+
+from photofilmstrip.core.PicturePattern import PicturePattern
+
+
+class SequenceIndex(object):
+    '''
+    The files of a time lapse sequence. The directory is scanned once and
+    the files that match the pattern of the sequence are indexed by their
+    number, so missing files are known before the rendering starts.
+    '''
+
+    def __init__(self, directory, prefix, postfix, digits):
+        '''
+        :param directory: the directory of the sequence
+        :param prefix: the part of the filename before the number
+        :param postfix: the part of the filename after the number
+        :param digits: the number of digits the number is padded to
+        '''
+        self.directory = directory
+        self.prefix = prefix
+        self.postfix = postfix
+        self.digits = digits
+
+        self.__files = {}
+        try:
+            names = os.listdir(directory or os.curdir)
+        except OSError, err:
+            logging.getLogger("SequenceIndex").debug(
+                "cannot scan %s: %s", directory, err)
+            names = []
+        for name in names:
+            pattern = PicturePattern.Create(name)
+            if not pattern.IsOk() or pattern.prefix != prefix or \
+                    pattern.postfix != postfix or \
+                    name != self.__FormatName(pattern.num):
+                continue
+            filename = os.path.join(directory, name)
+            try:
+                size = os.path.getsize(filename)
+            except OSError:
+                continue
+            if size > 0:
+                # an empty file is a failed write of the camera
+                self.__files[pattern.num] = filename
+        self.__numbers = sorted(self.__files)
+
+    def __FormatName(self, num):
+        return "{0}{1}{2}".format(self.prefix,
+                                  ("%%0%dd" % self.digits) % num,
+                                  self.postfix)
+
+    def MakeFilename(self, num):
+        '''
+        Returns the filename of a number whether the file exists or not.
+        '''
+        return os.path.join(self.directory, self.__FormatName(num))
+
+    def GetFilename(self, num):
+        '''
+        Returns the filename of a number or None if the file is missing.
+        '''
+        return self.__files.get(num)
+
+    def GetGaps(self, first, last):
+        '''
+        Returns a list of tuples of the first and last number of each range
+        of missing files between first and last.
+        :param first: the first number of the range
+        :param last: the last number of the range, inclusive
+        '''
+        gaps = []
+        expected = first
+        idx = bisect.bisect_left(self.__numbers, first)
+        while idx < len(self.__numbers) and self.__numbers[idx] <= last:
+            num = self.__numbers[idx]
+            if num > expected:
+                gaps.append((expected, num - 1))
+            expected = num + 1
+            idx += 1
+        if expected <= last:
+            gaps.append((expected, last))
+        return gaps
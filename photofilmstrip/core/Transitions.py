@@ -0,0 +1,144 @@
+# encoding: UTF-8
+#
+# PhotoFilmStrip - Creates movies out of your pictures.
+#
+# Copyright (C) 2017 Jens Goepfert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+
+import threading
+
+from PIL import Image
+
+from photofilmstrip.core import PILBackend
+from photofilmstrip.core.Picture import Picture
+from photofilmstrip.core.exceptions import RenderException
+
+
+class Transition(object):
+    '''
+    Renders the frames of a transition between two pictures. An instance is
+    registered for each transition kind with RegisterTransition(), TaskTrans
+    looks it up when it runs. Worker processes do not share the registry, so
+    a transition must be registered when its module is imported.
+    '''
+
+    def Render(self, image1, rect1, image2, rect2, size, percentage,
+               draft=False):
+        '''
+        Returns the frame of the transition as a PIL image.
+        :param image1: the ImagePyramid of the picture that disappears
+        :param rect1: the rect of the picture that disappears
+        :param image2: the ImagePyramid of the picture that appears
+        :param rect2: the rect of the picture that appears
+        :param size: the output resolution
+        :param percentage: the progress of the transition between 0 and 1
+        :param draft: use the faster filter of the draft mode
+        '''
+        frame1 = PILBackend.CropAndResize(image1, rect1, size, draft)
+        frame2 = PILBackend.CropAndResize(image2, rect2, size, draft)
+        return self.Composite(frame1, frame2, percentage)
+
+    def Composite(self, frame1, frame2, percentage):
+        '''
+        Combines two frames of the output resolution. The frames are owned
+        by the transition, so the result may be composited into one of them.
+        '''
+        raise NotImplementedError()
+
+
+class FadeTransition(Transition):
+    '''
+    Pastes the first frame into the second one through a mask of constant
+    alpha. The mask is kept for each thread and only refilled, so a fade
+    allocates no image besides the two frames.
+    '''
+
+    def __init__(self):
+        self.__local = threading.local()
+
+    def __GetMask(self, size, alpha):
+        mask = getattr(self.__local, "mask", None)
+        if mask is None or mask.size != size:
+            mask = Image.new("L", size)
+            self.__local.mask = mask
+        mask.paste(alpha, (0, 0) + size)
+        return mask
+
+    def Composite(self, frame1, frame2, percentage):
+        alpha = int(round(255 * (1.0 - percentage)))
+        if alpha <= 0:
+            return frame2
+        elif alpha >= 255:
+            return frame1
+        frame2.paste(frame1, (0, 0), self.__GetMask(frame2.size, alpha))
+        return frame2
+
+
+class RollTransition(Transition):
+    '''
+    Rolls the second picture in from the right. Only the visible parts are
+    rendered: the first picture is resized shifted by the width that is
+    rolled in and the visible part of the second picture is pasted over its
+    right edge.
+    '''
+
+    def Render(self, image1, rect1, image2, rect2, size, percentage,
+               draft=False):
+        width, height = size
+        delta = int(width * percentage)
+        if delta <= 0:
+            return PILBackend.CropAndResize(image1, rect1, size, draft)
+        elif delta >= width:
+            return PILBackend.CropAndResize(image2, rect2, size, draft)
+
+        scale1 = rect1[2] / float(width)
+        frame = PILBackend.CropAndResize(
+            image1,
+            (rect1[0] + delta * scale1, rect1[1], rect1[2], rect1[3]),
+            size, draft)
+
+        scale2 = rect2[2] / float(width)
+        part = PILBackend.CropAndResize(
+            image2,
+            (rect2[0], rect2[1], delta * scale2, rect2[3]),
+            (delta, height), draft)
+        frame.paste(part, (width - delta, 0))
+        return frame
+
+
+TRANSITIONS = {}
+
+
+def RegisterTransition(kind, transition):
+    '''
+    Registers the Transition that renders a transition kind.
+    :param kind: the transition kind, see Picture.TRANS_*
+    :param transition: the Transition instance
+    '''
+    TRANSITIONS[kind] = transition
+
+
+def GetTransition(kind):
+    try:
+        return TRANSITIONS[kind]
+    except KeyError:
+        raise RenderException(u"Unknown transition: %s" % kind)
+
+
+RegisterTransition(Picture.TRANS_FADE, FadeTransition())
+RegisterTransition(Picture.TRANS_ROLL, RollTransition())
@@ -22,6 +22,7 @@
 import logging
 import os
 import threading
+import time
 
 import Queue
 
@@ -30,9 +31,12 @@ from gi.repository import GObject
 
 from photofilmstrip.core.Aspect import Aspect
 from photofilmstrip.core.OutputProfile import OutputProfile
-from photofilmstrip.core.BaseRenderer import BaseRenderer
+from photofilmstrip.core.RenderStats import RenderStats
+from photofilmstrip.core.BaseRenderer import BaseRenderer, \
+    RawImageDataFinalizeHandler
 from photofilmstrip.core.Subtitle import SrtParser
 from photofilmstrip.core.exceptions import RendererException
+from photofilmstrip.lib.jobimpl.Tracer import Tracer
 
 
 class _GStreamerRenderer(BaseRenderer):
@@ -45,6 +49,9 @@ class _GStreamerRenderer(BaseRenderer):
         self.active = None
         self.finished = None
         self.ready = None
+        # the error message of the pipeline, it ends the pipeline like
+        # end-of-stream
+        self.error = None
         self.pipeline = None
         self.idxFrame = 0
         self.idxAudioFile = 0
@@ -56,6 +63,10 @@ class _GStreamerRenderer(BaseRenderer):
         self.concat = None
         self.ptsOffset = 0
         self.ptsLast = None
+        self.repeatBuffer = None
+        self.repeatCount = 0
+        self.segmentFile = None
+        self.frameOffset = 0
 
     @staticmethod
     def CheckDependencies(msgList):
@@ -69,29 +80,101 @@ class _GStreamerRenderer(BaseRenderer):
 
     @staticmethod
     def GetProperties():
-        return ["Bitrate", "RenderSubtitle"]
+        return ["Bitrate", "RenderSubtitle", "RawFrames"]
 
     @staticmethod
     def GetDefaultProperty(prop):
         if prop == "RenderSubtitle":
             return "false"
+        if prop == "RawFrames":
+            return "true"
+        if prop == "Segments":
+            return "1"
+        if prop == "SegmentCache":
+            return "false"
         return BaseRenderer.GetDefaultProperty(prop)
 
+    def GetFinalizeHandler(self):
+        '''
+        Workers deliver raw frames if the RawFrames property is set, otherwise
+        JPEG encoded frames which need less memory while waiting in the queue.
+        :rtype: FinalizeHandler
+        '''
+        if self.GetTypedProperty("RawFrames", bool):
+            return RawImageDataFinalizeHandler(self._GetRawFormat()[1])
+        else:
+            return BaseRenderer.GetFinalizeHandler(self)
+
+    def _GetRawFormat(self):
+        '''
+        Returns a tuple with the GStreamer video format and the corresponding
+        PIL raw mode. GStreamer expects the rows of packed RGB frames to be
+        aligned to 4 bytes, so RGBx is used if the width does not fit.
+        '''
+        width = self.GetProfile().GetResolution()[0]
+        if (width * 3) % 4 == 0:
+            return "RGB", "RGB"
+        else:
+            return "RGBx", "RGBX"
+
+    def GetSegmentCount(self):
+        '''
+        overrides BaseRenderer.GetSegmentCount
+        '''
+        if not self.SupportsSegments():
+            return 1
+        segments = self.GetTypedProperty("Segments", int, 1)
+        if segments is None:
+            raise RendererException(_(u"Segments must be a number!"))
+        return max(1, segments)
+
+    def GetSegmentExtension(self):
+        return "mkv"
+
+    def PrepareSegment(self, filename, frameOffset):
+        '''
+        overrides BaseRenderer.PrepareSegment, the segment contains only the
+        video stream in a Matroska file.
+        '''
+        self.segmentFile = filename
+        self.frameOffset = frameOffset
+        self.Prepare()
+
     def ToSink(self, data):
-        self.resQueue.put(data)
+        self.__PutResult(data, 1)
+
+    def ToSinkRepeated(self, data, count):
+        '''
+        overrides BaseRenderer.ToSinkRepeated, the frame is queued once and
+        the repeated buffers share its memory.
+        '''
+        self.__PutResult(data, count)
+
+    def __PutResult(self, data, count):
+        '''
+        Queues a frame for _GstNeedData, the frame is dropped if the pipeline
+        stopped with an error.
+        '''
+        while self.error is None:
+            try:
+                self.resQueue.put((data, count), True, 0.25)
+                return
+            except Queue.Full:
+                continue
 
     def __CleanUp(self):
         '''
         Waits until the ready event is set and finished the GTK-Mainloop.
         The ready event is set within _GstOnMessage if the end-of-stream event
-        was handled.
+        or an error was handled. Returns the error of the pipeline or None.
         '''
         if self.ready is None:
-            return
+            return None
 
         self._Log(logging.DEBUG, "waiting for ready event")
         self.ready.wait()
         self.gtkMainloop.quit()
+        error = self.error
 
         self.active = None
         self.finished = None
@@ -107,12 +190,19 @@ class _GStreamerRenderer(BaseRenderer):
         self.concat = None
         self.ptsOffset = 0
         self.ptsLast = None
-
-        if self.GetTypedProperty("RenderSubtitle", bool):
+        self.repeatBuffer = None
+        self.repeatCount = 0
+        # drop the frames that were not consumed by the pipeline
+        while not self.resQueue.empty():
+            self.resQueue.get_nowait()
+
+        if self.GetTypedProperty("RenderSubtitle", bool) \
+                and self.segmentFile is None:
             # delete subtitle file, if subtitle is rendered in video
             srtPath = os.path.join(self.GetOutputPath(), "output.srt")
             if os.path.exists(srtPath):
                 os.remove(srtPath)
+        return error
 
     def ProcessAbort(self):
         '''
@@ -132,6 +222,7 @@ class _GStreamerRenderer(BaseRenderer):
 
         self.ready = threading.Event()
         self.ready.set()
+        self.error = None
 
         self.active = True
         self.finished = False
@@ -140,13 +231,25 @@ class _GStreamerRenderer(BaseRenderer):
         self.imgDuration = int(round(1000 * Gst.MSECOND / frameRate.AsFloat()))
         self._Log(logging.DEBUG, "set imgDuration=%s", self.imgDuration)
 
-        outFile = os.path.join(self.GetOutputPath(),
-                               "output.%s" % self._GetExtension())
+        if self.segmentFile is None:
+            outFile = os.path.join(self.GetOutputPath(),
+                                   "output.%s" % self._GetExtension())
+        else:
+            outFile = self.segmentFile
 
         self.pipeline = Gst.Pipeline()
 
-        caps = Gst.caps_from_string(
-            "image/jpeg,framerate={0}".format(frameRate.AsStr()))
+        rawFrames = self.GetTypedProperty("RawFrames", bool)
+        if rawFrames:
+            width, height = self.GetProfile().GetResolution()
+            caps = Gst.caps_from_string(
+                "video/x-raw,format={0},width={1},height={2},"
+                "framerate={3},pixel-aspect-ratio=1/1".format(
+                    self._GetRawFormat()[0], width, height,
+                    frameRate.AsStr()))
+        else:
+            caps = Gst.caps_from_string(
+                "image/jpeg,framerate={0}".format(frameRate.AsStr()))
         videoSrc = Gst.ElementFactory.make("appsrc")
         videoSrc.set_property("block", True)
         videoSrc.set_property("caps", caps)
@@ -156,9 +259,6 @@ class _GStreamerRenderer(BaseRenderer):
         queueVideo = Gst.ElementFactory.make("queue")
         self.pipeline.add(queueVideo)
 
-        jpegDecoder = Gst.ElementFactory.make("jpegdec")
-        self.pipeline.add(jpegDecoder)
-
         colorConverter = Gst.ElementFactory.make("videoconvert")
         self.pipeline.add(colorConverter)
 
@@ -171,8 +271,13 @@ class _GStreamerRenderer(BaseRenderer):
             self.pipeline.add(self.textoverlay)
 
         # link elements for video stream
-        videoSrc.link(jpegDecoder)
-        jpegDecoder.link(colorConverter)
+        if rawFrames:
+            videoSrc.link(colorConverter)
+        else:
+            jpegDecoder = Gst.ElementFactory.make("jpegdec")
+            self.pipeline.add(jpegDecoder)
+            videoSrc.link(jpegDecoder)
+            jpegDecoder.link(colorConverter)
         if self.textoverlay:
             colorConverter.link(self.textoverlay)
             self.textoverlay.link(queueVideo)
@@ -181,51 +286,70 @@ class _GStreamerRenderer(BaseRenderer):
         queueVideo.link(videoEnc)
 
         audioEnc = None
-        if self.GetAudioFiles():
-            self.concat = Gst.ElementFactory.make("concat")
-            self.pipeline.add(self.concat)
-
-            srcpad = self.concat.get_static_pad("src")
-            srcpad.add_probe(Gst.PadProbeType.BUFFER,  # | Gst.PadProbeType.EVENT_DOWNSTREAM,
-                             self._GstProbeBuffer)
-
-            self._GstAddAudioFile(self.GetAudioFiles()[self.idxAudioFile])
-
-            audioConv = Gst.ElementFactory.make("audioconvert")
-            self.pipeline.add(audioConv)
-
-            audiorate = Gst.ElementFactory.make("audioresample")
-            self.pipeline.add(audiorate)
-
-            audioQueue = Gst.ElementFactory.make("queue")
-            self.pipeline.add(audioQueue)
-
-            audioEnc = self._GetAudioEncoder()
-            self.pipeline.add(audioEnc)
-
-            self.concat.link(audioConv)
-            audioConv.link(audiorate)
-            audiorate.link(audioQueue)
-            audioQueue.link(audioEnc)
+        if self.GetAudioFiles() and self.segmentFile is None:
+            audioEnc = self._GstAddAudioBranch()
 
         if self.GetProfile().IsMPEGProfile():
             vp = Gst.ElementFactory.make("mpegvideoparse")
             self.pipeline.add(vp)
             videoEnc.link(vp)
             videoEnc = vp
-
-            if audioEnc:
-                ap = Gst.ElementFactory.make("mpegaudioparse")
-                self.pipeline.add(ap)
-                audioEnc.link(ap)
-                audioEnc = ap
         elif isinstance(self, MkvX265AC3):
             vp = Gst.ElementFactory.make("h265parse")
             self.pipeline.add(vp)
             videoEnc.link(vp)
             videoEnc = vp
 
-        mux = self._GetMux()
+        if self.segmentFile is None:
+            mux = self._GetMux()
+        else:
+            mux = Gst.ElementFactory.make("matroskamux")
+        self._GstAddMuxAndSink(mux, outFile, videoEnc, audioEnc)
+        self._GstStart()
+
+    def _GstAddAudioBranch(self):
+        '''
+        Adds the elements that concatenate and encode the audio files.
+        Returns the last element of the audio branch.
+        '''
+        self.concat = Gst.ElementFactory.make("concat")
+        self.pipeline.add(self.concat)
+
+        srcpad = self.concat.get_static_pad("src")
+        srcpad.add_probe(Gst.PadProbeType.BUFFER,  # | Gst.PadProbeType.EVENT_DOWNSTREAM,
+                         self._GstProbeBuffer)
+
+        self._GstAddAudioFile(self.GetAudioFiles()[self.idxAudioFile])
+
+        audioConv = Gst.ElementFactory.make("audioconvert")
+        self.pipeline.add(audioConv)
+
+        audiorate = Gst.ElementFactory.make("audioresample")
+        self.pipeline.add(audiorate)
+
+        audioQueue = Gst.ElementFactory.make("queue")
+        self.pipeline.add(audioQueue)
+
+        audioEnc = self._GetAudioEncoder()
+        self.pipeline.add(audioEnc)
+
+        self.concat.link(audioConv)
+        audioConv.link(audiorate)
+        audiorate.link(audioQueue)
+        audioQueue.link(audioEnc)
+
+        if self.GetProfile().IsMPEGProfile():
+            ap = Gst.ElementFactory.make("mpegaudioparse")
+            self.pipeline.add(ap)
+            audioEnc.link(ap)
+            audioEnc = ap
+        return audioEnc
+
+    def _GstAddMuxAndSink(self, mux, outFile, videoEnc, audioEnc):
+        '''
+        Adds the muxer and the file sink and links the video and the optional
+        audio branch.
+        '''
         self.pipeline.add(mux)
 
         videoQueue2 = Gst.ElementFactory.make("queue")
@@ -246,10 +370,16 @@ class _GStreamerRenderer(BaseRenderer):
 
         mux.link(sink)
 
+    def _GstStart(self):
+        '''
+        Starts the pipeline and the GTK-Mainloop that handles its messages.
+        '''
         bus = self.pipeline.get_bus()
         bus.add_signal_watch()
         bus.connect("message", self._GstOnMessage)
 
+        # an error can be posted as soon as the pipeline starts
+        self.ready.clear()
         self.pipeline.set_state(Gst.State.PLAYING)
 
         self.gtkMainloop = GObject.MainLoop()
@@ -257,7 +387,100 @@ class _GStreamerRenderer(BaseRenderer):
                                              target=self._GtkMainloop)
         gtkMainloopThread.start()
 
-        self.ready.clear()
+    def ConcatSegments(self, filenames, frameCount, videoFile=None):
+        '''
+        overrides BaseRenderer.ConcatSegments, the video streams of the
+        segments are parsed and concatenated without encoding them again.
+        The audio files are encoded and cut to the length of the video.
+        '''
+        GObject.threads_init()
+
+        self.ready = threading.Event()
+        self.ready.set()
+        self.error = None
+
+        self.active = True
+        self.finished = True
+        frameRate = self.GetProfile().GetFrameRate()
+        self.imgDuration = int(round(1000 * Gst.MSECOND / frameRate.AsFloat()))
+        self.finalTime = frameCount * self.imgDuration
+
+        outFile = os.path.join(self.GetOutputPath(),
+                               "output.%s" % self._GetExtension())
+
+        self.pipeline = Gst.Pipeline()
+
+        videoConcat = Gst.ElementFactory.make("concat")
+        self.pipeline.add(videoConcat)
+        for filename in filenames:
+            segmentSrc = Gst.ElementFactory.make("filesrc")
+            segmentSrc.set_property("location", filename)
+            self.pipeline.add(segmentSrc)
+
+            demux = Gst.ElementFactory.make("matroskademux")
+            self.pipeline.add(demux)
+            segmentSrc.link(demux)
+
+            # convert to byte stream with inband parameter sets, so that
+            # the streams can be concatenated even if the codec data
+            # differs
+            parser = Gst.ElementFactory.make(self._GetVideoParser())
+            parser.set_property("config-interval", -1)
+            self.pipeline.add(parser)
+            demux.connect("pad-added", self._GstPadAddedSegment, parser)
+
+            capsFilter = Gst.ElementFactory.make("capsfilter")
+            capsFilter.set_property("caps", Gst.caps_from_string(
+                "{0},stream-format=byte-stream,alignment=au".format(
+                    self._GetVideoMediaType())))
+            self.pipeline.add(capsFilter)
+            parser.link(capsFilter)
+            # the pads of concat are requested in the order of the segments
+            capsFilter.link(videoConcat)
+
+        videoParser = Gst.ElementFactory.make(self._GetVideoParser())
+        self.pipeline.add(videoParser)
+        videoConcat.link(videoParser)
+
+        videoOut = videoParser
+        if videoFile:
+            videoOut = Gst.ElementFactory.make("tee")
+            self.pipeline.add(videoOut)
+            videoParser.link(videoOut)
+
+            videoFileQueue = Gst.ElementFactory.make("queue")
+            self.pipeline.add(videoFileQueue)
+            videoOut.link(videoFileQueue)
+
+            videoFileMux = Gst.ElementFactory.make("matroskamux")
+            self.pipeline.add(videoFileMux)
+            videoFileQueue.link(videoFileMux)
+
+            videoFileSink = Gst.ElementFactory.make("filesink")
+            videoFileSink.set_property("location", videoFile)
+            self.pipeline.add(videoFileSink)
+            videoFileMux.link(videoFileSink)
+
+        audioEnc = None
+        if self.GetAudioFiles():
+            audioEnc = self._GstAddAudioBranch()
+
+        self._GstAddMuxAndSink(self._GetMux(), outFile,
+                               videoOut, audioEnc)
+        self._GstStart()
+
+        error = self.__CleanUp()
+        if error is not None:
+            raise RendererException(error)
+
+    def _GstPadAddedSegment(self, demux, pad, parser):
+        '''
+        Gstreamer pad-added callback of the demuxer of a segment file.
+        '''
+        self._Log(logging.DEBUG, "_GstPadAddedSegment: %s - %s", demux, pad)
+        sinkPad = parser.get_static_pad("sink")
+        if not sinkPad.is_linked():
+            pad.link(sinkPad)
 
     def _GtkMainloop(self):
         self._Log(logging.DEBUG, "GTK mainloop starting...")
@@ -284,7 +507,9 @@ class _GStreamerRenderer(BaseRenderer):
         if not self.finished:
             self.finished = True
 
-        self.__CleanUp()
+        error = self.__CleanUp()
+        if error is not None:
+            raise RendererException(error)
 
     def _GetBitrate(self):
         bitrate = self.GetTypedProperty("Bitrate", int,
@@ -306,6 +531,12 @@ class _GStreamerRenderer(BaseRenderer):
             self._Log(logging.ERROR, "Error received from element %s: %s",
                           msg.src.get_name(), err)
             self._Log(logging.DEBUG, "Debugging information: %s", debug)
+            if self.error is None:
+                self.error = "%s: %s" % (msg.src.get_name(), err.message)
+            # the pipeline does not reach end-of-stream anymore
+            self.active = False
+            self.pipeline.set_state(Gst.State.NULL)
+            self.ready.set()
 
         elif msg.type == Gst.MessageType.LATENCY:
             self.pipeline.recalculate_latency()
@@ -330,16 +561,40 @@ class _GStreamerRenderer(BaseRenderer):
 
         pts = self.idxFrame * self.imgDuration
 
+        stats = RenderStats() if RenderStats().IsEnabled() else None
+        tracer = Tracer() if Tracer().IsEnabled() else None
+        if stats or tracer:
+            startTime = time.time()
+
         while self.active:
-            result = None
+            if self.repeatCount > 0:
+                # a frame shown multiple times, push a buffer that shares the
+                # memory of the first one
+                self.repeatCount -= 1
+                buf = self.repeatBuffer.copy_region(
+                    Gst.BufferCopyFlags.MEMORY, 0,
+                    self.repeatBuffer.get_size())
+                break
+
             try:
-                result = self.resQueue.get(True, 0.25)
+                result, count = self.resQueue.get(True, 0.25)
+                self._Log(logging.DEBUG,
+                          '_GstNeedData: push to buffer (%s)', len(result))
+                buf = Gst.Buffer.new_wrapped(result)
+                if count > 1:
+                    self.repeatBuffer = buf
+                    self.repeatCount = count - 1
+                else:
+                    self.repeatBuffer = None
                 break
             except Queue.Empty:
                 self._Log(logging.DEBUG, '_GstNeedData: Queue.Empty')
                 if self.finished:
                     self._Log(logging.DEBUG, '_GstNeedData: finished, emitting end-of-stream (finalTime %s)', pts)
                     self.finalTime = pts
+                    if tracer:
+                        tracer.AddInstant("end-of-stream", "gstreamer",
+                                          {"frame": self.idxFrame})
                     src.emit("end-of-stream")
                     return
                 else:
@@ -347,15 +602,26 @@ class _GStreamerRenderer(BaseRenderer):
         else:
             self._Log(logging.DEBUG, '_GstNeedData: not active anymore, emitting end-of-stream (finalTime %s)', pts)
             self.finalTime = pts
+            if tracer:
+                tracer.AddInstant("end-of-stream", "gstreamer",
+                                  {"frame": self.idxFrame, "aborted": True})
             src.emit("end-of-stream")
             return
 
-        self._Log(logging.DEBUG, '_GstNeedData: push to buffer (%s)', len(result))
-
-        buf = Gst.Buffer.new_wrapped(result)
         buf.pts = pts
         buf.duration = self.imgDuration
+        if stats or tracer:
+            pushTime = time.time()
+        if stats:
+            stats.Add("SinkQueueWait", pushTime - startTime)
+        if tracer:
+            tracer.AddComplete("need-data", "gstreamer", startTime,
+                               {"frame": self.idxFrame})
         ret = src.emit("push-buffer", buf)
+        if stats:
+            stats.Add("AppsrcPush", time.time() - pushTime)
+        if tracer:
+            tracer.AddComplete("push-buffer", "gstreamer", pushTime)
         if ret != Gst.FlowReturn.OK:
             return
 
@@ -366,7 +632,7 @@ class _GStreamerRenderer(BaseRenderer):
                 self.srtParse = SrtParser(
                     srtPath, self.GetProfile().GetFrameRate().AsFloat())
 
-            subtitle = self.srtParse.Get(self.idxFrame)
+            subtitle = self.srtParse.Get(self.idxFrame + self.frameOffset)
             self.textoverlay.set_property("text", subtitle)
 
         self.idxFrame += 1
@@ -425,6 +691,16 @@ class _GStreamerRenderer(BaseRenderer):
     def _GetVideoEncoder(self):
         raise NotImplementedError()
 
+    def _GetVideoParser(self):
+        '''
+        Returns the name of the parser element of the video stream, needed
+        if SupportsSegments() returns True.
+        '''
+        raise NotImplementedError()
+
+    def _GetVideoMediaType(self):
+        raise NotImplementedError()
+
 
 class MkvX264AC3(_GStreamerRenderer):
 
@@ -450,7 +726,18 @@ class MkvX264AC3(_GStreamerRenderer):
 
     @staticmethod
     def GetProperties():
-        return _GStreamerRenderer.GetProperties() + ["SpeedPreset"]
+        return _GStreamerRenderer.GetProperties() + \
+            ["SpeedPreset", "Segments", "SegmentCache"]
+
+    @staticmethod
+    def SupportsSegments():
+        return True
+
+    def _GetVideoParser(self):
+        return "h264parse"
+
+    def _GetVideoMediaType(self):
+        return "video/x-h264"
 
     def _GetExtension(self):
         return "mkv"
@@ -502,7 +789,18 @@ class Mp4X264AAC(_GStreamerRenderer):
 
     @staticmethod
     def GetProperties():
-        return _GStreamerRenderer.GetProperties() + ["SpeedPreset"]
+        return _GStreamerRenderer.GetProperties() + \
+            ["SpeedPreset", "Segments", "SegmentCache"]
+
+    @staticmethod
+    def SupportsSegments():
+        return True
+
+    def _GetVideoParser(self):
+        return "h264parse"
+
+    def _GetVideoMediaType(self):
+        return "video/x-h264"
 
     def _GetExtension(self):
         return "mp4"
@@ -548,7 +846,18 @@ class MkvX265AC3(_GStreamerRenderer):
 
     @staticmethod
     def GetProperties():
-        return _GStreamerRenderer.GetProperties() + ["SpeedPreset"]
+        return _GStreamerRenderer.GetProperties() + \
+            ["SpeedPreset", "Segments", "SegmentCache"]
+
+    @staticmethod
+    def SupportsSegments():
+        return True
+
+    def _GetVideoParser(self):
+        return "h265parse"
+
+    def _GetVideoMediaType(self):
+        return "video/x-h265"
 
     def _GetExtension(self):
         return "mkv"
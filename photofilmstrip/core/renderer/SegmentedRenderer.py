@@ -0,0 +1,219 @@
+# encoding: UTF-8
+#
+# PhotoFilmStrip - Creates movies out of your pictures.
+#
+# Copyright (C) 2017 Jens Goepfert
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+import logging
+import os
+import shutil
+import threading
+
+from photofilmstrip.core.BaseRenderer import BaseRenderer
+
+
+class Segment(object):
+    '''
+    A part of the video that is encoded into its own file.
+    '''
+
+    def __init__(self, filename, frameOffset, frameCount):
+        self.filename = filename
+        self.frameOffset = frameOffset
+        self.frameCount = frameCount
+        # set if the file is complete, e.g. taken from the SegmentCache
+        self.done = False
+        # the exception that occurred while the segment was finalized
+        self.error = None
+
+    def GetPartFilename(self):
+        '''
+        The segment is written to this file and renamed when it is complete,
+        so an aborted render never leaves an incomplete segment file.
+        '''
+        return self.filename + ".part"
+
+
+class SegmentedRenderer(BaseRenderer):
+    '''
+    Distributes the frames on one renderer per segment. The renderer of a
+    segment is created when its first frame arrives and finalized in the
+    background after its last frame, so several segments are encoded at the
+    same time. Finally the segments are concatenated by the main renderer,
+    which also adds the audio.
+    '''
+
+    def __init__(self, renderer, segments, tempDir=None, segmentCache=None,
+                 videoFile=None, checkpoint=None):
+        '''
+        :param renderer: the initialized main renderer
+        :param segments: the list of Segments in the order of the video
+        :param tempDir: a directory that is removed after the output is
+                        created, contains the segment files
+        :param segmentCache: the SegmentCache the segment files belong to,
+                             segments of former renders are removed from it
+                             after the output is created
+        :param videoFile: the file the concatenated video is kept in
+                          without audio, see BaseRenderer.ConcatSegments
+        :param checkpoint: the RenderCheckpoint that records the complete
+                           segments, if set the tempDir is kept on abort
+        '''
+        BaseRenderer.__init__(self)
+        BaseRenderer.Init(self, renderer.GetProfile(), renderer._aspect,  # pylint: disable=protected-access
+                          renderer.GetOutputPath())
+        self.SetAudioFiles(renderer.GetAudioFiles())
+        self._renderer = renderer
+        self._segments = segments
+        self._tempDir = tempDir
+        self._segmentCache = segmentCache
+        self._videoFile = videoFile
+        self._checkpoint = checkpoint
+
+        self._active = {}
+        self._received = {}
+        self._closing = []
+        self._aborted = False
+
+        self.__logger = logging.getLogger("SegmentedRenderer")
+
+    @staticmethod
+    def GetName():
+        return u"Segments"
+
+    def GetSegments(self):
+        return self._segments
+
+    def GetFinalizeHandler(self):
+        return self._renderer.GetFinalizeHandler()
+
+    def Prepare(self):
+        pass
+
+    def ToSegment(self, segment, data, count):
+        '''
+        Passes a frame to the renderer of the segment.
+        :param segment: the index of the segment
+        :param data: the finalized frame
+        :param count: the number of frames the data is shown
+        '''
+        renderer = self._active.get(segment)
+        if renderer is None:
+            renderer = self.__OpenSegment(segment)
+
+        if count == 1:
+            renderer.ToSink(data)
+        else:
+            renderer.ToSinkRepeated(data, count)
+
+        self._received[segment] += count
+        if self._received[segment] >= self._segments[segment].frameCount:
+            self.__CloseSegment(segment)
+
+    def __OpenSegment(self, segment):
+        seg = self._segments[segment]
+        self.__logger.debug("open segment %s: %s", segment, seg.filename)
+        renderer = self._renderer.__class__()
+        renderer.Init(self.GetProfile(), self._aspect, self.GetOutputPath())
+        renderer.PrepareSegment(seg.GetPartFilename(), seg.frameOffset)
+        self._active[segment] = renderer
+        self._received[segment] = 0
+        return renderer
+
+    def __CloseSegment(self, segment):
+        '''
+        Finalizes the renderer of the segment in the background, the encoder
+        may need some time to process its queued frames.
+        '''
+        renderer = self._active.pop(segment)
+        self.__logger.debug("close segment %s", segment)
+
+        seg = self._segments[segment]
+
+        def _Finalize():
+            try:
+                renderer.Finalize()
+                os.rename(seg.GetPartFilename(), seg.filename)
+            except Exception, exc:  # IGNORE:R0703
+                self.__logger.error("finalizing segment %s failed: %s",
+                                    segment, exc, exc_info=1)
+                seg.error = exc
+                return
+            seg.done = True
+            if self._checkpoint is not None:
+                self._checkpoint.Add(seg)
+
+        thread = threading.Thread(name="segment-{0}".format(segment),
+                                  target=_Finalize)
+        thread.start()
+        self._closing.append(thread)
+
+    def __WaitForSegments(self):
+        for segment in list(self._active.keys()):
+            self.__CloseSegment(segment)
+        for thread in self._closing:
+            thread.join()
+        self._closing = []
+
+    def ProcessAbort(self):
+        self._aborted = True
+        for segment, renderer in self._active.items():
+            renderer.ProcessAbort()
+            partFilename = self._segments[segment].GetPartFilename()
+            if os.path.exists(partFilename):
+                os.remove(partFilename)
+        self._active.clear()
+        self.__WaitForSegments()
+
+    def Finalize(self):
+        self.__WaitForSegments()
+        try:
+            if not self._aborted:
+                for seg in self._segments:
+                    if seg.error is not None:
+                        raise seg.error
+                filenames = [seg.filename for seg in self._segments]
+                if self._videoFile is None:
+                    self._renderer.ConcatSegments(
+                        filenames,
+                        sum(seg.frameCount for seg in self._segments))
+                else:
+                    self._renderer.ConcatSegments(
+                        filenames,
+                        sum(seg.frameCount for seg in self._segments),
+                        self._videoFile + ".part")
+                    os.rename(self._videoFile + ".part", self._videoFile)
+                    filenames.append(self._videoFile)
+                if self._segmentCache is not None:
+                    self._segmentCache.Prune(filenames)
+        finally:
+            if self._tempDir and \
+                    not (self._aborted and self._checkpoint is not None):
+                shutil.rmtree(self._tempDir, True)
+
+    @staticmethod
+    def CreateTempDir(outputPath, clear=True):
+        '''
+        Creates a directory for the segment files next to the output file.
+        :param clear: if False the files of an aborted render are kept
+        '''
+        tempDir = os.path.join(outputPath, ".segments")
+        if clear and os.path.exists(tempDir):
+            shutil.rmtree(tempDir, True)
+        if not os.path.isdir(tempDir):
+            os.makedirs(tempDir)
+        return tempDir
@@ -20,12 +20,12 @@
 #
 
 import os
+import shutil
 
-from photofilmstrip.core.BaseRenderer import BaseRenderer, \
-    FinalizeHandler
+from photofilmstrip.core.BaseRenderer import BaseRenderer
 
 
-class SingleFileRenderer(BaseRenderer, FinalizeHandler):
+class SingleFileRenderer(BaseRenderer):
 
     def __init__(self):
         BaseRenderer.__init__(self)
@@ -49,28 +49,31 @@ class SingleFileRenderer(BaseRenderer, FinalizeHandler):
     def Prepare(self):
         pass
 
-    def GetFinalizeHandler(self):
-        return self
+    def __NextFilename(self):
+        self._counter += 1
+        return os.path.join(self.GetOutputPath(),
+                            '%09d.%s' % (self._counter, "jpg"))
 
-    def UseSmartFinalize(self):
-        '''
-        overrides FinalizeHandler.UseSmartFinalize
-        :param pilImg:
-        '''
-        return False
+    def ToSink(self, data):
+        with open(self.__NextFilename(), "wb") as fd:
+            fd.write(data)
 
-    def ProcessFinalize(self, pilImg):
+    def ToSinkRepeated(self, data, count):
         '''
-        overrides FinalizeHandler.ProcessFinalize
-        :param pilImg:
+        overrides BaseRenderer.ToSinkRepeated, the repeated frames are hard
+        links to the first file or copies if the file system does not support
+        links.
         '''
-        self._counter += 1
-
-        newFilename = os.path.join(self.GetOutputPath(),
-                                   '%09d.%s' % (self._counter,
-                                                "jpg"))
-
-        pilImg.save(newFilename, "JPEG", quality=95)
+        firstFilename = self.__NextFilename()
+        with open(firstFilename, "wb") as fd:
+            fd.write(data)
+
+        for __ in range(count - 1):
+            filename = self.__NextFilename()
+            try:
+                os.link(firstFilename, filename)
+            except (OSError, AttributeError):
+                shutil.copyfile(firstFilename, filename)
 
     def Finalize(self):
         pass
@@ -21,17 +21,42 @@
 
 from photofilmstrip.core.Subtitle import SubtitleSrt
 from photofilmstrip.core import PILBackend
+from photofilmstrip.core.DecodedImageCache import DecodedImageCache
+from photofilmstrip.core.Transitions import GetTransition
 
 
 class Task(object):
+    '''
+    Base class of the render tasks. A long project creates many thousands of
+    tasks, so they use __slots__ and compute their key only once. The keys
+    are tuples, keys of tasks are built from the keys of their subtasks.
+    '''
+
+    __slots__ = ("info", "subTasks", "key", "frameCount", "segment")
 
     def __init__(self):
         self.info = u""
-        self.subTasks = []
+        self.subTasks = ()
+        self.key = None
+        self.frameCount = 1
+        self.segment = None
 
     def __str__(self):
         return "%s: %s" % (self.__class__.__name__, self.info)
 
+    def __getstate__(self):
+        state = {}
+        for clazz in type(self).__mro__:
+            for name in getattr(clazz, "__slots__", ()):
+                if name.startswith("__"):
+                    name = "_{0}{1}".format(clazz.__name__, name)
+                state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+
     def IterSubTasks(self):
         for subTask in self.subTasks:
             for subSubTask in subTask.IterSubTasks():
@@ -45,7 +70,34 @@ class Task(object):
         self.info = info
 
     def GetKey(self):
-        raise NotImplementedError()
+        return self.key
+
+    def SetFrameCount(self, frameCount):
+        '''
+        Sets the number of consecutive frames the result of this task is
+        shown, e.g. for a picture without motion.
+        '''
+        self.frameCount = frameCount
+
+    def GetFrameCount(self):
+        return self.frameCount
+
+    def SetSegment(self, segment):
+        '''
+        Sets the index of the output segment the frames of this task belong
+        to, if the output is rendered in segments.
+        '''
+        self.segment = segment
+
+    def GetSegment(self):
+        return self.segment
+
+    def IsProcessable(self):
+        '''
+        Returns True if the task is CPU bound and can be run in a worker
+        process. Such tasks must be picklable.
+        '''
+        return False
 
     def Run(self, jobContext):
         raise NotImplementedError()
@@ -53,11 +105,14 @@ class Task(object):
 
 class TaskSubtitle(Task):
 
+    __slots__ = ("__outputPath", "__picCountFactor", "__pics")
+
     def __init__(self, outputPath, picCountFactor, pics):
         Task.__init__(self)
         self.__outputPath = outputPath
         self.__picCountFactor = picCountFactor
         self.__pics = pics
+        self.key = ("Subtitle",)
         self.SetInfo(_(u"generating subtitle"))
 
     def __HasComments(self):
@@ -66,9 +121,6 @@ class TaskSubtitle(Task):
                 return True
         return False
 
-    def GetKey(self):
-        return "subtitle"
-
     def Run(self, jobContext):
         if self.__HasComments():
             st = SubtitleSrt(self.__outputPath,
@@ -77,21 +129,71 @@ class TaskSubtitle(Task):
 
 
 class TaskLoadPic(Task):
-
-    def __init__(self, picture):
+    '''
+    Loads a picture, one instance is shared by all tasks of the picture.
+    '''
+
+    __slots__ = ("pictureSpec", "resolution", "minRectSize")
+
+    # decode pictures at a reduced scale if the rects allow it, disabled to
+    # compare with the result of the full scale
+    REDUCED_DECODE = True
+
+    def __init__(self, pictureSpec, resolution, minRectSize=None):
+        '''
+        :param pictureSpec: the PictureSpec to load
+        :param resolution: the output resolution
+        :param minRectSize: the size of the smallest rect that is cropped
+                            from the picture, by default the smaller one of
+                            start and target rect
+        '''
         Task.__init__(self)
-        self.picture = picture
+        self.pictureSpec = pictureSpec
+        self.resolution = resolution
 
-    def GetKey(self):
-        return 'LoadPic_{}'.format(
-            self.picture.GetKey())
+        if not TaskLoadPic.REDUCED_DECODE:
+            self.minRectSize = None
+        elif minRectSize is not None:
+            self.minRectSize = minRectSize
+        else:
+            # the motion path interpolates monotonic between start and target
+            # rect, so the smallest rect decides about the needed source scale
+            startRect = pictureSpec.GetStartRect()
+            targetRect = pictureSpec.GetTargetRect()
+            self.minRectSize = (min(startRect[2], targetRect[2]),
+                                min(startRect[3], targetRect[3]))
+
+        self.key = ("LoadPic", pictureSpec.GetKey(),
+                    resolution, self.minRectSize)
+
+    def IsProcessable(self):
+        return True
+
+    def Run(self, jobContext):
+        return PILBackend.GetImagePyramid(self.pictureSpec, self.resolution,
+                                          self.minRectSize,
+                                          DecodedImageCache())
+
+
+class TaskLoadSequencePic(TaskLoadPic):
+    '''
+    Loads a file of a time lapse sequence. A file is only needed by its own
+    frames and the transitions to its neighbours, so it is not kept in the
+    DecodedImageCache, which would fill up with files that are never used
+    again.
+    '''
+
+    __slots__ = ()
 
     def Run(self, jobContext):
-        return PILBackend.GetImage(self.picture)
+        return PILBackend.GetImagePyramid(self.pictureSpec, self.resolution,
+                                          self.minRectSize)
 
 
 class TaskImaging(Task):
 
+    __slots__ = ("resolution", "draft")
+
     def __init__(self, resolution):
         Task.__init__(self)
         self.resolution = resolution
@@ -100,19 +202,24 @@ class TaskImaging(Task):
     def SetDraft(self, value):
         self.draft = value
 
+    def IsProcessable(self):
+        return True
+
 
 class TaskCropResize(TaskImaging):
 
-    def __init__(self, picture, rect, resolution):
-        TaskImaging.__init__(self, resolution)
-        self.picture = picture
-        self.rect = rect
-        self.taskLoadPic = TaskLoadPic(picture)
-        self.subTasks.append(self.taskLoadPic)
+    __slots__ = ("taskLoadPic", "rect")
 
-    def GetKey(self):
-        return 'CropAndResize_{}_{}_{}'.format(
-            self.taskLoadPic.GetKey(), self.rect, self.resolution)
+    def __init__(self, taskLoadPic, rect):
+        '''
+        :param taskLoadPic: the shared TaskLoadPic of the picture
+        :param rect: the rect to crop from the picture
+        '''
+        TaskImaging.__init__(self, taskLoadPic.resolution)
+        self.taskLoadPic = taskLoadPic
+        self.rect = rect
+        self.subTasks = (taskLoadPic,)
+        self.key = ("CropAndResize", taskLoadPic.GetKey(), rect)
 
     def Run(self, jobContext):
         image = jobContext.ProcessSubTask(self.taskLoadPic)
@@ -125,31 +232,34 @@ class TaskCropResize(TaskImaging):
 
 class TaskTrans(TaskImaging):
 
+    __slots__ = ("kind", "percentage",
+                 "taskLoadPic1", "rect1", "taskLoadPic2", "rect2")
+
     def __init__(self, kind, percentage,
-                 pic1, rect1, pic2, rect2, resolution):
-        TaskImaging.__init__(self, resolution)
+                 taskLoadPic1, rect1, taskLoadPic2, rect2):
+        '''
+        :param kind: the transition kind, see Transitions.GetTransition()
+        :param percentage: the progress of the transition between 0 and 1
+        '''
+        TaskImaging.__init__(self, taskLoadPic1.resolution)
         self.kind = kind
         self.percentage = percentage
-        self.taskPic1 = TaskCropResize(pic1, rect1, resolution)
-        self.taskPic2 = TaskCropResize(pic2, rect2, resolution)
-        self.subTasks.append(self.taskPic1)
-        self.subTasks.append(self.taskPic2)
-
-    def SetDraft(self, value):
-        TaskImaging.SetDraft(self, value)
-        self.taskPic1.SetDraft(self.draft)
-        self.taskPic2.SetDraft(self.draft)
-
-    def GetKey(self):
-        return 'TaskTrans_{}_{}_{}_{}'.format(
-            self.kind, self.percentage,
-            self.taskPic1.GetKey(), self.taskPic2.GetKey())
+        self.taskLoadPic1 = taskLoadPic1
+        self.rect1 = rect1
+        self.taskLoadPic2 = taskLoadPic2
+        self.rect2 = rect2
+        # the transition crops the pictures itself, so it can composite
+        # into its own frames and render only the visible parts
+        self.subTasks = (taskLoadPic1, taskLoadPic2)
+        self.key = ("TaskTrans", kind, percentage,
+                    taskLoadPic1.GetKey(), rect1,
+                    taskLoadPic2.GetKey(), rect2)
 
     def Run(self, jobContext):
-        image1 = jobContext.ProcessSubTask(self.taskPic1)
-        image2 = jobContext.ProcessSubTask(self.taskPic2)
-        img = PILBackend.Transition(self.kind,
-                                    image1, image2,
-                                    self.percentage)
-
-        return img
+        image1 = jobContext.ProcessSubTask(self.taskLoadPic1)
+        image2 = jobContext.ProcessSubTask(self.taskLoadPic2)
+        return GetTransition(self.kind).Render(image1, self.rect1,
+                                               image2, self.rect2,
+                                               self.resolution,
+                                               self.percentage,
+                                               self.draft)
@@ -33,12 +33,12 @@ from photofilmstrip.gui.ctrls.PnlDlgHeader import PnlDlgHeader
 from photofilmstrip.gui.HelpViewer import HelpViewer
 from photofilmstrip.gui.DlgRendererProps import DlgRendererProps
 
-[wxID_DLGRENDER, wxID_DLGRENDERCBDRAFT, wxID_DLGRENDERCHOICEFORMAT,
- wxID_DLGRENDERCHOICEPROFILE,
+[wxID_DLGRENDER, wxID_DLGRENDERCBDRAFT, wxID_DLGRENDERCBRESUME,
+ wxID_DLGRENDERCHOICEFORMAT, wxID_DLGRENDERCHOICEPROFILE,
  wxID_DLGRENDERCMDCANCEL, wxID_DLGRENDERCMDHELP,
  wxID_DLGRENDERCMDRENDERERPROPS, wxID_DLGRENDERCMDSTART, wxID_DLGRENDERPNLHDR,
  wxID_DLGRENDERPNLSETTINGS, wxID_DLGRENDERSTFORMAT, wxID_DLGRENDERSTPROFILE,
-] = [wx.NewId() for _init_ctrls in range(12)]
+] = [wx.NewId() for _init_ctrls in range(13)]
 
 
 class DlgRender(wx.Dialog):
@@ -77,6 +77,9 @@ class DlgRender(wx.Dialog):
         parent.AddSpacer(wx.Size(8, 8), border=0, flag=0)
         parent.AddSpacer(wx.Size(8, 8), border=0, flag=0)
         parent.AddWindow(self.cbDraft, 0, border=0, flag=0)
+        parent.AddSpacer(wx.Size(8, 8), border=0, flag=0)
+        parent.AddSpacer(wx.Size(8, 8), border=0, flag=0)
+        parent.AddWindow(self.cbResume, 0, border=0, flag=0)
 
     def _init_coll_sizerSettings_Growables(self, parent):
         # generated method, don't edit
@@ -150,6 +153,11 @@ class DlgRender(wx.Dialog):
             size=wx.Size(-1, -1), style=0)
         self.cbDraft.SetValue(False)
 
+        self.cbResume = wx.CheckBox(id=wxID_DLGRENDERCBRESUME,
+            label=_(u'Resumable'), name=u'cbResume', parent=self.pnlSettings,
+            pos=wx.Point(-1, -1), size=wx.Size(-1, -1), style=0)
+        self.cbResume.SetValue(False)
+
         self.cmdHelp = wx.Button(id=wx.ID_HELP, label=_(u'&Help'),
             name=u'cmdHelp', parent=self, pos=wx.Point(-1, -1),
             size=wx.Size(-1, -1), style=0)
@@ -177,6 +185,7 @@ class DlgRender(wx.Dialog):
         self.pnlHdr.SetBitmap(wx.ArtProvider.GetBitmap('PFS_RENDER_32'))
 
         self.cbDraft.SetToolTipString(_(u"Activate this option to generate a preview. The rendering process will speed up dramatically, but results in lower quality."))
+        self.cbResume.SetToolTipString(_(u"Activate this option to render in segments that are kept if the rendering process is aborted. An aborted rendering process of the same project is continued."))
 
         self.aspectRatio = aspectRatio
         self.__InitProfiles()
@@ -194,6 +203,7 @@ class DlgRender(wx.Dialog):
 
         self.profile = None
         self.draftMode = False
+        self.resume = False
         self.rendererClass = None
 
     def __GetChoiceDataSelected(self, choice):
@@ -270,6 +280,7 @@ class DlgRender(wx.Dialog):
 
         self.profile = profile
         self.draftMode = self.cbDraft.GetValue()
+        self.resume = self.cbResume.GetValue()
 
         self.EndModal(wx.ID_OK)
 
@@ -296,6 +307,9 @@ class DlgRender(wx.Dialog):
     def GetDraftMode(self):
         return self.draftMode
 
+    def GetResume(self):
+        return self.resume
+
     def GetRendererClass(self):
         return self.rendererClass
 
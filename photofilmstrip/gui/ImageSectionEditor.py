@@ -32,6 +32,7 @@ from photofilmstrip.lib.util import Encode
 
 from photofilmstrip.core.Aspect import Aspect
 from photofilmstrip.core import PILBackend
+from photofilmstrip.core.DecodedImageCache import DecodedImageCache
 
 from photofilmstrip.gui.util.ImageCache import ImageCache
 
@@ -612,7 +613,7 @@ class ScaleThread(threading.Thread):
             if self._abort:
                 return
 
-        pilImg = PILBackend.GetImage(self._picture)
+        pilImg = PILBackend.GetImage(self._picture, DecodedImageCache())
         wxImg = wx.ImageFromStream(PILBackend.ImageToStream(pilImg), wx.BITMAP_TYPE_JPEG)
 
         if not self._abort:
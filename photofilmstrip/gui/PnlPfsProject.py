@@ -544,6 +544,7 @@ class PnlPfsProject(PnlEditorPage, Observer):
 
             profile = dlg.GetProfile()
             draftMode = dlg.GetDraftMode()
+            resume = dlg.GetResume()
             rendererClass = dlg.GetRendererClass()
         finally:
             dlg.Destroy()
@@ -551,7 +552,8 @@ class PnlPfsProject(PnlEditorPage, Observer):
         ar = ActionRender(project,
                           profile,
                           rendererClass,
-                          draftMode)
+                          draftMode,
+                          resume=resume)
         try:
             ar.Execute()
             renderJob = ar.GetRenderJob()
@@ -0,0 +1,145 @@
+# encoding: UTF-8
+
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+
+from _multiprocessing import Connection
+from multiprocessing.reduction import send_handle, recv_handle
+
+from photofilmstrip.lib.common.Singleton import Singleton
+
+
+class ForkServer(Singleton):
+    '''
+    A process that forks the worker processes on request. A process that
+    forks while other threads are running may copy a lock that is held by
+    one of them, e.g. a logging lock, and the child deadlocks on it. The
+    server is started while the application has only the main thread, so it
+    can fork safely at any time later, e.g. to replace a dead worker process
+    during a render.
+
+    The child ends of the connections are passed to the server as file
+    descriptors, so the children talk to the requesting process directly.
+    '''
+
+    def __init__(self):
+        self.__conn = None
+        self.__process = None
+        self.__lock = threading.Lock()
+
+        self.__logger = logging.getLogger("ForkServer")
+
+    def Start(self):
+        '''
+        Starts the server process, does nothing if it is running already.
+        Must be called before threads are started.
+        '''
+        if self.__process is not None:
+            return
+        if threading.active_count() > 1:
+            self.__logger.warning("starting while %s threads are running",
+                                  threading.active_count())
+
+        self.__conn, serverConn = multiprocessing.Pipe()
+        self.__process = multiprocessing.Process(target=_ServerMain,
+                                                 name="fork-server",
+                                                 args=(serverConn,))
+        self.__process.daemon = True
+        self.__process.start()
+        serverConn.close()
+
+    def IsRunning(self):
+        return self.__process is not None
+
+    def Spawn(self, target, args=()):
+        '''
+        Forks a child process that runs target(conn, *args). Returns a tuple
+        of the connection to the child and its process id.
+        :param target: a picklable function
+        :param args: a tuple of picklable arguments
+        '''
+        conn, childConn = multiprocessing.Pipe()
+        try:
+            with self.__lock:
+                self.__conn.send(("spawn", target, args))
+                send_handle(self.__conn, childConn.fileno(),
+                            self.__process.pid)
+                pid = self.__conn.recv()
+        finally:
+            # only the child keeps its end open, so a dead child is noticed
+            # as end of file
+            childConn.close()
+        return conn, pid
+
+    def Wait(self, pid, timeout=None):
+        '''
+        Waits until a child process exited and returns its exit code like
+        multiprocessing.Process.exitcode, None if the timeout expired.
+        :param pid: the process id returned by Spawn()
+        :param timeout: the time to wait in seconds, None waits without limit
+        '''
+        with self.__lock:
+            self.__conn.send(("wait", pid, timeout))
+            return self.__conn.recv()
+
+
+def _ServerMain(conn):
+    # Ctrl-C is handled by the parent process, it ends the children
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while 1:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            # the parent process is gone
+            break
+        if msg[0] == "spawn":
+            fd = recv_handle(conn)
+            pid = os.fork()
+            if pid == 0:
+                conn.close()
+                _ChildMain(fd, msg[1], msg[2])
+            os.close(fd)
+            conn.send(pid)
+        elif msg[0] == "wait":
+            conn.send(_Wait(msg[1], msg[2]))
+
+
+def _ChildMain(fd, target, args):
+    exitCode = 0
+    try:
+        target(Connection(fd), *args)
+    except BaseException:  # IGNORE:W0703
+        traceback.print_exc()
+        exitCode = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # skip the exit handlers of the server process
+        os._exit(exitCode)  # pylint: disable=protected-access
+
+
+def _Wait(pid, timeout):
+    if timeout is None:
+        flags = 0
+    else:
+        flags = os.WNOHANG
+        deadline = time.time() + timeout
+    while 1:
+        try:
+            wpid, status = os.waitpid(pid, flags)
+        except OSError:
+            # not a child of the server or already reaped
+            return None
+        if wpid == pid:
+            if os.WIFSIGNALED(status):
+                return -os.WTERMSIG(status)
+            return os.WEXITSTATUS(status)
+        if time.time() >= deadline:
+            return None
+        time.sleep(0.01)
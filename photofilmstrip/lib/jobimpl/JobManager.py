@@ -8,9 +8,11 @@ import threading
 from photofilmstrip.lib.common.Singleton import Singleton
 from photofilmstrip.lib.DestructionManager import Destroyable
 
+from .ForkServer import ForkServer
 from .IVisualJobManager import IVisualJobManager
 from .LogVisualJobManager import LogVisualJobManager
 from .Worker import Worker, WorkerAbortSignal
+from .ProcessWorker import ProcessWorker
 from .JobAbortedException import JobAbortedException
 
 
@@ -141,7 +143,14 @@ class JobManager(Singleton, Destroyable):
         if len(self.__visuals) == 0:
             self.__visuals.append(self.__defaultVisual)
 
-    def Init(self, workerCtxGroup=None, workerCount=None):
+    def Init(self, workerCtxGroup=None, workerCount=None, useProcesses=False):
+        '''
+        Creates the workers for the given context group.
+        :param workerCtxGroup: the context group id
+        :param workerCount: number of workers, defaults to the cpu count
+        :param useProcesses: if True each worker delegates the execution of
+                             CPU bound targets to its own child process
+        '''
         if workerCtxGroup is None:
             workerCtxGroup = JobManager.DEFAULT_CTXGROUP_ID
         if workerCount is None:
@@ -154,7 +163,10 @@ class JobManager(Singleton, Destroyable):
         i = 0
         while i < workerCount:
             self.__logger.debug("creating worker for group %s", workerCtxGroup)
-            worker = Worker(self, workerCtxGroup, i)
+            if useProcesses:
+                worker = ProcessWorker(self, workerCtxGroup, i)
+            else:
+                worker = Worker(self, workerCtxGroup, i)
             workers.append(worker)
 
             i += 1
@@ -162,9 +174,18 @@ class JobManager(Singleton, Destroyable):
         jcGroup = _JobCtxGroup(workers)
         self.__jobCtxGroups[workerCtxGroup] = jcGroup
 
+        if useProcesses:
+            # all processes are created before the threads are started
+            ForkServer().Start()
+            for worker in workers:
+                worker.StartProcess()
+
         for worker in workers:
             worker.start()
 
+    def HasGroup(self, workerCtxGroup):
+        return self.__jobCtxGroups.has_key(workerCtxGroup)
+
     def EnqueueContext(self, jobContext):
         if not self.__jobCtxGroups.has_key(jobContext.GetGroupId()):
             raise RuntimeError("job group %s not available" % jobContext.GetGroupId())
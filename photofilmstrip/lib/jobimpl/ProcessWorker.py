@@ -0,0 +1,269 @@
+# encoding: UTF-8
+
+import collections
+import logging
+import os
+import signal
+import sys
+import traceback
+import weakref
+
+from . import SharedMemory
+from .ForkServer import ForkServer
+from .Worker import Worker
+
+
+class ProcessWorker(Worker):
+    '''
+    A worker thread that owns a child process. The workloads are still
+    fetched and processed by the thread, but targets passed to Execute() are
+    run inside the child process, so CPU bound python code is not limited by
+    the GIL. Method calls of the child on its job context are forwarded to the
+    real job context in this process.
+
+    Large results are moved between the processes through shared memory, the
+    files are kept in a directory of the worker that is removed when the
+    worker stops. Objects sent to the child are memorized, so the child
+    receives e.g. a decoded picture only once even if many targets need it.
+
+    The child processes are forked by the ForkServer, StartProcess() must be
+    called before the thread is started. If the child process dies, e.g. by
+    a crash of a native library, it is replaced by a new one and the target
+    that was running fails.
+    '''
+
+    MEMO_SIZE = 2
+
+    def __init__(self, jobManager, ctxGroupId, num):
+        Worker.__init__(self, jobManager, ctxGroupId, num)
+        self.__conn = None
+        self.__pid = None
+        self.__memo = None
+        self.__sharedDir = SharedMemory.CreateDirectory(
+            "pfs-{0}-".format(self.getName()))
+
+        self.__logger = logging.getLogger("ProcessWorker")
+
+    def StartProcess(self):
+        '''
+        Creates the child process.
+        '''
+        self.__conn, self.__pid = ForkServer().Spawn(_ChildMain,
+                                                     (self.__sharedDir,))
+        self.__memo = _TransferMemo(ProcessWorker.MEMO_SIZE)
+
+    def __RestartChild(self):
+        self.__conn.close()
+        exitCode = ForkServer().Wait(self.__pid, 1)
+        if exitCode is None:
+            try:
+                os.kill(self.__pid, signal.SIGTERM)
+            except OSError:
+                pass
+            exitCode = ForkServer().Wait(self.__pid)
+        self.__logger.warning("<%s> child process exited with %s, restarting",
+                              self.getName(), exitCode)
+        # drop the files of the messages that were not received
+        SharedMemory.RemoveDirectory(self.__sharedDir)
+        self.__sharedDir = SharedMemory.CreateDirectory(
+            "pfs-{0}-".format(self.getName()))
+        SharedMemory.SetDirectory(self.__sharedDir)
+        self.StartProcess()
+
+    def run(self):
+        SharedMemory.SetDirectory(self.__sharedDir)
+        try:
+            Worker.run(self)
+        finally:
+            self.__logger.debug("<%s> stopping child process", self.getName())
+            try:
+                self.__conn.send(("quit",))
+                ForkServer().Wait(self.__pid)
+            except (EOFError, IOError):
+                # already gone
+                pass
+            SharedMemory.RemoveDirectory(self.__sharedDir)
+
+    def Execute(self, target, jobContext):
+        '''
+        Runs target.Run() inside the child process and returns its result.
+        Must be called from this worker thread.
+        :param target: a picklable object with a Run(jobContext) method
+        :param jobContext: the job context the calls of the child are
+                           forwarded to
+        '''
+        try:
+            return self.__Execute(target, jobContext)
+        except (EOFError, IOError), exc:
+            # the connection to the child is broken, it died
+            self.__RestartChild()
+            raise RuntimeError("worker process died while running %s: %s" %
+                               (target, exc))
+
+    def __Execute(self, target, jobContext):
+        self.__conn.send(("run", target, self.__memo.TakeReleased()))
+        while 1:
+            msg = self.__conn.recv()
+            if msg[0] == "call":
+                self.__HandleCall(jobContext, msg[1], msg[2])
+            elif msg[0] == "result":
+                return SharedMemory.Unpack(msg[1])
+            elif msg[0] == "error":
+                self.__logger.error("<%s> %s", self.getName(), msg[2])
+                raise msg[1]
+
+    def __HandleCall(self, jobContext, name, args):
+        try:
+            result = getattr(jobContext, name)(*args)
+            self.__conn.send(("return", self.__memo.Pack(result)))
+        except Exception, exc:  # IGNORE:R0703
+            _SendError(self.__conn, exc)
+
+
+class _TransferMemo(object):
+    '''
+    Remembers the last objects sent to the child process. The child keeps
+    the same objects, so a repeated object is sent as a reference only.
+
+    Only weak references are kept, so an object e.g. released by the task
+    result cache is not kept alive by the memo. The child is told to drop
+    the objects that are gone with the next message.
+    '''
+
+    def __init__(self, size):
+        self.__size = size
+        self.__tokens = collections.OrderedDict()
+        self.__nextToken = 0
+        # tokens of collected objects, appended by the weakref callbacks
+        # that may run in any thread
+        self.__released = collections.deque()
+
+    def TakeReleased(self):
+        '''
+        Returns the tokens the child can drop because the objects are gone.
+        '''
+        dropTokens = []
+        while self.__released:
+            dropTokens.append(self.__released.popleft())
+        for key, (token, ref) in self.__tokens.items():
+            if ref() is None:
+                del self.__tokens[key]
+        return dropTokens
+
+    def Pack(self, obj):
+        if obj is None or isinstance(obj, (basestring, int, long, float,
+                                           tuple, list, dict)):
+            return SharedMemory.Pack(obj)
+
+        key = id(obj)
+        if key in self.__tokens:
+            token, ref = self.__tokens[key]
+            # the id may be reused by a new object if the former one is gone
+            if ref() is obj:
+                del self.__tokens[key]
+                self.__tokens[key] = token, ref
+                return _MemoRef(token)
+
+        token = self.__nextToken
+        released = self.__released
+        try:
+            ref = weakref.ref(obj, lambda _ref: released.append(token))
+        except TypeError:
+            # cannot be memorized
+            return SharedMemory.Pack(obj)
+        self.__nextToken += 1
+        self.__tokens.pop(key, None)
+        self.__tokens[key] = token, ref
+
+        dropTokens = self.TakeReleased()
+        while len(self.__tokens) > self.__size:
+            dropTokens.append(self.__tokens.popitem(last=False)[1][0])
+        return _MemoNew(token, SharedMemory.Pack(obj), dropTokens)
+
+
+class _MemoRef(object):
+
+    def __init__(self, token):
+        self.token = token
+
+
+class _MemoNew(_MemoRef):
+
+    def __init__(self, token, value, dropTokens):
+        _MemoRef.__init__(self, token)
+        self.value = value
+        self.dropTokens = dropTokens
+
+
+class _ChildJobContext(object):
+    '''
+    Stands in for the job context inside the child process. Every method call
+    is forwarded to the job context of the parent process.
+    '''
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._memo = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def _Call(*args):
+            return self._Call(name, args)
+        return _Call
+
+    def _Call(self, name, args):
+        self._conn.send(("call", name, args))
+        while 1:
+            msg = self._conn.recv()
+            if msg[0] == "run":
+                self._Drop(msg[2])
+                self._Run(msg[1])
+            elif msg[0] == "return":
+                return self._Unpack(msg[1])
+            elif msg[0] == "error":
+                raise msg[1]
+
+    def _Drop(self, tokens):
+        for token in tokens:
+            self._memo.pop(token, None)
+
+    def _Unpack(self, obj):
+        if isinstance(obj, _MemoNew):
+            self._Drop(obj.dropTokens)
+            self._memo[obj.token] = SharedMemory.Unpack(obj.value)
+            return self._memo[obj.token]
+        elif isinstance(obj, _MemoRef):
+            return self._memo[obj.token]
+        else:
+            return SharedMemory.Unpack(obj)
+
+    def _Run(self, target):
+        try:
+            result = target.Run(self)
+            self._conn.send(("result", SharedMemory.Pack(result)))
+        except Exception, exc:  # IGNORE:R0703
+            _SendError(self._conn, exc)
+
+
+def _SendError(conn, exc):
+    tb = "Traceback (within process):\n" + \
+         "".join(traceback.format_tb(sys.exc_info()[2]))
+    try:
+        conn.send(("error", exc, tb))
+    except Exception:  # IGNORE:R0703
+        # the exception itself cannot be pickled
+        conn.send(("error", RuntimeError(str(exc)), tb))
+
+
+def _ChildMain(conn, sharedDir):
+    SharedMemory.SetDirectory(sharedDir)
+    ctx = _ChildJobContext(conn)
+    while 1:
+        msg = conn.recv()
+        if msg[0] == "quit":
+            break
+        elif msg[0] == "run":
+            ctx._Drop(msg[2])  # pylint: disable=protected-access
+            ctx._Run(msg[1])  # pylint: disable=protected-access
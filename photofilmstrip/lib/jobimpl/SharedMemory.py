@@ -0,0 +1,122 @@
+# encoding: UTF-8
+
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+# results smaller than this are simply pickled
+MIN_SHARED_SIZE = 64 * 1024
+
+if os.path.isdir("/dev/shm"):
+    SHARED_DIR = "/dev/shm"
+else:
+    SHARED_DIR = tempfile.gettempdir()
+
+_local = threading.local()
+
+
+def CreateDirectory(prefix="pfs-"):
+    '''
+    Creates a directory for the files of the SharedBuffers. Files that are
+    never read, e.g. because the receiving process died, are removed together
+    with the directory by RemoveDirectory().
+    '''
+    return tempfile.mkdtemp(prefix=prefix, dir=SHARED_DIR)
+
+
+def RemoveDirectory(directory):
+    shutil.rmtree(directory, True)
+
+
+def SetDirectory(directory):
+    '''
+    Sets the directory of the SharedBuffers created by the current thread,
+    None for SHARED_DIR.
+    '''
+    _local.directory = directory
+
+
+class SharedBuffer(object):
+    '''
+    Transfers a byte string to another process through a memory backed file.
+    Only the name of the file is pickled. The file is removed by the receiver
+    when the data is read, so each SharedBuffer must be read exactly once.
+    '''
+
+    def __init__(self, data):
+        directory = getattr(_local, "directory", None) or SHARED_DIR
+        fd, self.path = tempfile.mkstemp(prefix="pfs-", dir=directory)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        self.length = len(data)
+
+    def _Map(self):
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            return mmap.mmap(fd, self.length, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+            os.remove(self.path)
+
+    def Read(self):
+        mm = self._Map()
+        try:
+            return mm[:]
+        finally:
+            mm.close()
+
+
+class SharedImage(SharedBuffer):
+    '''
+    Transfers the pixel data of a PIL image through a memory backed file.
+    '''
+
+    def __init__(self, pilImg):
+        SharedBuffer.__init__(self, pilImg.tobytes())
+        self.mode = pilImg.mode
+        self.size = pilImg.size
+
+    def Read(self):
+        mm = self._Map()
+        # frombuffer copies the data if the memory layout does not match,
+        # otherwise the image keeps a reference to the mapping
+        return Image.frombuffer(self.mode, self.size, mm,
+                                "raw", self.mode, 0, 1)
+
+
+def Pack(obj):
+    '''
+    Replaces large byte strings and PIL images with a shared memory
+    representation before the object is sent to another process. The items
+    of a tuple are replaced as well.
+    '''
+    if isinstance(obj, str) and len(obj) >= MIN_SHARED_SIZE:
+        return SharedBuffer(obj)
+    elif Image is not None and isinstance(obj, Image.Image):
+        return SharedImage(obj)
+    elif isinstance(obj, tuple):
+        return tuple(Pack(item) for item in obj)
+    else:
+        return obj
+
+
+def Unpack(obj):
+    '''
+    Counterpart of Pack() that must be called by the receiving process.
+    '''
+    if isinstance(obj, SharedBuffer):
+        return obj.Read()
+    elif isinstance(obj, tuple):
+        return tuple(Unpack(item) for item in obj)
+    else:
+        return obj
@@ -0,0 +1,106 @@
+# encoding: UTF-8
+
+import json
+import os
+import threading
+import time
+
+from photofilmstrip.lib.common.Singleton import Singleton
+
+
+class Tracer(Singleton):
+    '''
+    Records a timeline of the activity of the worker threads, e.g. the
+    workloads, the tasks and the feeding of the encoder. The timeline is
+    written in the Chrome trace event format, which can be opened with
+    chrome://tracing or https://ui.perfetto.dev.
+
+    The tracer is disabled by default. Callers check IsEnabled() before
+    they take the time, so a disabled tracer costs only this check.
+    '''
+
+    def __init__(self):
+        self.__enabled = False
+        self.__epoch = time.time()
+        self.__events = []
+        self.__threadNames = {}
+        self.__pid = os.getpid()
+
+    def Enable(self, value=True):
+        '''
+        Enables or disables the recording, enabling discards the events
+        recorded before.
+        '''
+        if value:
+            self.__epoch = time.time()
+            self.__events = []
+            self.__threadNames = {}
+        self.__enabled = value
+
+    def IsEnabled(self):
+        return self.__enabled
+
+    @staticmethod
+    def Now():
+        '''
+        Returns the start time of an event for AddComplete().
+        '''
+        return time.time()
+
+    def AddComplete(self, name, category, startTime, args=None):
+        '''
+        Records an event that started at startTime and ends now.
+        :param name: the name of the event
+        :param category: the category of the event, e.g. "task"
+        :param startTime: the value of Now() at the beginning of the event
+        :param args: an optional dictionary that is shown with the event
+        '''
+        endTime = time.time()
+        event = {"name": name,
+                 "cat": category,
+                 "ph": "X",
+                 "ts": (startTime - self.__epoch) * 1e6,
+                 "dur": (endTime - startTime) * 1e6,
+                 "pid": self.__pid,
+                 "tid": self.__GetThreadId()}
+        if args:
+            event["args"] = args
+        # list.append is atomic, no lock needed
+        self.__events.append(event)
+
+    def AddInstant(self, name, category, args=None):
+        '''
+        Records an event without duration.
+        '''
+        event = {"name": name,
+                 "cat": category,
+                 "ph": "i",
+                 "s": "t",
+                 "ts": (time.time() - self.__epoch) * 1e6,
+                 "pid": self.__pid,
+                 "tid": self.__GetThreadId()}
+        if args:
+            event["args"] = args
+        self.__events.append(event)
+
+    def __GetThreadId(self):
+        thread = threading.current_thread()
+        tid = thread.ident
+        if tid not in self.__threadNames:
+            self.__threadNames[tid] = thread.getName()
+        return tid
+
+    def Write(self, filename):
+        '''
+        Writes the recorded events as Chrome trace JSON file.
+        '''
+        events = list(self.__events)
+        for tid, name in self.__threadNames.items():
+            events.append({"name": "thread_name",
+                           "ph": "M",
+                           "pid": self.__pid,
+                           "tid": tid,
+                           "args": {"name": name}})
+        with open(filename, "w") as fd:
+            json.dump({"traceEvents": events,
+                       "displayTimeUnit": "ms"}, fd)
@@ -10,6 +10,7 @@ from .IJobContext import IWorker
 from .IWorkLoad import IWorkLoad
 from .ResultObject import ResultObject
 from .JobAbortedException import JobAbortedException
+from .Tracer import Tracer
 
 
 class Worker(threading.Thread, IWorker):
@@ -56,11 +57,19 @@ class Worker(threading.Thread, IWorker):
         self.__logger.debug("<%s> Worker gone...", self.getName())
 
     def __ProcessWorkLoad(self, jobContext, workLoad):
+        # checked once, these messages are written for every work load
+        debug = self.__logger.isEnabledFor(logging.DEBUG)
+        tracer = Tracer() if Tracer().IsEnabled() else None
+        if tracer:
+            startTime = tracer.Now()
+
         ro = ResultObject(workLoad)
         try:
-            self.__logger.debug("<%s> processing work load %s", self.getName(), workLoad)
+            if debug:
+                self.__logger.debug("<%s> processing work load %s", self.getName(), workLoad)
             ro.result = workLoad._Execute(jobContext)  # IGNORE:W0212
-            self.__logger.debug("<%s> execution done, result = %s", self.getName(), ro.result)
+            if debug:
+                self.__logger.debug("<%s> execution done, result = %s", self.getName(), ro.result)
         except Exception, inst:  # IGNORE:R0703
             self.__logger.error("<%s> job exception: %s", self.getName(), inst, exc_info=1)
             ro.exception = inst
@@ -69,13 +78,25 @@ class Worker(threading.Thread, IWorker):
         if jobContext.IsAborted():
             ro.exception = JobAbortedException()
 
+        if tracer:
+            getKey = getattr(workLoad, "GetKey", None)
+            tracer.AddComplete(workLoad.__class__.__name__, "workload",
+                               startTime,
+                               {"key": repr(getKey())} if getKey else None)
+            startTime = tracer.Now()
+
         try:
-            self.__logger.debug("<%s> pushing result %s", self.getName(), workLoad)
+            if debug:
+                self.__logger.debug("<%s> pushing result %s", self.getName(), workLoad)
             jobContext.PushResult(ro)
-            self.__logger.debug("<%s> result pushed %s", self.getName(), workLoad)
+            if debug:
+                self.__logger.debug("<%s> result pushed %s", self.getName(), workLoad)
         except Exception, inst:  # IGNORE:R0703
             self.__logger.error("<%s> push result exception: %s", self.getName(), inst, exc_info=1)
 
+        if tracer:
+            tracer.AddComplete("PushResult", "workload", startTime)
+
 
 class WorkerAbortSignal(Exception):
     pass